@@ -0,0 +1,289 @@
+'''
+Approximate token counts for every exported chat log and agent log in the scenarios.
+
+Logs are found at:
+  <category>/<task>/<editor>_<model>/chat.json   (VSCode "Chat: Export Chat")
+  <category>/<task>/<editor>_<model>/chat.md     (Cursor, exported with SpecStory)
+  <category>/<task>/run_<agent>_<timestamp>/log.txt   (CLI agents, written by run_all.py)
+
+Per-file results are cached in an SQLite index keyed by path, modification time and content hash,
+so reruns only parse logs that are new or have changed.
+'''
+from pathlib import Path
+import argparse
+import codecs
+import hashlib
+import json
+import os
+import re
+import sqlite3
+
+CHUNK_SIZE = 1 << 16
+
+try:
+    import tiktoken
+    encoding = tiktoken.get_encoding('o200k_base')
+    TOKENIZER = 'o200k_base'
+
+    def count_tokens(text):
+        return len(encoding.encode(text, disallowed_special=()))
+except ImportError:
+    TOKENIZER = 'chars/4'
+
+    def count_tokens(text):
+        # Rough approximation used when tiktoken is not installed
+        return (len(text) + 3) // 4
+
+
+class JsonStringScanner:
+    '''
+    Incremental JSON scanner that yields every string value together with the object keys leading to it.
+    Only the container stack and the string being read are held in memory, so a log of any size
+    can be fed in fixed-size chunks.
+    '''
+
+    special = re.compile(r'[\\"]')
+
+    def __init__(self):
+        self.stack = []  # ['o', key, expecting_key] for objects, ['a'] for arrays
+        self.in_string = False
+        self.pending_escape = False
+        self.parts = []
+
+    def path(self):
+        return tuple(frame[1] for frame in self.stack if frame[0] == 'o')
+
+    def feed(self, text):
+        i, n = 0, len(text)
+        while i < n:
+            if self.in_string:
+                if self.pending_escape:
+                    self.parts.append(text[i])
+                    self.pending_escape = False
+                    i += 1
+                    continue
+                m = self.special.search(text, i)
+                if m is None:
+                    self.parts.append(text[i:])
+                    break
+                if m.group() == '\\':
+                    if m.end() < n:
+                        self.parts.append(text[i:m.end() + 1])
+                        i = m.end() + 1
+                    else:
+                        self.parts.append(text[i:])
+                        self.pending_escape = True
+                        i = n
+                    continue
+                self.parts.append(text[i:m.start()])
+                i = m.end()
+                self.in_string = False
+                value = json.loads('"' + ''.join(self.parts) + '"')
+                top = self.stack[-1] if self.stack else None
+                if top is not None and top[0] == 'o' and top[2]:
+                    top[1] = value
+                else:
+                    yield self.path(), value
+                continue
+
+            c = text[i]
+            if c == '"':
+                self.in_string = True
+                self.parts = []
+            elif c == '{':
+                self.stack.append(['o', None, True])
+            elif c == '[':
+                self.stack.append(['a'])
+            elif c in '}]':
+                self.stack.pop()
+            elif c == ':':
+                self.stack[-1][2] = False
+            elif c == ',':
+                if self.stack[-1][0] == 'o':
+                    self.stack[-1][2] = True
+            i += 1
+
+
+def parse_vscode_chat(chunks):
+    # Which parts of an exported VSCode chat count as model input and model output
+    input_prefixes = [('requests', 'message', 'text'),
+                      ('requests', 'variableData'),
+                      ('requests', 'result', 'metadata', 'toolCallResults')]
+    output_paths = {('requests', 'response', 'value'),
+                    ('requests', 'result', 'metadata', 'toolCallRounds', 'response'),
+                    ('requests', 'result', 'metadata', 'toolCallRounds', 'toolCalls', 'arguments')}
+    scanner = JsonStringScanner()
+    counts = {'input_tokens': 0, 'output_tokens': 0, 'model': None}
+    for chunk in chunks:
+        for path, value in scanner.feed(chunk):
+            if path == ('requests', 'modelId'):
+                counts['model'] = value.split('/')[-1]
+            elif path in output_paths:
+                counts['output_tokens'] += count_tokens(value)
+            elif any(path[:len(prefix)] == prefix for prefix in input_prefixes):
+                counts['input_tokens'] += count_tokens(value)
+    return counts
+
+
+def parse_cursor_chat(chunks):
+    # SpecStory exports alternate between "_**User**_" and "_**Assistant**_" sections
+    counts = {'input_tokens': 0, 'output_tokens': 0, 'model': None}
+    role = None
+    for line in lines_of(chunks):
+        if line.startswith('_**User**_'):
+            role = 'input_tokens'
+        elif line.startswith('_**Assistant**_'):
+            role = 'output_tokens'
+        elif role is not None:
+            counts[role] += count_tokens(line)
+    return counts
+
+
+def parse_agent_log(chunks):
+    # The CLI logs only contain what the agent printed, so everything counts as output
+    counts = {'input_tokens': 0, 'output_tokens': 0, 'model': None}
+    for line in lines_of(chunks):
+        counts['output_tokens'] += count_tokens(line)
+    return counts
+
+
+def lines_of(chunks):
+    rest = ''
+    for chunk in chunks:
+        lines = (rest + chunk).split('\n')
+        rest = lines.pop()
+        yield from lines
+    if rest:
+        yield rest
+
+
+parsers = {
+    'chat.json': ('vscode', parse_vscode_chat),
+    'chat.md': ('cursor', parse_cursor_chat),
+    'log.txt': (None, parse_agent_log),
+}
+
+
+def discover(root):
+    for name in parsers:
+        yield from Path(root).glob(f'*/task*/*/{name}')
+
+
+def describe(root, path):
+    # <category>/<task>/<editor>_<model>/<file> or <category>/<task>/run_<agent>_<timestamp>/log.txt
+    rel = path.relative_to(root)
+    scenario = '/'.join(rel.parts[:2])
+    run_dir = rel.parts[2]
+    editor, parse = parsers[path.name]
+    if run_dir.startswith('run_'):
+        editor = run_dir.split('_')[1]
+        model = 'default'
+    else:
+        prefix, _, model = run_dir.partition('_')
+        editor = editor or prefix
+        model = model or 'unknown'
+    return scenario, editor, model, parse
+
+
+def read_chunks(path, hasher):
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(CHUNK_SIZE)
+            if not data:
+                break
+            hasher.update(data)
+            yield data
+
+
+def decode(chunks):
+    # Decode incrementally, so that multi-byte characters split across chunks are handled
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+    for chunk in chunks:
+        yield decoder.decode(chunk)
+    yield decoder.decode(b'', final=True)
+
+
+def file_hash(path):
+    hasher = hashlib.sha256()
+    for _ in read_chunks(path, hasher):
+        pass
+    return hasher.hexdigest()
+
+
+def open_index(db_path):
+    db = sqlite3.connect(db_path)
+    db.execute('''CREATE TABLE IF NOT EXISTS files (
+                    path TEXT PRIMARY KEY,
+                    mtime_ns INTEGER,
+                    size INTEGER,
+                    sha256 TEXT,
+                    tokenizer TEXT,
+                    scenario TEXT,
+                    editor TEXT,
+                    model TEXT,
+                    input_tokens INTEGER,
+                    output_tokens INTEGER)''')
+    return db
+
+
+def update_index(db, root, verbose=False):
+    root = Path(root).absolute()
+    seen = set()
+    parsed = 0
+    for path in discover(root):
+        key = str(path.relative_to(root))
+        seen.add(key)
+        st = path.stat()
+        row = db.execute('SELECT mtime_ns, size, sha256, tokenizer FROM files WHERE path = ?', (key,)).fetchone()
+        if row is not None and row[3] == TOKENIZER:
+            if row[0] == st.st_mtime_ns and row[1] == st.st_size:
+                continue
+            # The file was touched; only reparse it if the contents actually changed
+            if row[2] == file_hash(path):
+                db.execute('UPDATE files SET mtime_ns = ?, size = ? WHERE path = ?', (st.st_mtime_ns, st.st_size, key))
+                continue
+
+        scenario, editor, model, parse = describe(root, path)
+        hasher = hashlib.sha256()
+        counts = parse(decode(read_chunks(path, hasher)))
+        if verbose:
+            print(f"Indexed {key}: {counts['input_tokens']} input, {counts['output_tokens']} output tokens")
+        db.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                   (key, st.st_mtime_ns, st.st_size, hasher.hexdigest(), TOKENIZER,
+                    scenario, editor, counts['model'] or model,
+                    counts['input_tokens'], counts['output_tokens']))
+        parsed += 1
+
+    # Forget logs that have been deleted since the last run
+    for (key,) in db.execute('SELECT path FROM files').fetchall():
+        if key not in seen:
+            db.execute('DELETE FROM files WHERE path = ?', (key,))
+    db.commit()
+    return parsed, len(seen)
+
+
+def report(db):
+    rows = db.execute('''SELECT scenario, editor, model, COUNT(*), SUM(input_tokens), SUM(output_tokens)
+                         FROM files GROUP BY scenario, editor, model ORDER BY scenario, editor, model''').fetchall()
+    header = ('scenario', 'editor', 'model', 'logs', 'input tokens', 'output tokens')
+    rows = [header] + [tuple(str(cell) for cell in row) for row in rows]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    for row in rows:
+        print('  '.join(cell.ljust(width) for cell, width in zip(row, widths)))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Approximate token counts for every scenario/model/editor')
+    parser.add_argument('--root',       type=str,   default=os.path.dirname(os.path.abspath(__file__)), help='Root of the scenarios')
+    parser.add_argument('--db',         type=str,   default='cost_index.sqlite',    help='Path of the index')
+    parser.add_argument('--rebuild',    action='store_true',                        help='Discard the index and reparse every log')
+    parser.add_argument('--verbose',    action='store_true',                        help='Print every log that is parsed')
+    args = parser.parse_args()
+
+    if args.rebuild and Path(args.db).exists():
+        Path(args.db).unlink()
+    db = open_index(args.db)
+    parsed, total = update_index(db, args.root, verbose=args.verbose)
+    print(f"Parsed {parsed} new or changed logs ({total} indexed, tokenizer: {TOKENIZER})\n")
+    report(db)
@@ -0,0 +1,118 @@
+from models import estimate_tokens
+
+
+def count_tokens(text):
+    return estimate_tokens([{'content': text}])
+
+
+def compact_feedback(text, max_tokens):
+    '''
+    Shorten compiler errors or test logs: runs of identical lines are collapsed into one, and if the
+    text is still longer than `max_tokens`, its middle is cut, keeping the first two thirds and the last third.
+    Whole lines are kept where they fit; the others are cut by characters.
+    '''
+    runs = []
+    for line in text.split('\n'):
+        if runs and runs[-1][0] == line:
+            runs[-1][1] += 1
+        else:
+            runs.append([line, 1])
+    lines = [line if count == 1 else f"{line}  [repeated {count} times]" for line, count in runs]
+    text = '\n'.join(lines)
+    if count_tokens(text) <= max_tokens:
+        return text
+
+    # About 4 characters per token, as in estimate_tokens, less the marker of what was cut
+    max_chars = max(max_tokens * 4 - 40, 0)
+    head, head_chars = [], 0
+    for line in lines:
+        if head_chars + len(line) + 1 > max_chars * 2 // 3:
+            break
+        head.append(line)
+        head_chars += len(line) + 1
+    tail, tail_chars = [], 0
+    for line in reversed(lines[len(head):]):
+        if tail_chars + len(line) + 1 > max_chars // 3:
+            break
+        tail.insert(0, line)
+        tail_chars += len(line) + 1
+    omitted = lines[len(head):len(lines) - len(tail)]
+    # Lines longer than the space that is left are cut by characters, so that a single diagnostic
+    # over the budget is not dropped altogether
+    head_room = max_chars * 2 // 3 - head_chars
+    tail_room = max_chars // 3 - tail_chars
+    if len(omitted) == 1:
+        line = omitted[0]
+        cut = len(line) - head_room - tail_room
+        return '\n'.join(head + [f"{line[:head_room]} [... {cut} characters omitted ...] {line[len(line) - tail_room:]}"] + tail)
+    if not head:
+        head = [omitted[0][:head_room]]
+    if not tail:
+        tail = [omitted[-1][len(omitted[-1]) - tail_room:]]
+    return '\n'.join(head + [f"[... {len(omitted)} lines omitted ...]"] + tail)
+
+
+class ConversationManager:
+    '''
+    The conversation about one function: the translation task, then an attempt and its feedback
+    for every round of repair, sent to the model within a token budget.
+
+    The system prompt, the task and the latest attempt with its feedback are always sent. Earlier
+    attempts are superseded by the latest one, so they are only listed in the task message, each by a
+    one-line summary of how it failed, with consecutive identical failures merged. When the budget is
+    exceeded, the oldest summaries are dropped first, then the latest feedback is cut further.
+    '''
+
+    def __init__(self, system, task, token_budget=8000, max_feedback_tokens=2000):
+        self.system = system
+        self.task = task
+        self.token_budget = token_budget
+        self.max_feedback_tokens = max_feedback_tokens
+        # [response, feedback, summary of the feedback]
+        self.attempts = []
+
+    def add_response(self, response):
+        self.attempts.append([response, None, None])
+
+    def add_feedback(self, feedback, summary):
+        assert self.attempts, "Feedback given before any response"
+        self.attempts[-1][1] = compact_feedback(feedback, self.max_feedback_tokens)
+        self.attempts[-1][2] = summary
+
+    def summaries(self):
+        # One line per run of superseded attempts that failed the same way
+        runs = []
+        for i, (_, _, summary) in enumerate(self.attempts[:-1]):
+            if runs and runs[-1][2] == summary:
+                runs[-1][1] = i + 1
+            else:
+                runs.append([i + 1, i + 1, summary])
+        return [(f"Attempt {first}" if first == last else f"Attempts {first}-{last}") + f": {summary}"
+                for first, last, summary in runs]
+
+    def build(self, summaries, feedback):
+        task = self.task
+        if summaries:
+            task += "\n\nEarlier attempts, which were replaced by the latest one, failed as follows:\n" + \
+                    '\n'.join(f"- {summary}" for summary in summaries)
+        messages = [{'role': 'system', 'content': self.system},
+                    {'role': 'user', 'content': task}]
+        if self.attempts:
+            messages.append({'role': 'assistant', 'content': self.attempts[-1][0]})
+            if feedback is not None:
+                messages.append({'role': 'user', 'content': feedback})
+        return messages
+
+    def messages(self):
+        summaries = self.summaries()
+        feedback = self.attempts[-1][1] if self.attempts else None
+        messages = self.build(summaries, feedback)
+        while estimate_tokens(messages) > self.token_budget and summaries:
+            summaries = summaries[1:]
+            messages = self.build(summaries, feedback)
+        excess = estimate_tokens(messages) - self.token_budget
+        if excess > 0 and feedback is not None:
+            # The task and the latest attempt are needed as they are; the feedback can lose more of its middle
+            feedback = compact_feedback(feedback, max(count_tokens(feedback) - excess, self.max_feedback_tokens // 4))
+            messages = self.build(summaries, feedback)
+        return messages
@@ -0,0 +1,128 @@
+import hashlib
+from contextlib import contextmanager
+from pathlib import Path
+
+from workspace import break_link
+
+
+class Transaction:
+
+    def __init__(self, name=None):
+        self.name = name
+        # {path: content hash of the file before the transaction modified it, or None if it did not exist}
+        self.before = {}
+        # Undo functions for state kept outside of the files, called in reverse order on rollback
+        self.undo = []
+
+
+class Journal:
+    '''
+    Undo log of the files of a workspace, organized as a stack of nested transactions.
+
+    Before a file is modified for the first time in a transaction, `record` keeps its contents
+    in a content-addressed store, so identical versions of a file (such as the same src/main.rs
+    before each attempt at a function) are stored once. Only the files that a transaction
+    modifies are recorded, and a rollback only rewrites those that differ from their recorded version.
+
+    Rolling back a transaction also rolls back the transactions opened after it. Committing one
+    hands its recorded versions to the enclosing transaction, so that rolling back the enclosing
+    transaction still undoes it; committing the outermost transaction makes its changes permanent.
+    '''
+
+    def __init__(self):
+        self.transactions = []
+        self.blobs = {}
+
+    def begin(self, name=None):
+        transaction = Transaction(name)
+        self.transactions.append(transaction)
+        return transaction
+
+    def find(self, name):
+        # The innermost open transaction called `name`, if any
+        for transaction in reversed(self.transactions):
+            if transaction.name == name:
+                return transaction
+        return None
+
+    def record(self, path):
+        # Call before modifying `path`
+        if not self.transactions:
+            return
+        transaction = self.transactions[-1]
+        path = Path(path)
+        if path in transaction.before:
+            return
+        if path.exists():
+            contents = path.read_bytes()
+            digest = hashlib.sha256(contents).hexdigest()
+            self.blobs.setdefault(digest, contents)
+            transaction.before[path] = digest
+        else:
+            transaction.before[path] = None
+
+    def on_rollback(self, undo):
+        # Register the undo function of a change made outside of the files
+        if self.transactions:
+            self.transactions[-1].undo.append(undo)
+
+    def rollback(self, transaction=None):
+        '''
+        Restore the files as they were when `transaction` (by default the innermost one) began,
+        and close it along with every transaction opened after it.
+        '''
+        transaction = transaction or self.transactions[-1]
+        index = self.transactions.index(transaction)
+        for undone in reversed(self.transactions[index:]):
+            for path, digest in undone.before.items():
+                self.restore(path, digest)
+            for undo in reversed(undone.undo):
+                undo()
+        del self.transactions[index:]
+        self.collect()
+
+    def restore(self, path, digest):
+        if digest is None:
+            path.unlink(missing_ok=True)
+            return
+        contents = self.blobs[digest]
+        if path.exists() and hashlib.sha256(path.read_bytes()).hexdigest() == digest:
+            return
+        break_link(path)
+        path.write_bytes(contents)
+
+    def commit(self, transaction=None):
+        '''
+        Close `transaction` (by default the innermost one) and every transaction opened after it,
+        keeping their changes. Committing the earliest of several transactions commits them as one batch.
+        '''
+        transaction = transaction or self.transactions[-1]
+        index = self.transactions.index(transaction)
+        committed = self.transactions[index:]
+        del self.transactions[index:]
+        if self.transactions:
+            parent = self.transactions[-1]
+            for done in committed:
+                for path, digest in done.before.items():
+                    # The earliest recorded version is the one to go back to
+                    parent.before.setdefault(path, digest)
+                parent.undo += done.undo
+        self.collect()
+
+    @contextmanager
+    def transaction(self, name=None):
+        # Committed if the block completes, rolled back if it raises
+        transaction = self.begin(name)
+        try:
+            yield transaction
+        except BaseException:
+            if transaction in self.transactions:
+                self.rollback(transaction)
+            raise
+        if transaction in self.transactions:
+            self.commit(transaction)
+
+    def collect(self):
+        # Drop the stored versions that no open transaction refers to
+        referenced = {digest for transaction in self.transactions for digest in transaction.before.values()}
+        self.blobs = {digest: contents for digest, contents in self.blobs.items() if digest in referenced}
@@ -1,14 +1,29 @@
 import argparse
+import copy
+import glob
 import shutil
 import os
 from pathlib import Path
 import subprocess
 import json
+import re
 import networkx as nx
 import datetime
+import signal
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
 from typing import List, Dict, Tuple
 
-from models import get_model_from_name
+from models import get_model_from_name, CachedGen, ModelException, rate_limit_stats, estimate_tokens
+from workspace import materialize, break_link
+from worktree import WorktreePool
+from traces import traced_functions
+from source_index import SourceIndex
+from journal import Journal
+from conversation import ConversationManager
 
 def prRed(skk): print("\033[91m {}\033[00m" .format(skk))
 def prGreen(skk): print("\033[92m {}\033[00m" .format(skk))
@@ -18,7 +33,11 @@ def prLightPurple(skk): print("\033[94m {}\033[00m" .format(skk))
 def prLightGray(skk): print("\033[97m {}\033[00m" .format(skk))
 
 class CompileException(Exception):
-    pass
+
+    def __init__(self, message, diagnostics=None):
+        super().__init__(message)
+        # Structured compiler errors, see `parse_diagnostic`
+        self.diagnostics = diagnostics or []
 
 class RunException(Exception):
     pass
@@ -45,15 +64,80 @@ def run(command):
     except Exception as e:
         raise RunException(str(e))
 
+def stop_process_group(process):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+def parse_diagnostic(message):
+    '''
+    Turn a rustc JSON diagnostic (the "message" of a cargo "compiler-message") into
+    {'level', 'code', 'message', 'file', 'line', 'column', 'source', 'label', 'notes'}.
+    '''
+    primary = [span for span in message['spans'] if span['is_primary']]
+    span = primary[0] if primary else (message['spans'][0] if message['spans'] else None)
+    return {
+        'level': message['level'],
+        'code': message['code']['code'] if message.get('code') else None,
+        'message': message['message'],
+        'file': span['file_name'] if span else None,
+        'line': span['line_start'] if span else None,
+        'column': span['column_start'] if span else None,
+        'source': span['text'][0]['text'].strip() if span and span['text'] else None,
+        'label': span['label'] if span else None,
+        # Notes and help, which also carry the linker output for link errors
+        'notes': [f"{child['level']}: {child['message']}" for child in message['children']],
+    }
+
+def format_diagnostics(diagnostics):
+    # A compact rendering of the diagnostics, for prompts and logs
+    blocks = []
+    for d in diagnostics:
+        lines = [f"{d['level']}[{d['code']}]: {d['message']}" if d['code'] else f"{d['level']}: {d['message']}"]
+        if d['file'] is not None:
+            lines.append(f"  --> {d['file']}:{d['line']}:{d['column']}")
+        if d['source']:
+            lines.append(f"   | {d['source']}" + (f"  <- {d['label']}" if d['label'] else ''))
+        lines += [f"   = {note}" for note in d['notes']]
+        blocks.append('\n'.join(lines))
+    return '\n\n'.join(blocks)
+
+# Imported by every module of src/translated: the bindings, the other translations and the crate root
+RUST_PRELUDE = "#[allow(unused_imports)]\nuse crate::*;\n"
+
+# Function names that have to be written as raw identifiers (r#name) in Rust
+RUST_KEYWORDS = {'as', 'async', 'await', 'box', 'dyn', 'fn', 'impl', 'in', 'let', 'loop', 'match', 'mod', 'move',
+                 'mut', 'pub', 'ref', 'trait', 'type', 'unsafe', 'use', 'where', 'abstract',
+                 'become', 'final', 'macro', 'override', 'priv', 'typeof', 'unsized', 'virtual', 'yield', 'try', 'gen'}
+
+# Names that cannot be raw identifiers either; their modules are named with a trailing underscore
+RUST_RESERVED = {'crate', 'self', 'Self', 'super', '_'}
+
 class SourceManager:
 
-    def __init__(self, code_dir):
+    def __init__(self, code_dir, target_dir=None, trace_format='binary', rust_layout='modules'):
         self.code_dir = code_dir
         self.c_code_dir = Path(self.code_dir)/'c_src'
+        self.cargo_package = 'foo' # [package] name in rust_wrapper/Cargo.toml
         self.cargo_bin_target = 'foo' # Placeholder
+        # An optional cargo target directory shared with other output directories, so that
+        # dependencies are only built once. Otherwise <code_dir>/target is used.
+        self.target_dir = Path(target_dir).absolute() if target_dir is not None else None
+        # Format of the trace written by parsec's instrumentation: 'text' (instrumented.json) or 'binary' (instrumented.bin)
+        self.trace_format = trace_format
+        # 'single': translations are appended to src/main.rs; 'modules': each one is a module of src/translated
+        self.rust_layout = rust_layout
+        self.translated_dir = Path(self.code_dir, 'src/translated')
         self.bindgen_blocklist = Path(self.code_dir, 'bindgen_blocklist.txt')
         if not self.bindgen_blocklist.exists():
             self.bindgen_blocklist.touch()
+        # Held while the sources are read, or modified and validated, by one of several translation workers
+        self.lock = threading.RLock()
+        # The C sources, edited in memory and written out before each build
+        self.c_sources = SourceIndex(self.c_code_dir)
+        # Undo log of the changes made for the functions being validated
+        self.journal = Journal()
     
     def get_bin_target(self):
 
@@ -113,6 +197,7 @@ class SourceManager:
                 # Found the name line, replace it
                 lines[i] = f'name = "{target}"\n'
                 break
+        break_link(cargo_toml)
         with open(cargo_toml, 'w') as f:
             f.writelines(lines)
         self.cargo_bin_target = target
@@ -128,84 +213,129 @@ class SourceManager:
             raise Exception("Executable not found. Please compile the code first.")
         return executable
     
-    def compile(self, verbose=False):
-        cwd = os.getcwd()
-        cmd = 'cd {} && RUSTFLAGS="-Awarnings" cargo build'.format(self.code_dir)
-
+    def compile(self, verbose=False, max_errors=None):
+        self.run_cargo('build', verbose, max_errors=max_errors)
+
+    def check(self, verbose=False, max_errors=None):
+        # Type-check only: no codegen and no linking against libfoo.a
+        self.run_cargo('check', verbose, max_errors=max_errors)
+
+    def run_cargo(self, subcommand, verbose=False, max_errors=None, timeout=60):
+        '''
+        Run a cargo subcommand with JSON diagnostics, which are parsed as they are emitted.
+        Once `max_errors` distinct errors have been reported in the crate's own sources (src/), cargo is
+        stopped without waiting for the rest of the build.
+        Raises a CompileException carrying the deduplicated errors if the command fails.
+        '''
+        self.flush_sources()
+        cmd = 'cd {} && {}RUSTFLAGS="-Awarnings" exec cargo {} --message-format=json'.format(self.code_dir, self.cargo_env(), subcommand)
+        process = subprocess.Popen(cmd,
+                                   shell=True,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE,
+                                   start_new_session=True)
+
+        def stop():
+            stop_process_group(process)
+
+        # Set by the timer only; the process can also be killed by the OOM killer or from outside
+        timed_out = threading.Event()
+
+        def time_out():
+            timed_out.set()
+            stop()
+
+        # Cargo's own messages (and the output of a failing build script) go to stderr
+        stderr_chunks = []
+        stderr_reader = threading.Thread(target=lambda: stderr_chunks.append(process.stderr.read()), daemon=True)
+        stderr_reader.start()
+        timer = threading.Timer(timeout, time_out)
+        timer.start()
+
+        diagnostics = []
+        seen = set()
+        in_crate = 0
+        stopped_early = False
         try:
-            result = subprocess.run(
-                        cmd,
-                        shell=True,
-                        timeout=60,
-                        stderr=subprocess.STDOUT if verbose else subprocess.PIPE,
-                        stdout=None if verbose else subprocess.PIPE,
-                    )
-            if result.returncode != 0:
-                if not verbose:
-                    compiler_output = result.stderr.decode('utf-8', errors='ignore')
-                else:
-                    compiler_output = result.stdout.decode('utf-8', errors='ignore')
-                raise CompileException(compiler_output)
+            for line in process.stdout:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                if event.get('reason') == 'compiler-artifact' and event.get('executable') and self.target_dir is not None:
+                    self.keep_executable(event['executable'])
+                    continue
+                if event.get('reason') != 'compiler-message' or not event['message']['level'].startswith('error'):
+                    continue
+                if not event['message']['spans'] and event['message']['message'].startswith('aborting due to'):
+                    continue
+                diagnostic = parse_diagnostic(event['message'])
+                key = (diagnostic['code'], diagnostic['message'], diagnostic['file'], diagnostic['line'], diagnostic['column'])
+                if key in seen:
+                    continue
+                seen.add(key)
+                diagnostics.append(diagnostic)
+                if verbose:
+                    prLightGray(event['message']['rendered'])
+                if diagnostic['file'] is not None and diagnostic['file'].startswith('src/'):
+                    in_crate += 1
+                if max_errors and in_crate >= max_errors:
+                    stopped_early = True
+                    stop()
+                    break
+            process.wait()
+        finally:
+            timer.cancel()
+            stderr_reader.join()
 
-        except (subprocess.TimeoutExpired, TimeoutError):
+        if timed_out.is_set() and not stopped_early:
             raise CompileException("Timeout")
-
-        finally:
-            os.chdir(cwd)
+        if stopped_early or process.returncode != 0:
+            if diagnostics:
+                raise CompileException(format_diagnostics(diagnostics), diagnostics)
+            raise CompileException(b''.join(stderr_chunks).decode('utf-8', errors='ignore'))
     
-    def extract_body(self, func):
-        fpath = Path(os.path.join(self.c_code_dir, func['filename']))
-        start_line = func['startLine']
-        start_col = func['startCol']
-        end_line = func['endLine']
-        end_col = func['endCol']
+    def cargo_env(self):
+        env = f'PARSEC_TRACE={self.trace_format} '
+        if self.target_dir is not None:
+            env += f'CARGO_TARGET_DIR="{self.target_dir}" '
+        return env
+
+    def keep_executable(self, executable):
+        # Other output directories build a binary of the same name into a shared target directory.
+        # Cargo still holds the lock on it while it reports the artifact, so the copy is not overwritten midway.
+        local = Path(self.code_dir, 'target/debug', Path(executable).name)
+        local.parent.mkdir(parents=True, exist_ok=True)
+        tmp = local.with_name(local.name + '.tmp')
+        shutil.copy2(executable, tmp)
+        os.replace(tmp, local)
 
-        with open(fpath, 'r') as f:
-            lines = f.readlines()
-        
-        body = lines[start_line-1][start_col-1:]
-        for i in range(start_line, end_line-1):
-            body += lines[i]
-        body += lines[end_line-1][:end_col]
-        return body
+    def extract_body(self, func):
+        with self.lock:
+            return self.c_sources.extract(func)
 
     def insert_translation(self, func, translation):
-
+        # Every change made for `func` is undone by `reset_func`, or kept by `commit_func`
+        self.journal.begin(func['name'])
         self.comment_out_in_c(func)
-        self.insert_in_rust(translation)
+        if self.rust_layout == 'modules':
+            self.insert_in_module(func, translation)
+        else:
+            self.insert_in_rust(translation)
         # Add the function to the bindgen blocklist
-        shutil.copy(self.bindgen_blocklist, self.bindgen_blocklist.with_suffix('.old'))
+        self.journal.record(self.bindgen_blocklist)
+        break_link(self.bindgen_blocklist)
         with open(self.bindgen_blocklist, 'a') as f:
             f.write(f"{func['name']}\n")
     
     def comment_out_in_c(self, func):
+        # Recorded in memory; the file is only rewritten by `flush_sources`
+        self.c_sources.comment_out(func)
+        self.journal.on_rollback(lambda: self.c_sources.restore(func))
 
-        fpath = Path(os.path.join(self.c_code_dir, func['filename']))
-        start_line = func['startLine']
-        start_col = func['startCol']
-        end_line = func['endLine']
-        end_col = func['endCol']
-
-        with open(fpath, 'r') as f:
-            lines = f.readlines()
-
-        old_lines = lines.copy()
-        lines = [line.rstrip() for line in lines]
-
-        # We can't do a multiline comment because C doesn't support nested multiline comments
-        lines[start_line-1] = lines[start_line-1][:start_col-1] + '// ' + lines[start_line-1][start_col-1:]
-        for i in range(start_line, end_line-1):
-            lines[i] = '// ' + lines[i]
-        if lines[end_line-1][end_col:] != '':
-            # Taking advantage of the fact that you can insert a linebreak anywhere in C, for the most part
-            lines[end_line-1] = '// ' + lines[end_line-1][:end_col] + '\n' + lines[end_line-1][end_col:]
-        else:
-            lines[end_line-1] = '// ' + lines[end_line-1]
-        
-        with open(fpath, 'w') as f:
-            f.write('\n'.join(lines))
-        with open(fpath.with_suffix('.old'), 'w') as f:
-            f.write(''.join(old_lines))
+    def flush_sources(self):
+        with self.lock:
+            self.c_sources.flush()
 
     def insert_in_rust(self, translation):
 
@@ -218,7 +348,6 @@ class SourceManager:
         # Read the contents of the main.rs file
         main_rs = Path(self.code_dir, 'src/main.rs')
         contents = main_rs.read_text()
-        old_contents = contents
         lines = contents.split('\n')
 
         inside_attribute = False
@@ -245,64 +374,212 @@ class SourceManager:
         # Insert the function_trans and wrapper at the bottom
         new_contents += '\n' + function_trans + '\n' + wrapper
 
+        self.journal.record(main_rs)
+        break_link(main_rs)
         main_rs.write_text(new_contents)
         # De-duplicate imports
         try:
             run(f'cd {self.code_dir} && rustfmt --config imports_granularity=Crate src/main.rs')
         except:
             prRed("Rustfmt failed. There may be a syntax error in the generated code.")
-
-        with open(main_rs.with_suffix('.old'), 'w') as f:
-            f.write(old_contents)
     
+    def module_name(self, func):
+        # The file name of the module of `func`, without its extension
+        return func['name'] + '_' if func['name'] in RUST_RESERVED else func['name']
+
+    def module_path(self, func):
+        return self.translated_dir/f"{self.module_name(func)}.rs"
+
+    def module_declaration(self, func):
+        module = self.module_name(func)
+        if module in RUST_KEYWORDS:
+            module = f"r#{module}"
+        return f"mod {module};\npub(crate) use {module}::*;\n"
+
+    def insert_in_module(self, func, translation):
+        '''
+        Write the translation of `func` to its own module, src/translated/<name>.rs.
+        The modules are declared in src/translated/mod.rs, and their items are re-exported at the root
+        of the crate, which every module imports. So translations can call each other and use the bindings,
+        and an insertion only writes and formats the new module.
+        '''
+        index = self.translated_dir/'mod.rs'
+        if not index.exists():
+            self.translated_dir.mkdir(exist_ok=True)
+            self.journal.record(index)
+            index.write_text("// One module per translated function\n")
+            main_rs = Path(self.code_dir, 'src/main.rs')
+            self.journal.record(main_rs)
+            break_link(main_rs)
+            with open(main_rs, 'a') as f:
+                f.write("\n\nmod translated;\n#[allow(unused_imports)]\npub(crate) use translated::*;\n")
+
+        imports = translation['imports'] if 'imports' in translation else ''
+        # Top-level items are made visible to the rest of the crate, like they were in a single main.rs,
+        # including functions with qualifiers (const, async, unsafe, extern "C")
+        function_trans = re.sub(r'^((?:(?:const|async|unsafe)\s+)*(?:extern\s+(?:"[^"]*"\s+)?)?(?:fn|struct|enum|union|const|static|type|trait)\b)',
+                                r'pub(crate) \1', translation['func'], flags=re.M)
+        module_rs = self.module_path(func)
+        self.journal.record(module_rs)
+        break_link(module_rs)
+        module_rs.write_text(f"{RUST_PRELUDE}{imports}\n\n{function_trans}\n\n{translation['wrapper']}\n")
+        # De-duplicate imports, in the new module only
+        try:
+            run(f'cd {self.code_dir} && rustfmt --edition 2021 --config imports_granularity=Crate {module_rs.relative_to(self.code_dir)}')
+        except:
+            prRed("Rustfmt failed. There may be a syntax error in the generated code.")
+
+        declaration = self.module_declaration(func)
+        if declaration not in index.read_text():
+            self.journal.record(index)
+            break_link(index)
+            with open(index, 'a') as f:
+                f.write(declaration)
+
     def reset_func(self, func):
         prCyan("Resetting changes.")
-        # Replace the ".rs" and ".c" files with the ".old" files if they exist
-        original_c_file = Path(self.c_code_dir, func['filename'])
-        original_rust_file = Path(self.code_dir, 'src/main.rs')
-        for file in [original_c_file, original_rust_file, self.bindgen_blocklist]:
-            if file.with_suffix('.old').exists():
-                shutil.copy(file.with_suffix('.old'), file)
-                file.with_suffix('.old').unlink()
+        transaction = self.journal.find(func['name'])
+        if transaction is not None:
+            self.journal.rollback(transaction)
+        self.flush_sources()
+
+    def commit_func(self, func):
+        # Keep the changes made for `func`; they can no longer be reset
+        transaction = self.journal.find(func['name'])
+        if transaction is not None:
+            self.journal.commit(transaction)
 
     def cleanup(self):
-        cwd = os.getcwd()
-        os.chdir(self.code_dir)
-        cmd = 'rm -rf target'
+        # Only remove the artifacts of this crate (including its build script outputs),
+        # so that the dependencies do not have to be rebuilt
         try:
-            run(cmd)
-        except RunException as e:
-            # Read e and look for strings that say:
-            # rm: cannot remove '<filename>': Device or resource busy
-            # Get a list of these filenames
-            for line in str(e).split('\n'):
-                if 'cannot remove' in line and "Device or resource busy" in line:
-                    filename = line.split('\'')[1]
-                    try:
-                        run(f'fuser -k {filename}')
-                    except:
-                        pass
-                    try:
-                        run(f'rm -rf {filename}')
-                    except:
-                        pass
-            try:
-                run(cmd)
-            except RunException as e:
-                prRed(f"Failed to fully cleanup {self.code_dir}")
-        os.chdir(cwd)
+            run(f'cd {self.code_dir} && {self.cargo_env()}cargo clean -p {self.cargo_package}')
+            return
+        except RunException:
+            prRed(f"cargo clean failed, removing the artifacts of {self.cargo_package} directly")
+
+        target_dir = self.target_dir or Path(self.code_dir, 'target')
+        patterns = [f'debug/{self.cargo_bin_target}', f'debug/{self.cargo_bin_target}.d'] + \
+                   [f'debug/{subdir}/{name}-*' for subdir in ['deps', 'build', '.fingerprint', 'incremental']
+                                               for name in {self.cargo_package, self.cargo_bin_target}]
+        for pattern in patterns:
+            for path in glob.glob(str(target_dir/pattern)):
+                try:
+                    if os.path.isdir(path) and not os.path.islink(path):
+                        shutil.rmtree(path)
+                    else:
+                        os.unlink(path)
+                except OSError:
+                    prRed(f"Failed to remove {path}")
 
 
 class TestManager:
 
-    def __init__(self, test_scripts: List[Path], setup_script: Path, verbose: bool = False):
+    def __init__(self,
+                 test_scripts: List[Path],
+                 setup_script: Path,
+                 verbose: bool = False,
+                 jobs: int = 1,
+                 timeout: float = 120,
+                 timeouts: Dict[str, float] = None):
         self.test_scripts   = test_scripts
         self.setup_script   = setup_script
         self.status         = []
         self.verbose        = verbose
-
-    def run_tests(self, executable: Path, stop_on_failure=False):
+        self.jobs           = jobs
+        self.timeout        = timeout        # Default per-test timeout, in seconds
+        self.timeouts       = timeouts or {} # Per-test overrides, keyed by test script path
+        self.durations      = {}             # Duration of the last run of each test script, in seconds
+        self.coverage       = None           # Test impact index: {test script path: set of functions it executes}
+        self.coverage_dir   = None           # Set while the index is being built
+
+    def run_test(self, test_path, executable, running=None, cancelled=None):
+        '''
+        Run one test script in its own process group, so that it can be killed along with everything it started.
+        `running` is a dict of the process groups in flight, shared with other workers; `cancelled` is an Event
+        that is set when the remaining tests should not run.
+        Returns the status entry of the test, or None if the test was cancelled.
+        '''
+        if cancelled is not None and cancelled.is_set():
+            return None
+        cmd = f'PATH="{executable.parent.absolute()}:$PATH" exec bash {test_path}'
+        if self.coverage_dir is not None:
+            # Each test writes its own trace of the instrumented C functions
+            instrumentation_dir = self.instrumentation_dir(test_path)
+            shutil.rmtree(instrumentation_dir, ignore_errors=True)
+            instrumentation_dir.mkdir(parents=True)
+            cmd = f'INSTRUMENTATION_PATH="{instrumentation_dir.absolute()}" ' + cmd
+        timeout = self.timeouts.get(str(test_path), self.timeout)
+        start = time.perf_counter()
+        process = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True)
+        if running is not None:
+            running[process.pid] = process
+            if cancelled is not None and cancelled.is_set():
+                # Cancelled while starting up
+                stop_process_group(process)
+        try:
+            stdout, stderr = process.communicate(timeout=timeout)
+            error = None
+            if process.returncode != 0:
+                error = stderr.decode('utf-8', errors='ignore')
+                if error.strip() == '':
+                    error = stdout.decode('utf-8', errors='ignore')
+        except subprocess.TimeoutExpired:
+            stop_process_group(process)
+            process.communicate()
+            error = "Timeout"
+        finally:
+            if running is not None:
+                running.pop(process.pid, None)
+        self.durations[str(test_path)] = time.perf_counter() - start
+
+        if cancelled is not None and cancelled.is_set() and error is not None:
+            # Killed because another test failed
+            return None
+        if error is None:
+            if self.verbose:
+                prGreen(f"Test passed: {test_path}")
+            return {'test': test_path, 'status': 'passed', 'duration': self.durations[str(test_path)]}
+        if self.verbose:
+            prRed(f"Test failed: {test_path}")
+        return {'test': test_path, 'status': 'failed', 'error': error, 'duration': self.durations[str(test_path)]}
+
+    def instrumentation_dir(self, test_path):
+        return Path(self.coverage_dir, str(self.test_scripts.index(test_path)))
+
+    def build_impact_index(self, executable: Path, coverage_dir: Path):
+        '''
+        Run the test suite with parsec's instrumentation enabled, and record which functions each test executes.
+        Returns the test statuses, like `run_tests`.
+        '''
+        self.coverage_dir = Path(coverage_dir)
+        try:
+            statuses = self.run_tests(executable)
+            self.coverage = {}
+            for test_path in self.test_scripts:
+                trace = self.instrumentation_dir(test_path)/'instrumented.bin'
+                if not trace.exists():
+                    trace = self.instrumentation_dir(test_path)/'instrumented.json'
+                self.coverage[str(test_path)] = traced_functions(trace)
+        finally:
+            self.coverage_dir = None
+        return statuses
+
+    def tests_covering(self, func_name):
+        '''
+        The test scripts that execute `func_name`, or all of them if that is unknown.
+        Functions are only logged when they return, so a function that no test was seen executing
+        (for instance one that always calls exit) is validated against the whole suite.
+        '''
+        if self.coverage is None:
+            return self.test_scripts
+        tests = [test_path for test_path in self.test_scripts if func_name in self.coverage.get(str(test_path), ())]
+        return tests or self.test_scripts
+
+    def run_tests(self, executable: Path, stop_on_failure=False, test_scripts=None):
         prCyan("Running tests against the following executable: {}".format(executable))
+        # A subset of the test scripts can be given for this run only
+        test_scripts = self.test_scripts if test_scripts is None else test_scripts
 
         if self.setup_script is not None:
             # Run the setup script
@@ -317,22 +594,38 @@ class TestManager:
                 raise e
 
         self.status = []
-        # Run each test file
-        for test_path in self.test_scripts:
-            # Run the test file
-            cmd = f'PATH="{executable.parent.absolute()}:$PATH" bash {test_path}'
-            try:
-                run(cmd)
-                if self.verbose:
-                    prGreen(f"Test passed: {test_path}")
-                self.status.append({'test': test_path, 'status': 'passed'})
-            except RunException as e:
-                if self.verbose:
-                    prRed(f"Test failed: {test_path}")
-                self.status.append({'test': test_path, 'status': 'failed', 'error': str(e)})
-                if stop_on_failure:
+        if self.jobs <= 1:
+            # Run each test file
+            for test_path in test_scripts:
+                status = self.run_test(test_path, executable)
+                self.status.append(status)
+                if status['status'] == 'failed' and stop_on_failure:
                     # Stop running tests if one fails
                     break
+            return self.status
+
+        # Slowest first, so that a long test does not start last; tests that never ran count as slow
+        order = sorted(test_scripts, key=lambda test_path: -self.durations.get(str(test_path), float('inf')))
+        running = {}
+        cancelled = threading.Event()
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            futures = {executor.submit(self.run_test, test_path, executable, running, cancelled): test_path
+                       for test_path in order}
+            for future in as_completed(futures):
+                status = future.result()
+                if status is None:
+                    continue
+                results[str(futures[future])] = status
+                if status['status'] == 'failed' and stop_on_failure and not cancelled.is_set():
+                    # Fail fast: drop the tests that have not started and kill the ones in flight
+                    cancelled.set()
+                    for other in futures:
+                        other.cancel()
+                    for process in list(running.values()):
+                        stop_process_group(process)
+        # Report in the order of the test scripts
+        self.status = [results[str(test_path)] for test_path in test_scripts if str(test_path) in results]
         return self.status
     
     def passed(self):
@@ -345,7 +638,7 @@ class TestManager:
 
 class Orchestrator:
 
-    def function_iter(self, source_manager):
+    def build_call_graph(self, source_manager):
         static_analysis_results = source_manager.get_static_analysis_results()
         # Build call graph of functions
         self.call_graph = nx.DiGraph()
@@ -363,6 +656,15 @@ class Orchestrator:
         components = nx.weakly_connected_components(subgraph)
         assert len(list(components)) == 1
 
+        # If a name appears more than once, the first entry wins
+        funcs_by_name = {}
+        for func in static_analysis_results:
+            funcs_by_name.setdefault(func['name'], func)
+        return subgraph, funcs_by_name
+
+    def function_iter(self, source_manager):
+        subgraph, funcs_by_name = self.build_call_graph(source_manager)
+
         try:
             func_ordering = list(reversed(list(nx.topological_sort(subgraph))))
         except nx.NetworkXUnfeasible:
@@ -371,17 +673,137 @@ class Orchestrator:
         func_ordering = [f.strip('"') for f in func_ordering]
 
         for func_name in func_ordering:
-            funcs = [f for f in static_analysis_results if f['name'] == func_name]
-            if len(funcs) == 0:
+            if func_name not in funcs_by_name:
                 continue
-            func = funcs[0]
-            yield func
+            yield funcs_by_name[func_name]
+
+    def schedule(self, source_manager):
+        '''
+        Partition the call graph reachable from main_0 into units of work for parallel translation.
+        Mutually recursive functions (a strongly connected component) form a single unit, and are
+        translated one after the other in DFS postorder. A unit is ready once every unit it calls is done.
+        <returned>: (units, callees, levels)
+            units:   {unit_id: [func, ...]}
+            callees: {unit_id: set of unit_ids that it calls}
+            levels:  [[unit_id, ...], ...], callees first; the units within a level are independent
+        '''
+        subgraph, funcs_by_name = self.build_call_graph(source_manager)
+        condensed = nx.condensation(subgraph)
+
+        units = {}
+        for unit_id, members in condensed.nodes(data='members'):
+            ordering = list(nx.dfs_postorder_nodes(subgraph.subgraph(members)))
+            ordering = [f.strip('"') for f in ordering]
+            units[unit_id] = [funcs_by_name[f] for f in ordering if f in funcs_by_name]
+
+        callees = {unit_id: set(condensed.successors(unit_id)) for unit_id in condensed.nodes}
+        levels = list(reversed(list(nx.topological_generations(condensed))))
+        return units, callees, levels
+
+class ResponseFormatException(ModelException):
+    pass
+
+
+class TagParser:
+    '''
+    Incremental parser of responses in the format of the translation prompts: an optional
+    <IMPORTS> section, then <FUNC> and <WRAPPER> sections.
+
+    `feed` takes the response one chunk at a time and returns True once the <FUNC> and <WRAPPER>
+    sections (and <IMPORTS>, if it was opened) are closed, so that the rest of the response can be cut.
+    It raises a ResponseFormatException if no section has been opened after `max_preamble` characters.
+    '''
+
+    def __init__(self, max_preamble=2000):
+        self.text = ''
+        self.max_preamble = max_preamble
+        # Position of each tag found so far; closing tags are searched for after their opening tag
+        self.positions = {}
+        self.scanned = 0
+
+    def find(self, tag, start=0):
+        if tag not in self.positions:
+            # Only the new text, and enough before it to catch a tag split across chunks
+            position = self.text.find(tag, max(start, self.scanned - len(tag) + 1))
+            if position != -1:
+                self.positions[tag] = position
+        return self.positions.get(tag)
+
+    def closed(self, section):
+        opening = self.find(f'<{section}>\n')
+        return opening is not None and self.find(f'</{section}>', opening) is not None
+
+    def feed(self, chunk):
+        self.text += chunk
+        # Every tag is looked for in every chunk
+        closed = {section: self.closed(section) for section in ['IMPORTS', 'FUNC', 'WRAPPER']}
+        opened = any(f'<{section}>\n' in self.positions for section in closed)
+        self.scanned = len(self.text)
+        if not opened and len(self.text) > self.max_preamble:
+            raise ResponseFormatException(f"Response has no <FUNC> or <WRAPPER> tag after {self.max_preamble} characters")
+        return closed['FUNC'] and closed['WRAPPER'] and (closed['IMPORTS'] or '<IMPORTS>\n' not in self.positions)
+
+    @staticmethod
+    def valid(response):
+        # Whether a complete response has the expected sections
+        try:
+            TagParser().finish(response)
+            return True
+        except ResponseFormatException:
+            return False
+
+    def finish(self, response):
+        '''
+        Extract the sections of the complete (or cut) response.
+        A response from a cache arrives whole, without going through `feed`.
+        '''
+        if len(response) > len(self.text):
+            self.feed(response[len(self.text):])
+        response = self.text
+        # Parse the response and extract the text between either
+        # <FUNC>...</FUNC>, <IMPORT>...</IMPORT> or <WRAPPER>...</WRAPPER> tags
+        if '<IMPORTS>\n' in response:
+            imports = response.split('<IMPORTS>\n')[1].split('</IMPORTS>')[0]
+        else:
+            imports = ''
+
+        if '<FUNC>\n' not in response:
+            raise ResponseFormatException("Response does not contain <FUNC> tag")
+        if '<WRAPPER>\n' not in response:
+            raise ResponseFormatException("Response does not contain <WRAPPER> tag")
+        function_trans = response.split('<FUNC>\n')[1].split('</FUNC>')[0]
+        wrapper = response.split('<WRAPPER>\n')[1].split('</WRAPPER>')[0]
+
+        # Remove any ```rust and ``` tags from imports, function_trans and wrapper
+        return {
+            'func': function_trans.replace('```rust', '').replace('```', '').strip(),
+            'wrapper': wrapper.replace('```rust', '').replace('```', '').strip(),
+            'imports': imports.replace('```rust', '').replace('```', '').strip(),
+        }
+
 
 class Translator:
 
-    def __init__(self, model):
-        self.model = get_model_from_name(model)
-        self.conversation = []
+    def __init__(self, model, cache_dir=None, token_budget=8000):
+        self.model = get_model_from_name(model, cache_dir=cache_dir)
+        # Prompts beyond the budget are compacted, see ConversationManager
+        self.token_budget = token_budget
+        self.conversation = None
+        # Estimated prompt tokens of every request for the current function
+        self.prompt_tokens = []
+
+    def fork(self):
+        # A translator with its own conversation that shares the model (and its cache and rate limits)
+        clone = copy.copy(self)
+        clone.conversation = None
+        clone.prompt_tokens = []
+        return clone
+
+    def report_model_stats(self):
+        if isinstance(self.model, CachedGen):
+            prLightGray(f"LLM cache: {self.model.hits} hits, {self.model.misses} misses")
+        for provider, stats in rate_limit_stats().items():
+            prLightGray(f"{provider}: {stats['throttled_time']:.1f}s throttled, {stats['retries']} retries")
 
     def construct_prompt_for_func(self, func):
 
@@ -426,53 +848,15 @@ pub extern "C" fn {func['name']} ...
 
         translation_prompt = self.construct_prompt_for_func(func)
 
-        self.conversation = [{'role': 'system', 'content': 'You are an intelligent code assistant'},
-                            {'role': 'user', 'content': translation_prompt.strip()}]
+        self.conversation = ConversationManager('You are an intelligent code assistant', translation_prompt.strip(),
+                                                token_budget=self.token_budget)
+        self.prompt_tokens = []
 
-        while True:
-            try:
-                prCyan("Calling LLM for translation")
-                response = self.model.gen(self.conversation, top_k=1, temperature=0)[0]
-                self.conversation.append({'role': 'assistant', 'content': response})
-                prGreen("LLM response received")
-                if verbose:
-                    prLightGray(response)
-                # Parse the response and extract the text between either
-                # <FUNC>...</FUNC>, <IMPORT>...</IMPORT> or <WRAPPER>...</WRAPPER> tags
-                if '<IMPORTS>\n' in response:
-                    imports = response.split('<IMPORTS>\n')[1].split('</IMPORTS>')[0]
-                else:
-                    imports = ''
-                
-                if '<FUNC>\n' not in response:
-                    prRed("Response does not contain <FUNC> tag. Trying again.")
-                    continue
-                if '<WRAPPER>\n' not in response:
-                    prRed("Response does not contain <WRAPPER> tag. Trying again.")
-                    continue
-                function_trans = response.split('<FUNC>\n')[1].split('</FUNC>')[0]
-                wrapper = response.split('<WRAPPER>\n')[1].split('</WRAPPER>')[0]
-
-                # Remove any ```rust and ``` tags from imports, function_trans and wrapper
-                imports = imports.replace('```rust', '').replace('```', '').strip()
-                function_trans = function_trans.replace('```rust', '').replace('```', '').strip()
-                wrapper = wrapper.replace('```rust', '').replace('```', '').strip()
-                break
-            except ModelException as e:
-                prCyan("Model exception")
-                prCyan(e)
-                prCyan("Trying again")
-                continue
-
-        return {
-            'func': function_trans,
-            'wrapper': wrapper,
-            'imports': imports,
-        }
+        return self.request_translation("translation", verbose)
     
     def repair(self, result, source_manager, verbose=False):
 
-        assert len(self.conversation) > 0, "Repair called before translation"
+        assert self.conversation is not None and self.conversation.attempts, "Repair called before translation"
 
         if result['category'] == "Compile Error":
             prompt = ("The translation generated the following compile error:\n"
@@ -487,68 +871,69 @@ pub extern "C" fn {func['name']} ...
         else:
             raise NotImplementedError("Repair not implemented for this error type")
         
-        self.conversation += [{'role': 'user', 'content': prompt.strip()}]
-
-        while True:
+        # Only the first line of the error is kept once a later attempt supersedes this one
+        first_line = next((line.strip() for line in result['message'].split('\n') if line.strip()), '')
+        self.conversation.add_feedback(prompt.strip(), f"{result['category']}: {first_line[:200]}")
+
+        return self.request_translation("repair", verbose)
+
+    def request_translation(self, purpose, verbose=False, max_retries=3):
+        '''
+        Stream a response to the conversation and parse it as it arrives. The response is cut as soon
+        as its sections are complete, and a response that goes off-format is abandoned and requested again.
+        At temperature 0 the same prompt tends to get the same response, so after `max_retries`
+        unusable responses a ModelException is raised.
+        '''
+        for attempt in range(max_retries + 1):
             try:
-                prCyan("Calling LLM for repair")
-                response = self.model.gen(self.conversation, top_k=1, temperature=0)[0]
-                self.conversation.append({'role': 'assistant', 'content': response})
+                messages = self.conversation.messages()
+                self.prompt_tokens.append(estimate_tokens(messages))
+                prCyan(f"Calling LLM for {purpose}")
+                parser = TagParser()
+                response = self.model.gen_streaming(messages, temperature=0, stop=parser.feed, validate=TagParser.valid)
                 prGreen("LLM response received")
                 if verbose:
+                    prLightGray(f"Prompt tokens: {self.prompt_tokens[-1]}")
+                    self.report_model_stats()
                     prLightGray(response)
-                # Parse the response and extract the text between either
-                # <FUNC>...</FUNC>, <IMPORT>...</IMPORT> or <WRAPPER>...</WRAPPER> tags
-                if '<IMPORTS>\n' in response:
-                    imports = response.split('<IMPORTS>\n')[1].split('</IMPORTS>')[0]
-                else:
-                    imports = ''
-                
-                if '<FUNC>\n' not in response:
-                    prRed("Response does not contain <FUNC> tag. Trying again.")
-                    continue
-                if '<WRAPPER>\n' not in response:
-                    prRed("Response does not contain <WRAPPER> tag. Trying again.")
-                    continue
-                function_trans = response.split('<FUNC>\n')[1].split('</FUNC>')[0]
-                wrapper = response.split('<WRAPPER>\n')[1].split('</WRAPPER>')[0]
-
-                # Remove any ```rust and ``` tags from imports, function_trans and wrapper
-                imports = imports.replace('```rust', '').replace('```', '').strip()
-                function_trans = function_trans.replace('```rust', '').replace('```', '').strip()
-                wrapper = wrapper.replace('```rust', '').replace('```', '').strip()
-                break
+                translation = parser.finish(response)
+                self.conversation.add_response(response)
+                return translation
+            except ResponseFormatException as e:
+                error = e
+                prRed(f"{e}. Trying again.")
+                continue
             except ModelException as e:
+                error = e
                 prCyan("Model exception")
                 prCyan(e)
                 prCyan("Trying again")
                 continue
-
-        return {
-            'func': function_trans,
-            'wrapper': wrapper,
-            'imports': imports,
-        }
+        raise ModelException(f"No usable response for {purpose} after {max_retries + 1} requests: {error}")
 
 
 class Validator:
 
-    def __init__(self, compile_attempts=5):
+    def __init__(self, compile_attempts=5, max_errors=3, select_tests=False, full_suite_every=0):
         self.compile_attempts = 5
-
-    def validate(self, func, translation, source_manager, test_manager):
-        source_manager.insert_translation(func, translation)
-
-        compile_success = False
-        error_message = ''
-        # Try 2 times to compile, in case there is a timeout or mysterious linker error
+        # Stop compiling once this many errors have been reported in the translated code (None: never)
+        self.max_errors = max_errors
+        # Only run the tests that execute the function being validated, and the whole suite
+        # on every `full_suite_every`-th validation (0: never)
+        self.select_tests = select_tests
+        self.full_suite_every = full_suite_every
+        self.validations = 0
+
+    def run_stage(self, stage, source_manager):
+        # Returns the CompileException if the stage failed, None otherwise
+        error = None
+        # Try 2 times, in case there is a timeout or mysterious linker error
         for _ in range(2):
             try:
-                source_manager.compile()
-                compile_success = True
-                break
+                stage(max_errors=self.max_errors)
+                return None
             except CompileException as e:
-                error_message = str(e)
+                error = e
                 if "Timeout" in str(e):
                     prRed("Timeout. Trying again.")
                     continue
@@ -556,25 +941,52 @@ class Validator:
                     prRed("Linker error. Cleaning up and trying again.")
                     source_manager.cleanup()
                     continue
+                # A genuine compile error will not go away by itself
+                break
+        return error
 
-        if not compile_success:
+    def validate(self, func, translation, source_manager, test_manager):
+        source_manager.insert_translation(func, translation)
+        timings = {}
+
+        # Errors in the translation itself are caught by `cargo check`, in a fraction of the time of a full build
+        start = time.perf_counter()
+        error = self.run_stage(source_manager.check, source_manager)
+        timings['check'] = time.perf_counter() - start
+        if error is None:
+            start = time.perf_counter()
+            error = self.run_stage(source_manager.compile, source_manager)
+            timings['build'] = time.perf_counter() - start
+
+        if error is not None:
             return {"success": False,
                     "category": "Compile Error",
-                    "message" : error_message}
+                    "message" : str(error),
+                    "diagnostics": error.diagnostics,
+                    "timings" : timings}
         
         # If we get here, the code compiled successfully
         # Run the test suite
         executable = source_manager.get_executable()
-        test_res = test_manager.run_tests(executable, stop_on_failure=True)
+        self.validations += 1
+        test_scripts = None
+        if self.select_tests and not (self.full_suite_every and self.validations % self.full_suite_every == 0):
+            test_scripts = test_manager.tests_covering(func['name'])
+            prCyan(f"Running the {len(test_scripts)}/{len(test_manager.test_scripts)} tests that execute {func['name']}")
+        start = time.perf_counter()
+        test_res = test_manager.run_tests(executable, stop_on_failure=True, test_scripts=test_scripts)
+        timings['test'] = time.perf_counter() - start
         if test_manager.passed():
             return {"success": True,
                 "category": "",
-                "message" : ""}
+                "message" : "",
+                "timings" : timings}
         else:
             failed_test = [res for res in test_res if res['status'] == 'failed'][0]
             return {"success": False,
                     "category": "Test Failure",
-                    "message" : failed_test['error']}
+                    "message" : failed_test['error'],
+                    "timings" : timings}
 
 class TranslationEngine:
 
@@ -583,9 +995,27 @@ class TranslationEngine:
                 output_dir: str,
                 model: str,
                 num_attempts: int=5,
+                jobs: int=1,
+                worktrees: bool=False,
+                target_dir: str=None,
+                test_jobs: int=1,
+                select_tests: bool=False,
+                trace_format: str='binary',
+                rust_layout: str='modules',
+                max_functions: int=None,
                 verbose: bool=False):
         
         self.dataset = dataset
+        self.trace_format = trace_format
+        self.rust_layout = rust_layout
+        self.select_tests = select_tests
+        self.test_jobs = test_jobs
+        self.target_dir = target_dir
+        self.jobs = jobs
+        # Only the first `max_functions` functions in call-graph order are translated (None: all of them)
+        self.max_functions = max_functions
+        self.use_worktrees = worktrees
+        self.worktrees = None
         self.verbose = verbose
         self.output_dir = Path(output_dir)
         self.setup() # Sets up self.source_manager
@@ -614,12 +1044,17 @@ class TranslationEngine:
             prRed(f"Directory {output_dir} already exists. Please remove it before running the script.")
             raise FileExistsError(f"Directory {output_dir} already exists. Please remove it before running the script.")
             
-        shutil.copytree('rust_wrapper', output_dir)
-        shutil.copytree(code_dir, output_dir/'c_src')
+        # Files are reflinked or hardlinked from the originals where possible.
+        # SourceManager breaks the link of a file before it modifies it.
+        counts = materialize('rust_wrapper', output_dir)
+        for method, count in materialize(code_dir, output_dir/'c_src').items():
+            counts[method] += count
 
         code_dir = output_dir
         prCyan("Copied over the code to {}".format(code_dir.absolute()))
-        self.source_manager = SourceManager(code_dir)
+        if self.verbose:
+            prLightGray("Files shared with the originals: " + ", ".join(f"{method}: {count}" for method, count in counts.items()))
+        self.source_manager = SourceManager(code_dir, target_dir=self.target_dir, trace_format=self.trace_format, rust_layout=self.rust_layout)
         target = self.source_manager.get_bin_target()
         self.source_manager.set_cargo_bin_target(target)
 
@@ -647,8 +1082,19 @@ class TranslationEngine:
         else:
             setup_script = None
         
-        self.test_manager = TestManager(test_paths, setup_script, verbose=self.verbose)
-        test_statuses = self.test_manager.run_tests(executable)
+        # Timeouts in datasets.json are in seconds: "test_timeout" for every test, "test_timeouts" per test script
+        timeouts = {str(Path(test_dir)/Path(t)): timeout for t, timeout in self.dataset.get("test_timeouts", {}).items()}
+        self.test_manager = TestManager(test_paths, setup_script,
+                                        verbose=self.verbose,
+                                        jobs=self.test_jobs,
+                                        timeout=self.dataset.get("test_timeout", 120),
+                                        timeouts=timeouts)
+        if self.select_tests:
+            # Outside of the output directory, which is copied into the worktrees
+            with tempfile.TemporaryDirectory(prefix='coverage_') as coverage_dir:
+                test_statuses = self.test_manager.build_impact_index(executable, coverage_dir)
+        else:
+            test_statuses = self.test_manager.run_tests(executable)
         selected_tests = []
         for status in test_statuses:
             if status['status'] == "passed":
@@ -659,38 +1105,177 @@ class TranslationEngine:
         
         return 
     
+    def translate_func(self, func, translator, validator):
+        prCyan("Translating function: {}".format(func['name']))
+        try:
+            translation = translator.translate(func, self.source_manager, self.verbose)
+        except ModelException as e:
+            prRed(f"Translation failed: {e}")
+            return {'success': False, 'category': 'Model Error', 'message': str(e),
+                    'attempt_timings': [], 'prompt_tokens': translator.prompt_tokens}
+        result = self.validate(func, translation, validator)
+        attempt_timings = [result['timings']]
+
+        for i in range(self.num_attempts):
+            prCyan(f"Attempt {i+1}/{self.num_attempts}")
+
+            if result['success']:
+                prGreen("Translation succeeded")
+                break
+            else:
+                prRed("Translation failed")
+                if self.verbose:
+                    prLightGray(result['message'])
+                if i == self.num_attempts - 1:
+                    break
+                try:
+                    translation = translator.repair(result, self.source_manager, self.verbose)
+                except ModelException as e:
+                    prRed(f"Repair failed: {e}")
+                    break
+                result = self.validate(func, translation, validator)
+                attempt_timings.append(result['timings'])
+        # Time spent in each validation stage, per attempt
+        result['attempt_timings'] = attempt_timings
+        result['prompt_tokens'] = translator.prompt_tokens
+        return result
+
+    def validate(self, func, translation, validator):
+        if self.worktrees is None:
+            # The translation is inserted, compiled, tested and, if it failed, reset without another worker touching the sources
+            with self.source_manager.lock:
+                result = validator.validate(func, translation, self.source_manager, self.test_manager)
+                if not result['success']:
+                    self.source_manager.reset_func(func)
+                else:
+                    self.source_manager.commit_func(func)
+        else:
+            result = self.validate_in_worktree(func, translation, validator)
+        if self.verbose:
+            prLightGray("Validation time: " + ", ".join(f"{stage}: {seconds:.1f}s" for stage, seconds in result['timings'].items()))
+        return result
+
+    def validate_in_worktree(self, func, translation, validator):
+        with self.worktrees.acquire() as worktree_dir:
+            source_manager = SourceManager(worktree_dir, target_dir=self.target_dir, trace_format=self.trace_format, rust_layout=self.rust_layout)
+            source_manager.cargo_bin_target = self.source_manager.cargo_bin_target
+            result = validator.validate(func, translation, source_manager, copy.copy(self.test_manager))
+            if not result['success']:
+                source_manager.reset_func(func)
+            else:
+                # Callers are only dispatched once this function is done, so merges happen in dependency order
+                def merge():
+                    with self.source_manager.lock:
+                        self.source_manager.insert_translation(func, translation)
+                        self.source_manager.commit_func(func)
+                        # The worktrees are synced from the files on disk
+                        self.source_manager.flush_sources()
+                self.worktrees.merge(merge)
+        return result
+
+    def record_result(self, func, result):
+        with self.source_manager.lock:
+            self.log['results'].append({'function': func['name'],
+                                   'results': "Success" if result['success'] else result['category'],
+                                   'timings': result['attempt_timings'],
+                                   'prompt_tokens': result['prompt_tokens']})
+            with open(self.log_file, 'w') as f:
+                f.write(json.dumps(self.log, indent=4))
+
     def run(self,
             orchestrator: Orchestrator,
             translator: Translator,
             validator: Validator):
 
-        for func in orchestrator.function_iter(self.source_manager):
-            prCyan("Translating function: {}".format(func['name']))
-            translation = translator.translate(func, self.source_manager, self.verbose)
-            result = validator.validate(func, translation, self.source_manager, self.test_manager)
+        if self.jobs > 1:
+            return self.run_parallel(orchestrator, translator, validator)
 
-            for i in range(self.num_attempts):
-                prCyan(f"Attempt {i+1}/{self.num_attempts}")
+        for func in self.selected_functions(orchestrator):
+            result = self.translate_func(func, translator, validator)
+            self.record_result(func, result)
 
-                if result['success']:
-                    prGreen("Translation succeeded")
-                    break
-                else:
-                    prRed("Translation failed")
-                    if self.verbose:
-                        prLightGray(result['message'])
-                    self.source_manager.reset_func(func)
-                    if i == self.num_attempts - 1:
-                        break
-                    translation = translator.repair(result, self.source_manager, self.verbose)
-                    result = validator.validate(func, translation, self.source_manager, self.test_manager)
-            
-            exit(0) # This is just for testing purposes, to stop after the first function
-            
-            self.log['results'].append({'function': func['name'],
-                                   'results': "Success" if result['success'] else result['category']})
-            with open(self.log_file, 'w') as f:
-                f.write(json.dumps(self.log, indent=4))
+    def selected_functions(self, orchestrator):
+        # Callees come first, so the selected functions never call one that is left out
+        funcs = list(orchestrator.function_iter(self.source_manager))
+        return funcs if self.max_functions is None else funcs[:self.max_functions]
+
+    def run_parallel(self,
+            orchestrator: Orchestrator,
+            translator: Translator,
+            validator: Validator):
+        '''
+        Translate up to `jobs` functions at once. A function is dispatched as soon as all of its
+        callees are done, so the wall-clock time is bounded by the depth of the call graph rather than
+        by the number of functions. LLM calls run concurrently. Validation is serialized on the output
+        directory, unless worktrees are enabled; then each function is validated in a worktree and
+        merged into the output directory once it passes.
+        '''
+        units, callees, levels = orchestrator.schedule(self.source_manager)
+        # The same functions as a serial run; the units left without any are done right away
+        selected = {func['name'] for func in self.selected_functions(orchestrator)}
+        units = {unit_id: [func for func in funcs if func['name'] in selected] for unit_id, funcs in units.items()}
+        prCyan(f"Translating {sum(len(funcs) for funcs in units.values())} functions "
+               f"({len(levels)} dependency levels) with {self.jobs} workers")
+
+        callers = defaultdict(set)
+        for unit_id, unit_callees in callees.items():
+            for callee in unit_callees:
+                callers[callee].add(unit_id)
+        waiting = {unit_id: set(unit_callees) for unit_id, unit_callees in callees.items()}
+
+        def translate_unit(funcs, translator):
+            for func in funcs:
+                result = self.translate_func(func, translator, validator)
+                self.record_result(func, result)
+
+        if self.use_worktrees:
+            # With a shared target directory, the executables are copied out of it by `keep_executable`
+            self.worktrees = WorktreePool(self.source_manager.code_dir, self.jobs, copy_target=self.target_dir is None)
+            prCyan(f"Created {self.jobs} worktrees in {self.worktrees.root}")
+            if self.verbose:
+                prLightGray("Files shared with the output directory: " + ", ".join(f"{method}: {count}" for method, count in self.worktrees.counts.items()))
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            running = {}
+            while waiting or running:
+                # Dispatch every unit whose callees have all been translated
+                for unit_id in [unit_id for unit_id, pending in waiting.items() if not pending]:
+                    del waiting[unit_id]
+                    running[executor.submit(translate_unit, units[unit_id], translator.fork())] = unit_id
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    unit_id = running.pop(future)
+                    future.result()
+                    for caller in callers[unit_id]:
+                        waiting[caller].discard(unit_id)
+
+        if self.worktrees is not None:
+            self.worktrees.close()
+            self.worktrees = None
+            self.confirm()
+
+    def confirm(self):
+        # Translations validated in separate worktrees may still conflict once they are merged together
+        prCyan("Confirming the merged translations")
+        result = {'success': True, 'category': '', 'message': ''}
+        try:
+            self.source_manager.compile()
+            self.test_manager.run_tests(self.source_manager.get_executable())
+            if not self.test_manager.passed():
+                failed_test = [res for res in self.test_manager.status if res['status'] == 'failed'][0]
+                result = {'success': False, 'category': 'Test Failure', 'message': failed_test['error']}
+        except CompileException as e:
+            result = {'success': False, 'category': 'Compile Error', 'message': str(e)}
+
+        if result['success']:
+            prGreen("Confirmation build and tests passed")
+        else:
+            prRed(f"Confirmation failed: {result['category']}")
+            if self.verbose:
+                prLightGray(result['message'])
+        self.log['confirmation'] = "Success" if result['success'] else result['category']
+        with open(self.log_file, 'w') as f:
+            f.write(json.dumps(self.log, indent=4))
         
 
 if __name__ == '__main__':
@@ -700,8 +1285,22 @@ if __name__ == '__main__':
     parser.add_argument('--model',          type=str,   default='gpt4o-mini',   help='Model to use for translation')
     parser.add_argument('--num_attempts',   type=int,   default=2,              help='Number of attempts to translate each function')
     parser.add_argument('--output_dir',     type=str,   default='output/translation', help='Directory to write the output')
+    parser.add_argument('--jobs',           type=int,   default=1,              help='Number of functions to translate concurrently, in call-graph order')
+    parser.add_argument('--worktrees',      action='store_true',                help='With --jobs, validate each function in its own copy of the output crate')
+    parser.add_argument('--max_errors',     type=int,   default=3,              help='Stop a build after this many errors in the translated code (0 to never stop early)')
+    parser.add_argument('--test_jobs',      type=int,   default=1,              help='Number of test scripts to run concurrently')
+    parser.add_argument('--select_tests',   action='store_true',                help='Only run the tests that execute the function being translated')
+    parser.add_argument('--full_suite_every', type=int, default=0,              help='With --select_tests, run the whole suite on every Nth validation (0: never)')
+    parser.add_argument('--target_dir',     type=str,   default=None,           help='Cargo target directory to share across runs, so dependencies are built once')
+    parser.add_argument('--trace_format',   type=str,   default='binary',       choices=['text', 'binary'], help="Trace format of parsec's instrumentation; binary traces are buffered and much faster to write")
+    parser.add_argument('--rust_layout',    type=str,   default='modules',      choices=['single', 'modules'], help='Append translations to src/main.rs, or write each one to a module of src/translated')
+    parser.add_argument('--token_budget',   type=int,   default=8000,           help='Prompt tokens per LLM call beyond which earlier repair attempts and long error logs are compacted')
+    parser.add_argument('--max_functions',  type=int,   default=1,              help='Stop after translating this many functions, in call-graph order (0: all of them). The scenario only translates the first one')
+    parser.add_argument('--cache_dir',      type=str,   default=None,           help='Directory of a persistent LLM response cache (disabled by default)')
     parser.add_argument('--verbose',        action='store_true',                help='Enable verbose output')
     args = parser.parse_args()
+    if args.worktrees and args.jobs < 2:
+        parser.error("--worktrees requires --jobs greater than 1")
 
     datasets = json.loads(open('data/datasets.json').read())
     assert args.dataset in datasets, f"Dataset {args.dataset} not found in datasets.yaml"
@@ -709,13 +1308,24 @@ if __name__ == '__main__':
     assert 'code_dir' in dataset, f"Code directory not specified for dataset {args.dataset}"
 
     orchestrator = Orchestrator()
-    translator = Translator(args.model)
-    validator = Validator(compile_attempts=5) # In case compilation times out, how many times to retry
+    translator = Translator(args.model, cache_dir=args.cache_dir, token_budget=args.token_budget)
+    validator = Validator(compile_attempts=5, # In case compilation times out, how many times to retry
+                          max_errors=args.max_errors or None,
+                          select_tests=args.select_tests,
+                          full_suite_every=args.full_suite_every)
 
     engine = TranslationEngine(dataset=dataset,
                                output_dir=args.output_dir,
                                model=args.model,
                                num_attempts=args.num_attempts,
+                               jobs=args.jobs,
+                               worktrees=args.worktrees,
+                               target_dir=args.target_dir,
+                               test_jobs=args.test_jobs,
+                               select_tests=args.select_tests,
+                               trace_format=args.trace_format,
+                               rust_layout=args.rust_layout,
+                               max_functions=args.max_functions or None,
                                verbose=args.verbose)
 
     engine.run(translator=translator,
@@ -1,7 +1,10 @@
 from .openai import OpenAIGen, OpenAIEmbed
 from .google import GoogleGen
 from .claude import ClaudeGen
+from .cache import CachedGen
+from .ratelimit import configure_rate_limit, rate_limit_stats, estimate_tokens
 from dotenv import load_dotenv
+from pathlib import Path
 
 load_dotenv()
 
@@ -9,31 +12,44 @@ class ModelException(Exception):
     pass
 
 
-def get_model_from_name(name):
+def get_model_from_name(name, cache_dir=None):
+    '''
+    If `cache_dir` is given, generation models are wrapped in a persistent response cache,
+    and embedding models persist their vectors in a store under it.
+    '''
 
     if name == "gpt4":
-        return OpenAIGen(model="gpt-4-0125-preview")
+        model = OpenAIGen(model="gpt-4-0125-preview")
     elif name == "gpt4o":
-        return OpenAIGen(model="gpt-4o-2024-11-20")
+        model = OpenAIGen(model="gpt-4o-2024-11-20")
     elif name == "gpt4o-mini":
-        return OpenAIGen(model="gpt-4o-mini-2024-07-18")
+        model = OpenAIGen(model="gpt-4o-mini-2024-07-18")
     elif name == "gpt3":
-        return OpenAIGen(model="gpt-3.5-turbo")
+        model = OpenAIGen(model="gpt-3.5-turbo")
     elif name == "gemini":
-        return GoogleGen(model="gemini-1.0-pro")
+        model = GoogleGen(model="gemini-1.0-pro")
     elif name == "claude":
-        return ClaudeGen(model="claude-3-opus-20240229")
+        model = ClaudeGen(model="claude-3-opus-20240229")
     elif name == "embedding":
-        return OpenAIEmbed(model="text-embedding-3-large")
+        store_dir = None if cache_dir is None else Path(cache_dir)/'embeddings'/'text-embedding-3-large'
+        return OpenAIEmbed(model="text-embedding-3-large", store_dir=store_dir)
     else:
         raise NotImplementedError("Unknown model name")
 
+    if cache_dir is not None:
+        model = CachedGen(model, cache_dir)
+    return model
+
 
 __all__ = [
     "OpenAIGen",
     "GoogleGen",
     "ClaudeGen",
     "OpenAIEmbed",
+    "CachedGen",
+    "configure_rate_limit",
+    "rate_limit_stats",
+    "estimate_tokens",
     "ModelException",
     "get_model_from_name",
 ]
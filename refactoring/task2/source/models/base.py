@@ -0,0 +1,98 @@
+import asyncio
+
+from .http import run_sync
+
+class GenBase:
+    '''
+    Common interface of the generation backends.
+    Subclasses implement the coroutine `agen_one`, which draws a single sample.
+    Backends whose API can return several candidates in one request override `agen` instead.
+    '''
+
+    async def agen_one(self, messages, temperature=0):
+        raise NotImplementedError
+
+    async def agen(self, messages, temperature=0, top_k=1, quorum=None):
+        '''
+        messages: [{'role': 'system', 'content': 'You are an intelligent code assistant'},
+                   {'role': 'user', 'content': 'Translate this program...'},
+                   {'role': 'assistant', 'content': 'Here is the translation...'},
+                   {'role': 'user', 'content': 'Do something else...'}]
+                   
+        <returned>: ['Sure, here is...',
+                     'Okay, let me see...',
+                     ...]
+        len(<returned>) == top_k, or == quorum if a quorum is given
+
+        The top_k samples are requested concurrently. With a quorum m, the first m samples
+        to arrive are returned and the remaining requests are cancelled.
+        '''
+        from models import ModelException
+
+        if top_k != 1 and temperature == 0:
+            raise ModelException("Top k sampling requires a non-zero temperature")
+        quorum = top_k if quorum is None else min(quorum, top_k)
+
+        if top_k == 1:
+            return [await self.agen_one(messages, temperature=temperature)]
+
+        tasks = [asyncio.ensure_future(self.agen_one(messages, temperature=temperature)) for _ in range(top_k)]
+        responses = []
+        failures = 0
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                try:
+                    responses.append(await next_done)
+                except Exception:
+                    # A failed sample is only fatal if the quorum can no longer be reached
+                    failures += 1
+                    if top_k - failures < quorum:
+                        raise
+                if len(responses) >= quorum:
+                    break
+        finally:
+            for task in tasks:
+                task.cancel()
+        return responses
+
+    async def agen_many(self, conversations, temperature=0, top_k=1, quorum=None):
+        '''
+        conversations: a list of message lists, in the format taken by `gen`.
+        <returned>: a list with the `gen` result for each conversation, in the same order.
+        The requests are in flight concurrently.
+        '''
+        return list(await asyncio.gather(*[self.agen(messages, temperature=temperature, top_k=top_k, quorum=quorum)
+                                           for messages in conversations]))
+
+    async def astream(self, messages, temperature=0):
+        '''
+        Draws one sample as an async iterator of text chunks.
+        Backends with a streaming API override this; by default the whole response is a single chunk.
+        '''
+        yield (await self.agen(messages, temperature=temperature, top_k=1))[0]
+
+    async def agen_streaming(self, messages, temperature=0, stop=None, validate=None):
+        '''
+        Draws one sample, calling `stop(chunk)` with each chunk of text as it arrives.
+        When `stop` returns True, the response is cut there: the stream is closed, so the rest is
+        never generated, and the text received so far is returned. An exception raised by `stop`
+        also closes the stream, and is propagated.
+        `validate(response)` tells whether the response is usable; it only matters to backends that
+        keep responses, such as CachedGen.
+        '''
+        text = ''
+        stream = self.astream(messages, temperature=temperature)
+        try:
+            async for chunk in stream:
+                text += chunk
+                if stop is not None and stop(chunk):
+                    break
+        finally:
+            await stream.aclose()
+        return text
+
+    def gen(self, messages, temperature=0, top_k=1, quorum=None):
+        return run_sync(self.agen(messages, temperature=temperature, top_k=top_k, quorum=quorum))
+
+    def gen_streaming(self, messages, temperature=0, stop=None, validate=None):
+        return run_sync(self.agen_streaming(messages, temperature=temperature, stop=stop, validate=validate))
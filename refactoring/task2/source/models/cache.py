@@ -0,0 +1,138 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from .base import GenBase
+
+class CachedGen(GenBase):
+    '''
+    Wraps a generation backend (OpenAIGen, ClaudeGen, GoogleGen) with a persistent response cache.
+
+    Entries are keyed on the model name, the normalized message list, the temperature and the
+    sample index, and are stored in an SQLite file under `cache_dir`. When the cache grows beyond
+    `max_size` bytes, the least recently used entries are evicted. The number and total size of the
+    entries are kept up to date as they are added and removed, so the table is only scanned once, on open.
+    '''
+
+    def __init__(self, backend, cache_dir, max_size=512 * 1024 * 1024):
+
+        self.backend = backend
+        self.model_name = getattr(backend, 'model_name', backend.model)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        Path(cache_dir).mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(Path(cache_dir)/'responses.sqlite', check_same_thread=False)
+        self.db.execute('''CREATE TABLE IF NOT EXISTS responses (
+                            key TEXT PRIMARY KEY,
+                            response TEXT,
+                            size INTEGER,
+                            last_access REAL)''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)')
+        self.db.commit()
+        self.entries, self.size = self.db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses').fetchone()
+
+    def count(self, hits=0, misses=0):
+        # Samples are requested from several threads
+        with self.lock:
+            self.hits += hits
+            self.misses += misses
+
+    def key(self, messages, temperature, sample_index):
+        normalized = [{'role': message['role'], 'content': message['content'].strip()} for message in messages]
+        blob = json.dumps([self.model_name, normalized, temperature, sample_index], sort_keys=True)
+        return hashlib.sha256(blob.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            row = self.db.execute('SELECT response FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                self.db.execute('UPDATE responses SET last_access = ? WHERE key = ?', (time.time(), key))
+                self.db.commit()
+                return row[0]
+        return None
+
+    def put(self, key, response):
+        size = len(response.encode('utf-8'))
+        with self.lock:
+            self.forget(key)
+            self.db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)', (key, response, size, time.time()))
+            self.entries += 1
+            self.size += size
+            while self.size > self.max_size:
+                # Evict about as many of the least recently used entries as it takes, at the average entry size
+                count = -(-(self.size - self.max_size) * self.entries // self.size)
+                evicted = self.db.execute('SELECT size FROM responses ORDER BY last_access LIMIT ?', (count,)).fetchall()
+                self.db.execute('DELETE FROM responses WHERE key IN '
+                                '(SELECT key FROM responses ORDER BY last_access LIMIT ?)', (count,))
+                self.entries -= len(evicted)
+                self.size -= sum(evicted_size for evicted_size, in evicted)
+            self.db.commit()
+
+    def forget(self, key):
+        # Takes the entry for `key`, if any, out of the counts; called with the lock held
+        row = self.db.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+        if row is not None:
+            self.entries -= 1
+            self.size -= row[0]
+
+    async def agen(self, messages, temperature=0, top_k=1, quorum=None, **kwargs):
+        '''
+        Same interface as the wrapped backend's `agen`.
+        Only the samples that are not in the cache are requested from the backend.
+        '''
+        needed = top_k if quorum is None else min(quorum, top_k)
+        keys = [self.key(messages, temperature, i) for i in range(top_k)]
+        responses = [self.get(key) for key in keys]
+        missing = [i for i, response in enumerate(responses) if response is None]
+        cached = top_k - len(missing)
+
+        if cached >= needed:
+            self.count(hits=needed)
+            return [response for response in responses if response is not None][:needed]
+
+        self.count(hits=cached)
+        new_responses = await self.backend.agen(messages, temperature=temperature, top_k=len(missing),
+                                                quorum=needed - cached, **kwargs)
+        self.count(misses=len(new_responses))
+        for i, response in zip(missing, new_responses):
+            responses[i] = response
+            self.put(keys[i], response)
+
+        return [response for response in responses if response is not None]
+
+    def delete(self, key):
+        with self.lock:
+            self.forget(key)
+            self.db.execute('DELETE FROM responses WHERE key = ?', (key,))
+            self.db.commit()
+
+    async def agen_streaming(self, messages, temperature=0, stop=None, validate=None):
+        '''
+        Same interface as `GenBase.agen_streaming`, sharing its entries with the first sample of `agen`.
+        A cached response is returned whole, without calls to `stop`. A response that `stop` aborted
+        with an exception is not cached, and neither is one for which `validate` returns False:
+        otherwise, a request retried because of an unusable response would get the same response back.
+        A cached response that fails `validate` is dropped and requested again.
+        '''
+        key = self.key(messages, temperature, 0)
+        response = self.get(key)
+        if response is not None:
+            if validate is None or validate(response):
+                self.count(hits=1)
+                return response
+            self.delete(key)
+        response = await self.backend.agen_streaming(messages, temperature=temperature, stop=stop)
+        self.count(misses=1)
+        if validate is None or validate(response):
+            self.put(key, response)
+        return response
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': self.entries, 'size': self.size}
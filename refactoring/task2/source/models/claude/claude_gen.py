@@ -1,66 +1,127 @@
-import time
+import json
 import os
-import requests
 
-class ClaudeGen:
+import httpx
+
+from ..base import GenBase
+from ..http import get_client, request_slot
+from ..ratelimit import get_rate_limiter, estimate_tokens, parse_reset, RetryableError
+
+URL = 'https://api.anthropic.com/v1/messages'
+RETRYABLE_STATUS = (429, 500, 502, 503, 504, 529)
+
+class ClaudeGen(GenBase):
 
     def __init__(self, model):
 
         self.api_key=os.environ['ANTHROPIC_API_KEY']
         self.model = model
+
+    def payload(self, messages, temperature):
+        return {
+            "model": self.model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": 4096
+        }
+
+    def headers(self):
+        return {
+            'x-api-key': self.api_key,
+            'content-type': 'application/json',
+            "anthropic-version": "2023-06-01"
+        }
     
-    def gen(self, messages, temperature=0, top_k=1):
+    async def agen_one(self, messages, temperature=0):
         '''
-        messages: [{'role': 'system', 'content': 'You are an intelligent code assistant'},
-                   {'role': 'user', 'content': 'Translate this program...'},
-                   {'role': 'assistant', 'content': 'Here is the translation...'},
-                   {'role': 'user', 'content': 'Do something else...'}]
-                   
-        <returned>: ['Sure, here is...',
-                     'Okay, let me see...',
-                     ...]
-        len(<returned>) == top_k
+        Draws one sample. The Messages API has no parameter for multiple candidates,
+        so `agen` issues top_k of these requests concurrently.
         '''
         
         from models import ModelException
 
-        if top_k != 1 and temperature == 0:
-            raise ModelException("Top k sampling requires a non-zero temperature")
+        new_messages = [message for message in messages if message['role'] != 'system']
+        limiter = get_rate_limiter('anthropic')
+
+        async def call():
+            try:
+                async with request_slot():
+                    response = await get_client().post(URL,
+                                                       json=self.payload(new_messages, temperature),
+                                                       headers=self.headers())
+            except httpx.TransportError as e:
+                raise RetryableError(f"{type(e).__name__}: {e}")
+            limiter.update(response.headers)
+            if response.status_code in RETRYABLE_STATUS:
+                retry_after = response.headers.get('retry-after')
+                raise RetryableError(response.text,
+                                     retry_after=parse_reset(retry_after) if retry_after else None,
+                                     rate_limited=response.status_code == 429)
+            if response.status_code != 200:
+                raise ModelException(response.json()['error']['message'])
+            response = response.json()
+            if len(response['content']) > 1:
+                raise ModelException("Claude returned multiple responses")
+            return response
+
+        try:
+            response = await limiter.run(call, tokens=estimate_tokens(new_messages))
+        except Exception as e:
+            raise ModelException(f"Claude API Error: {e}")
+
+        return response['content'][0]['text']
+
+    async def astream(self, messages, temperature=0):
+        '''
+        Draws one sample as a stream of server-sent events, yielding the text as it is generated.
+        Closing the iterator closes the connection, which stops the generation.
+        Only opening the stream is retried; an error in the middle of a response is raised.
+        '''
+
+        from models import ModelException
 
         new_messages = [message for message in messages if message['role'] != 'system']
-        url = 'https://api.anthropic.com/v1/messages'
+        limiter = get_rate_limiter('anthropic')
+        client = get_client()
 
-        retry_count = 0
-        while True:
+        async def open_stream():
+            request = client.build_request('POST', URL,
+                                           json={**self.payload(new_messages, temperature), "stream": True},
+                                           headers=self.headers())
             try:
-                response = requests.post(
-                                url,
-                                json={
-                                    "model": self.model,
-                                    "messages": new_messages,
-                                    "temperature": temperature,
-                                    "max_tokens": 4096
-                                },
-                                headers={
-                                    'x-api-key': self.api_key,
-                                    'content-type': 'application/json',
-                                    "anthropic-version": "2023-06-01"
-                                }
-                            )
-                if response.status_code != 200:
-                    raise ModelException(response.json()['error']['message'])
-                response = response.json()
-                if len(response['content']) > 1:
-                    raise ModelException("Claude returned multiple responses")
-                break
+                response = await client.send(request, stream=True)
+            except httpx.TransportError as e:
+                raise RetryableError(f"{type(e).__name__}: {e}")
+            limiter.update(response.headers)
+            if response.status_code != 200:
+                text = (await response.aread()).decode('utf-8', errors='replace')
+                await response.aclose()
+                if response.status_code in RETRYABLE_STATUS:
+                    retry_after = response.headers.get('retry-after')
+                    raise RetryableError(text,
+                                         retry_after=parse_reset(retry_after) if retry_after else None,
+                                         rate_limited=response.status_code == 429)
+                raise ModelException(json.loads(text)['error']['message'])
+            return response
+
+        # The slot is held for the whole response, which occupies a connection until it ends
+        async with request_slot():
+            try:
+                response = await limiter.run(open_stream, tokens=estimate_tokens(new_messages))
             except Exception as e:
-                retry_count += 1
-                if retry_count >= 5:
-                    raise ModelException(f"Claude API Error: {e}")
-                print(f"Claude API Error: {e}. Waiting 10 seconds and retrying")
-                time.sleep(10)
-        
-        if top_k > 1:
-            return [response['content'][0]['text']] + self.gen(messages, temperature, top_k=top_k-1)
-        else:
-            return [response['content'][0]['text']]
+                raise ModelException(f"Claude API Error: {e}")
+            try:
+                async for line in response.aiter_lines():
+                    if not line.startswith('data:'):
+                        continue
+                    event = json.loads(line[len('data:'):])
+                    if event['type'] == 'content_block_delta' and event['delta']['type'] == 'text_delta':
+                        yield event['delta']['text']
+                    elif event['type'] == 'error':
+                        raise ModelException(f"Claude API Error: {event['error']['message']}")
+                    elif event['type'] == 'message_stop':
+                        break
+            except httpx.TransportError as e:
+                raise ModelException(f"Claude API Error: {type(e).__name__}: {e}")
+            finally:
+                await response.aclose()
@@ -1,74 +1,109 @@
-import time
 import os
 import google.generativeai as genai
 
-class GoogleGen:
+from ..base import GenBase
+from ..http import request_slot
+from ..ratelimit import get_rate_limiter, estimate_tokens
+
+class GoogleGen(GenBase):
 
     def __init__(self, model):
 
         genai.configure(api_key=os.environ['GOOGLE_API_KEY'])
+        self.model_name = model
         self.model = genai.GenerativeModel(model)
     
-    def gen(self, messages, temperature=0, top_k=1):
+    def convert(self, messages):
+        remap = lambda x: 'model' if (x == 'assistant') else x
+        return [{'role': remap(message['role']),
+                 'parts': [message['content']]}
+                for message in messages if message['role'] != 'system'
+                ]
+
+    def check_finish_reason(self, finish_reason):
+        # Called for a candidate without any content
+        from models import ModelException
+
+        if finish_reason == 3:
+            raise ModelException("Gemini flagged this for safety reasons")
+        elif finish_reason == 4:
+            raise ModelException("Gemini flagged this for recitation reasons")
+        else:
+            raise ModelException(f"Gemini returned no candidates. Finish reason: {finish_reason}")
+
+    async def agen_one(self, messages, temperature=0):
         '''
-        messages: [{'role': 'system', 'content': 'You are an intelligent code assistant'},
-                   {'role': 'user', 'content': 'Translate this program...'},
-                   {'role': 'assistant', 'content': 'Here is the translation...'},
-                   {'role': 'user', 'content': 'Do something else...'}]
-                   
-        <returned>: ['Sure, here is...',
-                     'Okay, let me see...',
-                     ...]
-        len(<returned>) == top_k
+        Draws one sample. gemini-1.0-pro does not support multiple candidates per request,
+        so `agen` issues top_k of these requests concurrently.
         '''
 
         from models import ModelException
 
-        if top_k != 1 and temperature == 0:
-            raise ModelException("Top k sampling requires a non-zero temperature")
+        new_messages = self.convert(messages)
+        limiter = get_rate_limiter('google')
 
-        remap = lambda x: 'model' if (x == 'assistant') else x
-        new_messages = [{'role': remap(message['role']),
-                        'parts': [message['content']]}
-                        for message in messages if message['role'] != 'system'
-                        ]
-        retry_count = 0
-        while True:
-            try:
-                response = self.model.generate_content(new_messages,
+        async def call():
+            # The client keeps its own gRPC channel open between calls
+            async with request_slot():
+                response = await self.model.generate_content_async(new_messages,
                                 generation_config=genai.types.GenerationConfig(
                                                             candidate_count=1, # Gemini doesn't yet support multiple candidates
                                                             temperature=temperature))
-                
-                if any(len(candidate.content.parts) > 1 for candidate in response.candidates):
-                    raise ModelException("Gemini returned multi-part candidates")
-                elif any(len(candidate.content.parts) == 0 for candidate in response.candidates):
-                    finish_reason = response.candidates[0].finish_reason
-                    if finish_reason == 3:
-                        raise ModelException("Gemini flagged this for safety reasons")
-                    elif finish_reason == 4:
-                        raise ModelException("Gemini flagged this for recitation reasons")
-                    else:
-                        raise ModelException(f"Gemini returned no candidates. Finish reason: {finish_reason}")
-                break
-            except Exception as e:
-                retry_count += 1
-                if retry_count >= 5:
-                    raise ModelException(f"Google API Error: {e}")
-                if "safety reasons" in str(e):
-                    raise ModelException("Gemini flagged this for safety reasons")
-                if "recitation reasons" in str(e):
-                    raise ModelException("Gemini flagged this for recitation reasons")
-                if "Resource has been exhausted" in str(e):
-                    print(f"Google API Error: {e}. Waiting 10 seconds and retrying")
-                else:
-                    raise ModelException(f"Google API Error: {e}")
-                time.sleep(10)
+            
+            if any(len(candidate.content.parts) > 1 for candidate in response.candidates):
+                raise ModelException("Gemini returned multi-part candidates")
+            elif any(len(candidate.content.parts) == 0 for candidate in response.candidates):
+                self.check_finish_reason(response.candidates[0].finish_reason)
+            return response
+
+        try:
+            response = await limiter.run(call,
+                                         tokens=estimate_tokens(messages),
+                                         retryable=lambda e: "Resource has been exhausted" in str(e))
+        except ModelException as e:
+            if "safety reasons" in str(e) or "recitation reasons" in str(e):
+                raise
+            raise ModelException(f"Google API Error: {e}")
+        except Exception as e:
+            raise ModelException(f"Google API Error: {e}")
         
         assert len(response.candidates) == 1
-        this_gen = [response.candidates[0].content.parts[0].text]
+        return response.candidates[0].content.parts[0].text
 
-        if top_k > 1:
-            return this_gen + self.gen(messages, temperature, top_k=top_k-1)
-        else:
-            return this_gen
+    async def astream(self, messages, temperature=0):
+        '''
+        Draws one sample, yielding its text as the chunks of the response arrive.
+        Only starting the request is retried; an error in the middle of a response is raised.
+        '''
+
+        from models import ModelException
+
+        new_messages = self.convert(messages)
+        limiter = get_rate_limiter('google')
+
+        async def call():
+            return await self.model.generate_content_async(new_messages,
+                            generation_config=genai.types.GenerationConfig(candidate_count=1, temperature=temperature),
+                            stream=True)
+
+        async with request_slot():
+            try:
+                response = await limiter.run(call,
+                                             tokens=estimate_tokens(messages),
+                                             retryable=lambda e: "Resource has been exhausted" in str(e))
+            except Exception as e:
+                raise ModelException(f"Google API Error: {e}")
+            try:
+                async for chunk in response:
+                    if not chunk.candidates:
+                        continue
+                    candidate = chunk.candidates[0]
+                    if len(candidate.content.parts) == 0:
+                        if candidate.finish_reason in (3, 4):
+                            self.check_finish_reason(candidate.finish_reason)
+                        continue
+                    yield ''.join(part.text for part in candidate.content.parts)
+            except ModelException:
+                raise
+            except Exception as e:
+                raise ModelException(f"Google API Error: {e}")
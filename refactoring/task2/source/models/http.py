@@ -0,0 +1,54 @@
+import asyncio
+import threading
+import weakref
+
+import httpx
+
+# Upper bound on concurrent requests (and open connections) per event loop, across all backends
+MAX_CONCURRENT_REQUESTS = 16
+
+class LoopState:
+
+    def __init__(self):
+        self.client = httpx.AsyncClient(
+                        limits=httpx.Limits(max_connections=MAX_CONCURRENT_REQUESTS,
+                                            max_keepalive_connections=MAX_CONCURRENT_REQUESTS),
+                        timeout=httpx.Timeout(600, connect=30))
+        self.semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+# asyncio objects are bound to the loop they are used on, so every loop gets its own pool
+_states = weakref.WeakKeyDictionary()
+
+def _state():
+    loop = asyncio.get_running_loop()
+    if loop not in _states:
+        _states[loop] = LoopState()
+    return _states[loop]
+
+def get_client():
+    '''
+    Shared keep-alive HTTP client for the running event loop.
+    '''
+    return _state().client
+
+def request_slot():
+    '''
+    `async with request_slot():` bounds the number of requests in flight on the running event loop.
+    '''
+    return _state().semaphore
+
+_loop = None
+_loop_lock = threading.Lock()
+
+def run_sync(coro):
+    '''
+    Run a coroutine to completion from synchronous code.
+    All synchronous callers share one background event loop, so its connection pool
+    stays warm between calls. Safe to call from several threads at once.
+    '''
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='models-event-loop', daemon=True).start()
+    return asyncio.run_coroutine_threadsafe(coro, _loop).result()
@@ -1,34 +1,111 @@
+import asyncio
 import openai
 from openai import OpenAI
 
-import time
 import os
 
+import numpy as np
+
+from ..http import run_sync
+from ..ratelimit import get_rate_limiter, parse_reset
+from ..vector_store import VectorStore
+
+# Per-request limits of the embeddings endpoint
+MAX_INPUTS_PER_REQUEST = 2048
+MAX_TOKENS_PER_REQUEST = 300000
+
 class OpenAIEmbed:
 
-    def __init__(self, model):
+    def __init__(self, model, store_dir=None):
+        '''
+        If `store_dir` is given, embeddings are persisted there and never requested twice for the same text.
+        '''
 
         self.model = model
-        self.client = OpenAI(api_key=os.environ['OPENAI_API_KEY'])
+        self.client = OpenAI(api_key=os.environ['OPENAI_API_KEY'], max_retries=0)
+        self.store = VectorStore(store_dir) if store_dir is not None else None
 
     def embed(self, text):
+        return self.request([text])[0]
+
+    def embed_many(self, texts):
+        '''
+        texts: ['int add(int a, int b) {...}', ...]
+        <returned>: float32 array of shape (len(texts), dim), unit-normalized if a store is used.
+
+        Inputs are packed into as few requests as the API limits allow.
+        With a store, only texts that have not been embedded before are sent.
+        '''
+        if self.store is None:
+            return np.asarray([vector for batch in self.batches(texts) for vector in self.request(batch)], dtype=np.float32)
+
+        keys = [VectorStore.key(text, self.model) for text in texts]
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in self.store and key not in missing:
+                missing[key] = text
+        missing_keys = list(missing.keys())
+        missing_texts = list(missing.values())
+        done = 0
+        for batch in self.batches(missing_texts):
+            # Persist every batch as soon as it arrives, so an interrupted run keeps its progress
+            self.store.add(missing_keys[done:done + len(batch)], self.request(batch))
+            done += len(batch)
+        return self.store.get(keys)
+
+    def search(self, text, k=10):
+        '''
+        The k stored embeddings most similar to `text`, as (keys, cosine similarities).
+        '''
+        assert self.store is not None, "Search requires a store_dir"
+        # The query is not added to the store, so it does not show up in later searches
+        key = VectorStore.key(text, self.model)
+        query = self.store.get([key]) if key in self.store else self.request([text])
+        keys, scores = self.store.search(query, k=k)
+        return keys[0].tolist(), scores[0].tolist()
+
+    def batches(self, texts):
+        batch = []
+        batch_tokens = 0
+        for text in texts:
+            # Over-estimate tokens (3 characters per token) to stay clear of the limit
+            tokens = len(text) // 3 + 1
+            if batch and (len(batch) == MAX_INPUTS_PER_REQUEST or batch_tokens + tokens > MAX_TOKENS_PER_REQUEST):
+                yield batch
+                batch = []
+                batch_tokens = 0
+            batch.append(text)
+            batch_tokens += tokens
+        if batch:
+            yield batch
+
+    def request(self, texts):
 
         from models import ModelException
 
-        count = 0
-        while True:
-            try:
-                embedding = self.client.embeddings.create(input=text, model=self.model)["data"][0]["embedding"]
-                break
-            except openai.InvalidRequestError as e:
-                raise ModelException(f"Encountered an error with OpenAI API {e}")
-            except (openai.RateLimitError, openai.ServiceUnavailableError, openai.APIError):
-                count += 1
-                if count >= 5:
-                    raise ModelException("Too many retries")
-                print("OpenAI Error. Waiting 10 seconds and retrying")
-                time.sleep(10)
-            except:
-                raise ModelException("Unknown error")
-
-        return embedding
\ No newline at end of file
+        limiter = get_rate_limiter('openai')
+
+        async def call():
+            response = await asyncio.to_thread(self.client.embeddings.create, input=texts, model=self.model)
+            return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+        def retryable(e):
+            if isinstance(e, openai.RateLimitError):
+                # Let the limiter hold back every OpenAI client until the window resets
+                limiter.update(e.response.headers)
+                retry_after = e.response.headers.get('retry-after')
+                e.retry_after = parse_reset(retry_after) if retry_after else None
+                e.rate_limited = True
+                return True
+            return isinstance(e, (openai.APIConnectionError, openai.InternalServerError))
+
+        try:
+            embeddings = run_sync(limiter.run(call, tokens=sum(len(text) for text in texts) // 4, retryable=retryable))
+        except openai.BadRequestError as e:
+            raise ModelException(f"Encountered an error with OpenAI API {e}")
+        except (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError):
+            raise ModelException("Too many retries")
+        except Exception:
+            raise ModelException("Unknown error")
+
+        return embeddings
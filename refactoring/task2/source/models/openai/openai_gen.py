@@ -1,18 +1,19 @@
 import os
 
-import time
-import os
-
+from ..base import GenBase
 
 
-class OpenAIGen:
+class OpenAIGen(GenBase):
 
     def __init__(self, model):
 
         self.model = model
 
-    def gen(self, messages, temperature=0, seed=True, top_k=1):
+    async def agen(self, messages, temperature=0, top_k=1, quorum=None, seed=True):
         '''
+        The Chat Completions API returns several candidates for one request (`n`),
+        so all samples come back in a single round trip and `quorum` has nothing to cut short.
+
         messages: [{'role': 'system', 'content': 'You are an intelligent code assistant'},
                    {'role': 'user', 'content': 'Translate this program...'},
                    {'role': 'assistant', 'content': 'Here is the translation...'},
@@ -21,7 +22,7 @@ class OpenAIGen:
         <returned>: ['Sure, here is...',
                      'Okay, let me see...',
                      ...]
-        len(<returned>) == top_k
+        len(<returned>) == top_k, or == quorum if a quorum is given
         '''
         # This is a dummy implementation for demonstration purposes.
         from .. import ModelException
@@ -29,8 +30,9 @@ class OpenAIGen:
         if top_k != 1 and temperature == 0:
             raise ModelException("Top k sampling requires a non-zero temperature")
 
+        n = top_k if quorum is None else min(quorum, top_k)
         responses = []
-        for _ in range(top_k):
+        for _ in range(n):
             response = """
 <FUNC>
 // Hello World
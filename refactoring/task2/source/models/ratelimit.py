@@ -0,0 +1,196 @@
+import asyncio
+import random
+import threading
+import time
+from datetime import datetime, timezone
+
+# Conservative default budgets per provider. Override them with `configure_rate_limit`
+# to match the tier of the account in use.
+DEFAULT_LIMITS = {
+    'anthropic': {'requests_per_minute': 50,  'tokens_per_minute': 40000},
+    'openai':    {'requests_per_minute': 500, 'tokens_per_minute': 200000},
+    'google':    {'requests_per_minute': 60,  'tokens_per_minute': 1000000},
+}
+
+DISPLAY_NAMES = {'anthropic': 'Claude', 'openai': 'OpenAI', 'google': 'Google'}
+
+class RetryableError(Exception):
+    '''
+    Raised by a backend for failures that are worth retrying (rate limits, overload, network errors).
+    `retry_after` is the delay in seconds requested by the server, if any.
+    '''
+
+    def __init__(self, message, retry_after=None, rate_limited=False):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.rate_limited = rate_limited
+
+
+class TokenBucket:
+    '''
+    Holds up to `capacity` units and refills at `rate` units per second.
+    A caller that takes more than is available goes into debt and waits until the debt is repaid,
+    so concurrent callers are served in the order they arrived.
+    '''
+
+    def __init__(self, capacity, rate):
+        self.capacity = capacity
+        self.rate = rate
+        self.level = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, amount):
+        # Returns how long the caller has to wait before `amount` is available
+        with self.lock:
+            now = time.monotonic()
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+            self.updated = now
+            self.level -= amount
+            return max(0.0, -self.level / self.rate)
+
+    def drain(self):
+        # The server reported that the budget is used up
+        with self.lock:
+            self.level = min(self.level, 0)
+
+
+class RateLimiter:
+    '''
+    Process-wide request and token budgets for one provider, shared by all of its clients.
+    Every wait caused by the budgets, by server-requested pauses or by backoff is added to `throttled_time`.
+    '''
+
+    def __init__(self, name, requests_per_minute, tokens_per_minute, max_retries=5, base_delay=1.0, max_delay=60.0):
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute, requests_per_minute / 60)
+        self.tokens = TokenBucket(tokens_per_minute, tokens_per_minute / 60)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.paused_until = 0.0
+        self.throttled_time = 0.0
+        self.retries = 0
+        self.lock = threading.Lock()
+
+    async def acquire(self, tokens=0):
+        wait = max(self.requests.reserve(1), self.tokens.reserve(tokens), self.paused_until - time.monotonic())
+        if wait > 0:
+            with self.lock:
+                self.throttled_time += wait
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds):
+        # Hold back every caller of this provider, not only the one that was rate limited,
+        # so that they do not all hit the limit again at the same moment
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def backoff_delay(self, attempt, retry_after=None):
+        if retry_after is not None:
+            return retry_after
+        # Exponential backoff with full jitter
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def update(self, headers):
+        '''
+        Synchronize with the rate-limit headers of a response (Anthropic and OpenAI formats).
+        '''
+        for kind, bucket in [('requests', self.requests), ('tokens', self.tokens)]:
+            remaining = headers.get(f'anthropic-ratelimit-{kind}-remaining', headers.get(f'x-ratelimit-remaining-{kind}'))
+            reset = headers.get(f'anthropic-ratelimit-{kind}-reset', headers.get(f'x-ratelimit-reset-{kind}'))
+            if remaining is None or reset is None:
+                continue
+            try:
+                if int(remaining) > 0:
+                    continue
+            except ValueError:
+                continue
+            bucket.drain()
+            seconds = parse_reset(reset)
+            if seconds is not None:
+                self.pause(seconds)
+
+    async def run(self, call, tokens=0, retryable=lambda e: isinstance(e, RetryableError)):
+        '''
+        Await `call()` within the budget, retrying failures for which `retryable` is true.
+        The last exception is re-raised once `max_retries` attempts have failed.
+        '''
+        attempt = 0
+        while True:
+            await self.acquire(tokens)
+            try:
+                return await call()
+            except Exception as e:
+                attempt += 1
+                if attempt >= self.max_retries or not retryable(e):
+                    raise
+                delay = self.backoff_delay(attempt, getattr(e, 'retry_after', None))
+                if getattr(e, 'rate_limited', False):
+                    self.pause(delay)
+                with self.lock:
+                    self.retries += 1
+                    self.throttled_time += delay
+                print(f"{DISPLAY_NAMES.get(self.name, self.name)} API Error: {e}. Waiting {delay:.1f} seconds and retrying")
+                await asyncio.sleep(delay)
+
+    def stats(self):
+        return {'throttled_time': self.throttled_time, 'retries': self.retries}
+
+
+def parse_reset(value):
+    '''
+    Seconds until a rate-limit window resets.
+    Accepts RFC 3339 timestamps (Anthropic), durations such as "1m30s" or "250ms" (OpenAI),
+    and plain numbers of seconds (Retry-After).
+    '''
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        reset = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        return max(0.0, (reset - datetime.now(timezone.utc)).total_seconds())
+    except ValueError:
+        pass
+    seconds = 0.0
+    number = ''
+    units = {'h': 3600, 'm': 60, 's': 1, 'ms': 0.001}
+    i = 0
+    while i < len(value):
+        c = value[i]
+        if c.isdigit() or c == '.':
+            number += c
+            i += 1
+            continue
+        unit = 'ms' if value.startswith('ms', i) else c
+        if unit not in units or number == '':
+            return None
+        seconds += float(number) * units[unit]
+        number = ''
+        i += len(unit)
+    return seconds
+
+
+def estimate_tokens(messages):
+    # About 4 characters per token, which is close enough for budgeting
+    return sum(len(message['content']) for message in messages) // 4
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def get_rate_limiter(provider):
+    with _limiters_lock:
+        if provider not in _limiters:
+            _limiters[provider] = RateLimiter(provider, **DEFAULT_LIMITS[provider])
+        return _limiters[provider]
+
+def configure_rate_limit(provider, requests_per_minute, tokens_per_minute, **kwargs):
+    with _limiters_lock:
+        _limiters[provider] = RateLimiter(provider, requests_per_minute, tokens_per_minute, **kwargs)
+        return _limiters[provider]
+
+def rate_limit_stats():
+    with _limiters_lock:
+        return {provider: limiter.stats() for provider, limiter in _limiters.items()}
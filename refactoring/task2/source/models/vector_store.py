@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+class VectorStore:
+    '''
+    Append-only store of unit-normalized float32 vectors, keyed by content hash.
+
+    <store_dir>/vectors.f32  raw row-major float32 matrix, memory-mapped on access
+    <store_dir>/keys.txt     one key per line; line i is the key of row i
+    <store_dir>/meta.json    {"dim": ...}
+
+    Vectors are appended before their keys, so an interrupted write leaves at most
+    some unreferenced bytes at the end of vectors.f32 (or keys without a complete vector).
+    Both files are cut back to their common length on load, so later appends stay aligned.
+    '''
+
+    def __init__(self, store_dir, dim=None):
+        self.store_dir = Path(store_dir)
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        self.vectors_path = self.store_dir/'vectors.f32'
+        self.keys_path = self.store_dir/'keys.txt'
+        self.meta_path = self.store_dir/'meta.json'
+
+        self.dim = dim
+        if self.meta_path.exists():
+            self.dim = json.loads(self.meta_path.read_text())['dim']
+
+        self.keys = []
+        if self.keys_path.exists():
+            self.keys = self.keys_path.read_text().split()
+        if self.dim is not None and self.vectors_path.exists():
+            # Drop keys whose vectors were not fully written, and vectors whose keys were not written
+            stored_keys = len(self.keys)
+            self.keys = self.keys[:os.path.getsize(self.vectors_path) // (4 * self.dim)]
+            if os.path.getsize(self.vectors_path) != 4 * self.dim * len(self.keys):
+                os.truncate(self.vectors_path, 4 * self.dim * len(self.keys))
+            if len(self.keys) != stored_keys:
+                self.keys_path.write_text(''.join(key + '\n' for key in self.keys))
+        self.rows = {key: row for row, key in enumerate(self.keys)}
+        self._matrix = None
+
+    @staticmethod
+    def key(text, model=''):
+        return hashlib.sha256(f'{model}\0{text}'.encode('utf-8')).hexdigest()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.rows
+
+    def matrix(self):
+        # (len(self), dim) read-only view of every stored vector, backed by the file
+        if self._matrix is None or self._matrix.shape[0] != len(self):
+            if len(self) == 0:
+                return np.zeros((0, self.dim or 0), dtype=np.float32)
+            self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(len(self), self.dim))
+        return self._matrix
+
+    def add(self, keys, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+            self.meta_path.write_text(json.dumps({'dim': self.dim}))
+        assert vectors.shape[1] == self.dim, f"Expected vectors of dimension {self.dim}, got {vectors.shape[1]}"
+
+        new = [i for i, key in enumerate(keys) if key not in self.rows]
+        # The same key may appear twice in one batch
+        new = list({keys[i]: i for i in new}.values())
+        if not new:
+            return
+        vectors = vectors[new]
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+
+        with open(self.vectors_path, 'ab') as f:
+            f.write(vectors.tobytes())
+        with open(self.keys_path, 'a') as f:
+            f.write(''.join(keys[i] + '\n' for i in new))
+        for i in new:
+            self.rows[keys[i]] = len(self.keys)
+            self.keys.append(keys[i])
+        self._matrix = None
+
+    def get(self, keys):
+        return np.asarray(self.matrix()[[self.rows[key] for key in keys]])
+
+    def search(self, queries, k=10, chunk_size=65536):
+        '''
+        Top-k cosine similarity search.
+        queries: a vector of shape (dim,) or a matrix of shape (m, dim).
+        <returned>: (keys, scores), each of shape (m, k') with k' = min(k, len(self)), best match first.
+        The store is scanned in chunks, so memory use does not grow with its size.
+        '''
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(norms == 0, 1, norms)
+        k = min(k, len(self))
+        best_scores = np.zeros((queries.shape[0], 0), dtype=np.float32)
+        best_rows = np.zeros((queries.shape[0], 0), dtype=np.int64)
+        if k == 0:
+            return np.zeros(best_rows.shape, dtype=object), best_scores
+
+        matrix = self.matrix()
+        for start in range(0, len(self), chunk_size):
+            block = matrix[start:start + chunk_size]
+            scores = queries @ block.T
+            rows = np.broadcast_to(np.arange(start, start + block.shape[0]), scores.shape)
+            # Keep the k best of the previous candidates and this chunk
+            best_scores = np.concatenate([best_scores, scores], axis=1)
+            best_rows = np.concatenate([best_rows, rows], axis=1)
+            if best_scores.shape[1] > k:
+                top = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+                best_scores = np.take_along_axis(best_scores, top, axis=1)
+                best_rows = np.take_along_axis(best_rows, top, axis=1)
+
+        order = np.argsort(-best_scores, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best_rows = np.take_along_axis(best_rows, order, axis=1)
+        keys = np.array([[self.keys[row] for row in query_rows] for query_rows in best_rows], dtype=object)
+        return keys, best_scores
@@ -1,5 +1,11 @@
 #include "FunctionVisitAction.h"
 
+#include "llvm/Bitcode/BitcodeWriter.h"
+#include "llvm/Support/FileSystem.h"
+#include "llvm/Support/raw_ostream.h"
+
+#include <fstream>
+
 using namespace clang;
 
 std::unique_ptr<ASTConsumer>
@@ -34,13 +40,31 @@ void FunctionVisitAction::EndSourceFileAction() {
         std::cerr << "Failed to generate module\n";
         return;
     }
+    if (!cachePrefix.empty()) {
+        // The bitcode is written first, so a .json file is only present next to a complete .bc file
+        std::error_code EC;
+        llvm::raw_fd_ostream BCFile(cachePrefix + ".bc", EC, llvm::sys::fs::OF_None);
+        if (EC) {
+            std::cerr << "Unable to write " << cachePrefix << ".bc: " << EC.message() << "\n";
+        } else {
+            llvm::WriteBitcodeToFile(*M, BCFile);
+            BCFile.close();
+            std::ofstream JSONFile(cachePrefix + ".json");
+            JSONFile << json(fileData);
+        }
+    }
+    addModule(std::move(M));
+}
+
+bool FunctionVisitAction::addModule(std::unique_ptr<llvm::Module> M) {
     if (linker == nullptr) {
         this->mod = std::move(M);
         linker = new llvm::Linker(*(this->mod));
     } else {
         if (linker->linkInModule(std::move(M))) {
             std::cerr << "Error linking module\n";
-            return;
+            return false;
         }
     }
+    return true;
 }
\ No newline at end of file
@@ -19,6 +19,10 @@ using json = nlohmann::json;
 
 class FunctionVisitAction : public EmitLLVMOnlyAction {
     public:
+        // Modules loaded from the cache must live in the same context as the ones generated here
+        explicit FunctionVisitAction(llvm::LLVMContext *context = nullptr)
+            : EmitLLVMOnlyAction(context) {}
+
         std::unique_ptr<ASTConsumer>
         CreateASTConsumer(CompilerInstance &compiler, llvm::StringRef inFile);
     
@@ -30,8 +34,20 @@ class FunctionVisitAction : public EmitLLVMOnlyAction {
         std::unique_ptr<llvm::Module> getModule() {
             return std::move(mod);
         }
+
+        // Link the module of one translation unit into the combined module
+        bool addModule(std::unique_ptr<llvm::Module> M);
+        void addData(const json &entry) {
+            data.insert(entry);
+        }
+        // If set, the module and data of the next translation unit are also
+        // written to <cachePrefix>.bc and <cachePrefix>.json
+        void setCachePrefix(const std::string &prefix) {
+            cachePrefix = prefix;
+        }
     
     private:
+        std::string cachePrefix;
         std::unordered_set<json> data;
         std::unique_ptr<llvm::Module> mod;
         llvm::Linker* linker = nullptr;
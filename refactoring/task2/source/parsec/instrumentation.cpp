@@ -140,4 +140,76 @@ void addInstrumentation(Module &M) {
 		// Close file
 		Builder.CreateCall(Fclose, {FilePtr});
 	}
-}
\ No newline at end of file
+}
+
+// Value tags of the binary trace format, see trace_runtime.h
+enum TraceTag { TagInt = 0, TagFloat = 1, TagPointer = 2, TagString = 3, TagUnsupported = 4 };
+
+// Append the (tag, value) pair that records V to TraceArgs
+static void addTraceValue(IRBuilder<> &Builder, Value *V, std::vector<Value *> &TraceArgs) {
+	LLVMContext &Context = Builder.getContext();
+	Type *Int32Ty = Type::getInt32Ty(Context);
+	Type *Int64Ty = Type::getInt64Ty(Context);
+	Type *ValueType = V->getType();
+
+	if (ValueType->isIntegerTy()) {
+		TraceArgs.push_back(ConstantInt::get(Int32Ty, TagInt));
+		TraceArgs.push_back(ValueType->isIntegerTy(1) ? Builder.CreateZExt(V, Int64Ty) : Builder.CreateSExtOrTrunc(V, Int64Ty));
+	} else if (ValueType->isFloatingPointTy()) {
+		TraceArgs.push_back(ConstantInt::get(Int32Ty, TagFloat));
+		TraceArgs.push_back(Builder.CreateFPCast(V, Type::getDoubleTy(Context)));
+	} else if (ValueType->isPointerTy() && ValueType->getPointerElementType()->isIntegerTy(8)) { // char* (i8*)
+		TraceArgs.push_back(ConstantInt::get(Int32Ty, TagString));
+		TraceArgs.push_back(V);
+	} else if (ValueType->isPointerTy()) {
+		TraceArgs.push_back(ConstantInt::get(Int32Ty, TagPointer));
+		TraceArgs.push_back(Builder.CreatePtrToInt(V, Int64Ty));
+	} else {
+		TraceArgs.push_back(ConstantInt::get(Int32Ty, TagUnsupported));
+		TraceArgs.push_back(ConstantInt::get(Int64Ty, 0));
+	}
+}
+
+void addBinaryInstrumentation(Module &M) {
+	// Record the arguments and return value of every function with a single call to the trace runtime
+	// before each return. The runtime resolves the trace path once per process and buffers the records.
+	LLVMContext &Context = M.getContext();
+	IRBuilder<> Builder(Context);
+
+	// void __parsec_trace_record(i32 id, i8 *name, i32 nargs, i32 nrets, ...)
+	FunctionCallee TraceRecord = M.getOrInsertFunction(
+		"__parsec_trace_record", FunctionType::get(Type::getVoidTy(Context),
+									{IntegerType::getInt32Ty(Context),
+									PointerType::get(Type::getInt8Ty(Context), 0),
+									IntegerType::getInt32Ty(Context),
+									IntegerType::getInt32Ty(Context)}, true));
+
+	uint32_t FunctionId = 0;
+	for (Function &F : M) {
+		// Skip functions that are not defined in the module
+		if (F.isDeclaration()) continue;
+
+		Value *Name = nullptr;
+		for (auto &BB : F) {
+			ReturnInst *Ret = dyn_cast<ReturnInst>(BB.getTerminator());
+			if (!Ret) continue;
+			Builder.SetInsertPoint(Ret);
+			if (!Name) Name = Builder.CreateGlobalStringPtr(F.getName());
+
+			Value *RetVal = Ret->getReturnValue();
+			std::vector<Value *> TraceArgs = {
+				ConstantInt::get(Type::getInt32Ty(Context), FunctionId),
+				Name,
+				ConstantInt::get(Type::getInt32Ty(Context), F.arg_size()),
+				ConstantInt::get(Type::getInt32Ty(Context), RetVal ? 1 : 0)};
+			for (auto &Arg : F.args()) {
+				addTraceValue(Builder, &Arg, TraceArgs);
+			}
+			if (RetVal) {
+				addTraceValue(Builder, RetVal, TraceArgs);
+			}
+			Builder.CreateCall(TraceRecord, TraceArgs);
+		}
+		FunctionId++;
+	}
+}
@@ -9,5 +9,6 @@
 #include "llvm/IR/DerivedTypes.h"
 
 void addInstrumentation(llvm::Module &M);
+void addBinaryInstrumentation(llvm::Module &M);
 
 #endif // INSTRUMENTATION_H
\ No newline at end of file
@@ -8,6 +8,10 @@
 #include "llvm/Support/VirtualFileSystem.h"
 #include "llvm/Support/ToolOutputFile.h"
 #include "llvm/Bitcode/BitcodeWriter.h"
+#include "llvm/IRReader/IRReader.h"
+#include "llvm/Support/SourceMgr.h"
+#include "llvm/Support/xxhash.h"
+#include "llvm/ADT/StringExtras.h"
 
 #include "llvm/Target/TargetMachine.h"
 #include "llvm/Support/FileSystem.h"
@@ -28,6 +32,7 @@
 #include "FunctionVisitAction.h"
 #include "ToolActionWrapper.h"
 #include "instrumentation.h"
+#include "trace_runtime.h"
 
 using namespace clang;
 using namespace clang::tooling;
@@ -43,6 +48,65 @@ bool compareFilenames(std::string filename1, std::string filename2) {
 	return baseName1 == baseName2;
 }
 
+// Identifies the contents of a translation unit and the command it is compiled with.
+// Headers are not part of the key: the caller (build.rs) clears the cache when a header changes.
+std::string translationUnitKey(const CompilationDatabase &compilations, const std::string &source) {
+	std::string keyData = source;
+	auto buffer = llvm::MemoryBuffer::getFile(source);
+	if (buffer) {
+		keyData.push_back('\0');
+		keyData += buffer.get()->getBuffer().str();
+	}
+	for (const CompileCommand &command : compilations.getCompileCommands(source)) {
+		for (const std::string &arg : command.CommandLine) {
+			keyData.push_back('\0');
+			keyData += arg;
+		}
+	}
+	return llvm::utohexstr(llvm::xxHash64(keyData));
+}
+
+// Add the module and function data that an earlier run stored for a translation unit
+bool loadCachedTranslationUnit(FunctionVisitAction &action, llvm::LLVMContext &context, const std::string &prefix) {
+	if (!llvm::sys::fs::exists(prefix + ".bc") || !llvm::sys::fs::exists(prefix + ".json")) {
+		return false;
+	}
+	std::ifstream JSONFile(prefix + ".json");
+	json entries = json::parse(JSONFile, nullptr, false);
+	if (entries.is_discarded()) {
+		return false;
+	}
+	llvm::SMDiagnostic Err;
+	std::unique_ptr<llvm::Module> M = llvm::parseIRFile(prefix + ".bc", Err, context);
+	if (!M) {
+		return false;
+	}
+	for (const json &entry : entries) {
+		action.addData(entry);
+	}
+	return action.addModule(std::move(M));
+}
+
+// Compile the runtime of the binary trace format to parsec_trace.o
+bool compileTraceRuntime() {
+	std::ofstream sourceFile("parsec_trace.c");
+	if (!sourceFile.is_open()) {
+		std::cerr << "Unable to open file parsec_trace.c\n";
+		return false;
+	}
+	sourceFile << TraceRuntimeSource;
+	sourceFile.close();
+	const char *compiler = std::getenv("CC");
+	std::string command = std::string(compiler ? compiler : "cc") + " -O2 -fPIC -c parsec_trace.c -o parsec_trace.o";
+	int result = std::system(command.c_str());
+	llvm::sys::fs::remove("parsec_trace.c");
+	if (result != 0) {
+		llvm::errs() << "Failed to compile the trace runtime\n";
+		return false;
+	}
+	return true;
+}
+
 int main(int argc, const char **argv) {
 	auto expectedParser = CommonOptionsParser::create(argc, argv, FindFunctionCategory, llvm::cl::ZeroOrMore, "ast-visitor <source0> [... <sourceN>] --");
 	if (!expectedParser) {
@@ -70,12 +134,32 @@ int main(int argc, const char **argv) {
 	// tool.mapVirtualFile("instrumentation.cpp", cpp_source);
 
 	CommonOptionsParser& optionsParser = expectedParser.get();
-	ClangTool tool(optionsParser.getCompilations(),
-				   optionsParser.getSourcePathList());
-	ToolActionWrapper actionWrapper(new FunctionVisitAction());
-	tool.run(&actionWrapper);
-	
+	llvm::LLVMContext Context;
+	ToolActionWrapper actionWrapper(new FunctionVisitAction(&Context));
 	FunctionVisitAction *action = static_cast<FunctionVisitAction*>(actionWrapper.getAction());
+
+	// With PARSEC_CACHE_DIR set, the module and function data of every translation unit are cached,
+	// and only the translation units that changed since the last run are parsed and compiled again
+	const char *cacheDir = std::getenv("PARSEC_CACHE_DIR");
+	if (cacheDir == nullptr) {
+		ClangTool tool(optionsParser.getCompilations(),
+					   optionsParser.getSourcePathList());
+		tool.run(&actionWrapper);
+	} else {
+		llvm::sys::fs::create_directories(cacheDir);
+		for (const std::string &source : optionsParser.getSourcePathList()) {
+			std::string prefix = std::string(cacheDir) + "/" + translationUnitKey(optionsParser.getCompilations(), source);
+			if (loadCachedTranslationUnit(*action, Context, prefix)) {
+				std::cout << "Reusing cached translation unit: " << source << "\n";
+				continue;
+			}
+			ClangTool tool(optionsParser.getCompilations(), std::vector<std::string>{source});
+			action->setCachePrefix(prefix);
+			tool.run(&actionWrapper);
+			action->setCachePrefix("");
+		}
+	}
+	
 	std::unique_ptr<llvm::Module> M = action->getModule();
 	std::unordered_set<json> jsonData = action->getData();
 
@@ -137,8 +221,15 @@ int main(int argc, const char **argv) {
 		std::cerr << "Unable to open file functions.json\n";
 		return 1;
 	}
-	// Add instrumentation to the module
-	addInstrumentation(*M);
+	// Add instrumentation to the module. With PARSEC_TRACE=binary, the calls are recorded in a
+	// buffered binary trace (instrumented.bin) instead of one line of instrumented.json per call.
+	const char *traceFormat = std::getenv("PARSEC_TRACE");
+	bool binaryTrace = traceFormat != nullptr && std::string(traceFormat) == "binary";
+	if (binaryTrace) {
+		addBinaryInstrumentation(*M);
+	} else {
+		addInstrumentation(*M);
+	}
 
 	std::error_code EC;
 	llvm::legacy::PassManager PM;
@@ -181,18 +272,30 @@ int main(int argc, const char **argv) {
     ObjFile.close();
 	// std::cout << "Instrumented object file written to instrumented.o\n";
 
-	 // Invoke `ar` to create a static library
-	 int result = std::system("ar rcs libfoo.a instrumented.o");
+	 std::string objects = "instrumented.o";
+	 if (binaryTrace) {
+		 if (!compileTraceRuntime()) {
+			 return 1;
+		 }
+		 objects += " parsec_trace.o";
+	 }
+
+	 // Invoke `ar` to create a static library. Start from an empty archive, so that
+	 // the trace runtime does not stay in it after switching back to the text format.
+	 llvm::sys::fs::remove("libfoo.a");
+	 int result = std::system(("ar rcs libfoo.a " + objects).c_str());
 	 if (result != 0) {
 		 llvm::errs() << "Failed to create static library\n";
 		 return 1;
 	 }
 	 std::cout << "Static library created: libfoo.a\n";
-	 // Clean up the object file
-	 EC = llvm::sys::fs::remove("instrumented.o", false);
-	 if (EC) {
-		 llvm::errs() << "Failed to remove object file: " << EC.message() << "\n";
-		 return 1;
+	 // Clean up the object files
+	 for (const char *object : {"instrumented.o", "parsec_trace.o"}) {
+		 EC = llvm::sys::fs::remove(object);
+		 if (EC) {
+			 llvm::errs() << "Failed to remove object file: " << EC.message() << "\n";
+			 return 1;
+		 }
 	 }
 	 return 0;
 }
\ No newline at end of file
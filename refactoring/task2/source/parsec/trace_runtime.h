@@ -0,0 +1,171 @@
+#ifndef TRACE_RUNTIME_H
+#define TRACE_RUNTIME_H
+
+// C source of the runtime that addBinaryInstrumentation calls into.
+// main.cpp compiles it and adds it to libfoo.a next to the instrumented module.
+static const char *TraceRuntimeSource = R"runtime(// Runtime of parsec's binary trace format, linked into libfoo.a when PARSEC_TRACE=binary.
+//
+// Records are appended to a per-process buffer, which is written to
+// $INSTRUMENTATION_PATH/instrumented.bin (./instrumented.bin by default) when it is full
+// and at exit. Each write is one chunk:
+//   "PTRC" | u16 version | u16 reserved | u32 pid | u32 payload length | payload
+// Several processes may append to the same file; a chunk is written with a single
+// O_APPEND write, so chunks do not interleave. The payload is a sequence of records
+// (little-endian):
+//   name: u8 1 | u32 function id | u8 length | name bytes   (once per function and process)
+//   call: u8 2 | u32 function id | u8 #args | u8 #returns | values
+// and every value is a u8 tag followed by
+//   int: i64 | float: f64 | pointer: u64 | string: u8 length, bytes | unsupported: nothing
+#include <fcntl.h>
+#include <pthread.h>
+#include <stdarg.h>
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <unistd.h>
+
+enum { TAG_INT = 0, TAG_FLOAT = 1, TAG_POINTER = 2, TAG_STRING = 3, TAG_UNSUPPORTED = 4 };
+enum { RECORD_NAME = 1, RECORD_CALL = 2 };
+
+#define PARSEC_TRACE_VERSION 1
+#define PARSEC_TRACE_HEADER 16
+#define PARSEC_TRACE_CAPACITY (1 << 20)
+#define PARSEC_TRACE_MAX_STRING 100
+
+static unsigned char parsec_trace_buffer[PARSEC_TRACE_CAPACITY];
+static size_t parsec_trace_used = PARSEC_TRACE_HEADER;
+static int parsec_trace_fd = -2; // -2: not opened yet, -1: could not be opened
+static unsigned char *parsec_trace_seen = NULL; // Whether the name of a function id was written
+static size_t parsec_trace_seen_size = 0;
+static pthread_mutex_t parsec_trace_lock = PTHREAD_MUTEX_INITIALIZER;
+
+static void parsec_trace_put(const void *data, size_t size) {
+	memcpy(parsec_trace_buffer + parsec_trace_used, data, size);
+	parsec_trace_used += size;
+}
+
+static void parsec_trace_put_u8(uint8_t value) {
+	parsec_trace_buffer[parsec_trace_used++] = value;
+}
+
+static void parsec_trace_put_u32(unsigned char *at, uint32_t value) {
+	for (int i = 0; i < 4; i++) at[i] = (unsigned char)(value >> (8 * i));
+}
+
+static void parsec_trace_flush_locked(void) {
+	if (parsec_trace_used == PARSEC_TRACE_HEADER || parsec_trace_fd == -1) {
+		parsec_trace_used = PARSEC_TRACE_HEADER;
+		return;
+	}
+	unsigned char *header = parsec_trace_buffer;
+	memcpy(header, "PTRC", 4);
+	header[4] = PARSEC_TRACE_VERSION; header[5] = 0;
+	header[6] = 0; header[7] = 0;
+	parsec_trace_put_u32(header + 8, (uint32_t)getpid());
+	parsec_trace_put_u32(header + 12, (uint32_t)(parsec_trace_used - PARSEC_TRACE_HEADER));
+	size_t written = 0;
+	while (written < parsec_trace_used) {
+		ssize_t n = write(parsec_trace_fd, parsec_trace_buffer + written, parsec_trace_used - written);
+		if (n <= 0) break;
+		written += (size_t)n;
+	}
+	parsec_trace_used = PARSEC_TRACE_HEADER;
+}
+
+static void parsec_trace_flush(void) {
+	pthread_mutex_lock(&parsec_trace_lock);
+	parsec_trace_flush_locked();
+	pthread_mutex_unlock(&parsec_trace_lock);
+}
+
+static void parsec_trace_after_fork(void) {
+	// The parent flushes what was buffered before the fork; the child starts a new stream
+	parsec_trace_used = PARSEC_TRACE_HEADER;
+	if (parsec_trace_seen) memset(parsec_trace_seen, 0, parsec_trace_seen_size);
+	pthread_mutex_init(&parsec_trace_lock, NULL);
+}
+
+static void parsec_trace_open(void) {
+	// The path is resolved once per process
+	const char *dir = getenv("INSTRUMENTATION_PATH");
+	char path[4096];
+	if (dir) snprintf(path, sizeof(path), "%s/instrumented.bin", dir);
+	else snprintf(path, sizeof(path), "./instrumented.bin");
+	parsec_trace_fd = open(path, O_WRONLY | O_CREAT | O_APPEND | O_CLOEXEC, 0644);
+	atexit(parsec_trace_flush);
+	pthread_atfork(NULL, NULL, parsec_trace_after_fork);
+}
+
+static int parsec_trace_mark_seen(uint32_t id) {
+	// Returns 1 the first time it is called for `id`
+	if (id >= parsec_trace_seen_size) {
+		size_t size = parsec_trace_seen_size ? parsec_trace_seen_size : 1024;
+		while (size <= id) size *= 2;
+		unsigned char *seen = realloc(parsec_trace_seen, size);
+		if (!seen) return 0;
+		memset(seen + parsec_trace_seen_size, 0, size - parsec_trace_seen_size);
+		parsec_trace_seen = seen;
+		parsec_trace_seen_size = size;
+	}
+	if (parsec_trace_seen[id]) return 0;
+	parsec_trace_seen[id] = 1;
+	return 1;
+}
+
+// Called by the instrumented functions before they return, with `nargs + nrets` (tag, value) pairs.
+// Integers are passed as int64_t, floats as double, pointers as uint64_t and strings as char *.
+void __parsec_trace_record(uint32_t id, const char *name, uint32_t nargs, uint32_t nrets, ...) {
+	uint32_t nvalues = nargs + nrets;
+	if (nvalues > 255) return;
+	// Worst case: a name record, the call record and a string for every value
+	size_t needed = (1 + 4 + 1 + 255) + (1 + 4 + 1 + 1) + nvalues * (1 + 1 + PARSEC_TRACE_MAX_STRING);
+
+	pthread_mutex_lock(&parsec_trace_lock);
+	if (parsec_trace_fd == -2) parsec_trace_open();
+	if (parsec_trace_used + needed > PARSEC_TRACE_CAPACITY) parsec_trace_flush_locked();
+
+	unsigned char *at;
+	if (parsec_trace_mark_seen(id)) {
+		size_t length = strnlen(name, 255);
+		parsec_trace_put_u8(RECORD_NAME);
+		at = parsec_trace_buffer + parsec_trace_used; parsec_trace_used += 4;
+		parsec_trace_put_u32(at, id);
+		parsec_trace_put_u8((uint8_t)length);
+		parsec_trace_put(name, length);
+	}
+	parsec_trace_put_u8(RECORD_CALL);
+	at = parsec_trace_buffer + parsec_trace_used; parsec_trace_used += 4;
+	parsec_trace_put_u32(at, id);
+	parsec_trace_put_u8((uint8_t)nargs);
+	parsec_trace_put_u8((uint8_t)nrets);
+
+	va_list values;
+	va_start(values, nrets);
+	for (uint32_t i = 0; i < nvalues; i++) {
+		int tag = va_arg(values, int);
+		parsec_trace_put_u8((uint8_t)tag);
+		if (tag == TAG_INT) {
+			int64_t value = va_arg(values, int64_t);
+			parsec_trace_put(&value, 8);
+		} else if (tag == TAG_FLOAT) {
+			double value = va_arg(values, double);
+			parsec_trace_put(&value, 8);
+		} else if (tag == TAG_POINTER) {
+			uint64_t value = va_arg(values, uint64_t);
+			parsec_trace_put(&value, 8);
+		} else if (tag == TAG_STRING) {
+			const char *value = va_arg(values, const char *);
+			size_t length = value ? strnlen(value, PARSEC_TRACE_MAX_STRING) : 0;
+			parsec_trace_put_u8((uint8_t)length);
+			parsec_trace_put(value, length);
+		} else {
+			(void)va_arg(values, int64_t);
+		}
+	}
+	va_end(values);
+	pthread_mutex_unlock(&parsec_trace_lock);
+}
+)runtime";
+
+#endif // TRACE_RUNTIME_H
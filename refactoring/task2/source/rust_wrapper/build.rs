@@ -2,8 +2,11 @@ extern crate bindgen;
 extern crate serde_json;
 extern crate glob;
 
+use std::collections::hash_map::DefaultHasher;
+use std::collections::HashSet;
 use std::env;
 use std::fs;
+use std::hash::{Hash, Hasher};
 use std::path::{Path, PathBuf};
 use std::process::Command;
 use glob::glob;
@@ -30,6 +33,138 @@ impl ParseCallbacks for Renamer {
     }
 }
 
+// Records, for each stage of this script, a hash of its inputs and of each of its outputs.
+// A stage is skipped when its inputs are unchanged and its outputs are still what it produced.
+// DefaultHasher is not stable across Rust releases, which only costs a rebuild after a toolchain update.
+struct Manifest {
+    path: PathBuf,
+    stages: serde_json::Map<String, serde_json::Value>,
+}
+
+impl Manifest {
+    fn load(path: PathBuf) -> Manifest {
+        let stages = fs::read_to_string(&path).ok()
+            .and_then(|contents| serde_json::from_str::<serde_json::Value>(&contents).ok())
+            .and_then(|value| value.as_object().cloned())
+            .unwrap_or_default();
+        Manifest { path, stages }
+    }
+
+    fn is_fresh(&self, stage: &str, inputs: &str, outputs: &[PathBuf]) -> bool {
+        let entry = match self.stages.get(stage) {
+            Some(entry) => entry,
+            None => return false,
+        };
+        if entry["inputs"].as_str() != Some(inputs) {
+            return false;
+        }
+        outputs.iter().all(|output| {
+            let recorded = entry["outputs"][output.to_str().unwrap()].as_str();
+            recorded.is_some() && hash_file(output).as_deref() == recorded
+        })
+    }
+
+    fn record(&mut self, stage: &str, inputs: &str, outputs: &[PathBuf]) {
+        let mut output_hashes = serde_json::Map::new();
+        for output in outputs {
+            if let Some(hash) = hash_file(output) {
+                output_hashes.insert(output.to_str().unwrap().to_string(), serde_json::Value::String(hash));
+            }
+        }
+        self.stages.insert(stage.to_string(), serde_json::json!({"inputs": inputs, "outputs": output_hashes}));
+        // Written after every stage, so that an interrupted build only redoes the stages that did not finish
+        fs::write(&self.path, serde_json::to_string_pretty(&self.stages).unwrap())
+            .expect("Couldn't write the build manifest!");
+    }
+}
+
+fn hash_file(path: &Path) -> Option<String> {
+    let contents = fs::read(path).ok()?;
+    let mut hasher = DefaultHasher::new();
+    contents.hash(&mut hasher);
+    Some(format!("{:016x}", hasher.finish()))
+}
+
+// Hash the names and contents of `paths` into `hasher`
+fn hash_contents(hasher: &mut DefaultHasher, paths: &[PathBuf]) {
+    for path in paths {
+        path.hash(hasher);
+        fs::read(path).unwrap_or_default().hash(hasher);
+    }
+}
+
+// Like hash_contents, but lines that are commented out with // do not count
+fn hash_uncommented_contents(hasher: &mut DefaultHasher, paths: &[PathBuf]) {
+    for path in paths {
+        path.hash(hasher);
+        let contents = fs::read_to_string(path).unwrap_or_default();
+        for line in contents.lines().filter(|line| !line.trim_start().starts_with("//")) {
+            line.hash(hasher);
+        }
+    }
+}
+
+fn hash_finish(hasher: DefaultHasher) -> String {
+    format!("{:016x}", hasher.finish())
+}
+
+// The name of the function declared by `item`, if it is a function declaration
+fn declared_function(item: &str) -> Option<&str> {
+    let start = item.find("pub fn ")? + "pub fn ".len();
+    let rest = &item[start..];
+    let end = rest.find(|c: char| !(c.is_alphanumeric() || c == '_'))?;
+    Some(&rest[..end])
+}
+
+// Remove the declarations of blocklisted functions from bindgen's output, which is what bindgen itself
+// would produce with those functions blocklisted. Declarations are found in the top-level
+// `extern "C" { ... }` blocks; a block that is left empty is removed.
+fn filter_bindings(bindings: &str, blocklist: &HashSet<&str>) -> String {
+    let mut output = String::with_capacity(bindings.len());
+    let mut lines = bindings.lines();
+    while let Some(line) = lines.next() {
+        if !(line.starts_with("extern \"C\" {") || line.starts_with("unsafe extern \"C\" {")) {
+            output.push_str(line);
+            output.push('\n');
+            continue;
+        }
+        let mut block = String::new();
+        let mut kept = 0;
+        let mut item = String::new();
+        let mut depth = 0i32;
+        for line in lines.by_ref() {
+            if line == "}" {
+                break;
+            }
+            // An item ends with the `;` that closes its signature, after any attributes and doc comments
+            item.push_str(line);
+            item.push('\n');
+            let trimmed = line.trim_start();
+            if trimmed.starts_with("#[") || trimmed.starts_with("//") {
+                // Attributes and doc comments may contain unbalanced brackets in string literals
+                continue;
+            }
+            depth += line.matches(|c| c == '(' || c == '[' || c == '{').count() as i32;
+            depth -= line.matches(|c| c == ')' || c == ']' || c == '}').count() as i32;
+            if depth == 0 && line.trim_end().ends_with(';') {
+                if !declared_function(&item).map_or(false, |name| blocklist.contains(name)) {
+                    block.push_str(&item);
+                    kept += 1;
+                }
+                item.clear();
+            }
+        }
+        block.push_str(&item);
+        if kept > 0 {
+            output.push_str(line);
+            output.push('\n');
+            output.push_str(&block);
+            output.push_str("}\n");
+        }
+    }
+    output
+}
+
 fn main() {
     let cargo_manifest_dir = env::var("CARGO_MANIFEST_DIR").unwrap();
     let c_src_dir = format!("{}/c_src", cargo_manifest_dir);
@@ -42,12 +177,29 @@ fn main() {
     let new_path = format!("{}:{}", parsec_build_dir.display(), env::var("PATH").unwrap_or_default());
     env::set_var("PATH", new_path);
 
-    // First run bear to generate compile_commands.json
-    let status = Command::new("make")
-    .arg("clean")
-    .current_dir(&c_src_dir)
-    .status()
-    .expect(&format!("Failed to make clean in {}", c_src_dir.as_str()));
+    let out_path = PathBuf::from(env::var("OUT_DIR").unwrap());
+    let mut manifest = Manifest::load(out_path.join("build_manifest.json"));
+
+    // Every C source and header, in a stable order
+    let mut c_files: Vec<PathBuf> = glob(&format!("{}/**/*.[ch]", c_src_dir))
+        .expect("Failed to read glob pattern")
+        .filter_map(Result::ok)
+        .collect();
+    c_files.sort();
+    let headers: Vec<PathBuf> = c_files.iter().filter(|path| path.extension().map_or(false, |ext| ext == "h")).cloned().collect();
+
+    // Declaring any rerun-if directive replaces cargo's default of rerunning on every change to the
+    // package, so all the inputs of the stages below are listed. The generated files in c_src are not.
+    println!("cargo:rerun-if-changed=build.rs");
+    println!("cargo:rerun-if-changed=bindgen_blocklist.txt");
+    println!("cargo:rerun-if-changed=c_src/Makefile");
+    for path in &c_files {
+        println!("cargo:rerun-if-changed={}", path.display());
+    }
+    println!("cargo:rerun-if-changed={}", parsec_build_dir.join("parsec").display());
+    println!("cargo:rerun-if-env-changed=PARSEC_BUILD_DIR");
+    println!("cargo:rerun-if-env-changed=PARSEC_TRACE");
+    println!("cargo:rerun-if-env-changed=CC");
 
     // Check bear version. If > 3, run "bear -- make". Otherwise run "bear make"
     let bear_version = Command::new("bear")
@@ -55,35 +207,54 @@ fn main() {
         .output()
         .expect("Failed to get bear version");
     let bear_version = String::from_utf8_lossy(&bear_version.stdout);
-    let bear_version = bear_version.trim();
-    let bear_version_parts: Vec<&str> = bear_version.split('.').collect();
-    let major_version: u32 = bear_version_parts[0].parse().unwrap_or(0);
-    let minor_version: u32 = bear_version_parts.get(1).and_then(|s| s.parse().ok()).unwrap_or(0);
-    let patch_version: u32 = bear_version_parts.get(2).and_then(|s| s.parse().ok()).unwrap_or(0);
-    let bear_version = (major_version, minor_version, patch_version);
-    if bear_version >= (3, 0, 0) {
-        // If bear version is >= 3.0.0, run "bear -- make"
-        let status = Command::new("bear")
-            .arg("--")
+    let bear_version = bear_version.trim().to_string();
+
+    // compile_commands.json only depends on the Makefile and on which files there are, not on their contents
+    let compile_commands_path = PathBuf::from("c_src/compile_commands.json");
+    let mut hasher = DefaultHasher::new();
+    hash_contents(&mut hasher, &[Path::new(&c_src_dir).join("Makefile")]);
+    c_files.hash(&mut hasher);
+    bear_version.hash(&mut hasher);
+    env::var("CC").ok().hash(&mut hasher);
+    let make_inputs = hash_finish(hasher);
+
+    if !manifest.is_fresh("make", &make_inputs, &[compile_commands_path.clone()]) {
+        // First run bear to generate compile_commands.json
+        Command::new("make")
+        .arg("clean")
+        .current_dir(&c_src_dir)
+        .status()
+        .expect(&format!("Failed to make clean in {}", c_src_dir.as_str()));
+
+        let bear_version_parts: Vec<&str> = bear_version.split('.').collect();
+        let major_version: u32 = bear_version_parts[0].parse().unwrap_or(0);
+        let minor_version: u32 = bear_version_parts.get(1).and_then(|s| s.parse().ok()).unwrap_or(0);
+        let patch_version: u32 = bear_version_parts.get(2).and_then(|s| s.parse().ok()).unwrap_or(0);
+        let bear_version = (major_version, minor_version, patch_version);
+        let status = if bear_version >= (3, 0, 0) {
+            // If bear version is >= 3.0.0, run "bear -- make"
+            Command::new("bear")
+                .arg("--")
+                .arg("make")
+                .current_dir(&c_src_dir)
+                .status()
+                .expect(&format!("Failed to generate compile_commands in {}", c_src_dir.as_str()))
+        } else {
+            // If bear version is < 3.0.0, run "bear make"
+            Command::new("bear")
             .arg("make")
             .current_dir(&c_src_dir)
             .status()
-            .expect(&format!("Failed to generate compile_commands in {}", c_src_dir.as_str()));
-    } else {
-        // If bear version is < 3.0.0, run "bear make"
-        let status = Command::new("bear")
-        .arg("make")
-        .current_dir(&c_src_dir)
-        .status()
-        .expect(&format!("Failed to generate compile_commands in {}", c_src_dir.as_str()));
-    }
-    if !status.success() {
-        panic!("Bear failed with exit code: {:?}", status.code());
+            .expect(&format!("Failed to generate compile_commands in {}", c_src_dir.as_str()))
+        };
+        if !status.success() {
+            panic!("Bear failed with exit code: {:?}", status.code());
+        }
+        manifest.record("make", &make_inputs, &[compile_commands_path.clone()]);
     }
 
     // Go through c_src/compile_commands.json, get the list of files
-    let compile_commands_path = PathBuf::from("c_src/compile_commands.json");
-    let compile_commands = std::fs::read_to_string(compile_commands_path)
+    let compile_commands = std::fs::read_to_string(&compile_commands_path)
         .expect("Unable to read compile_commands.json");
     let compile_commands: serde_json::Value = serde_json::from_str(&compile_commands)
         .expect("Unable to parse compile_commands.json");
@@ -115,15 +286,44 @@ fn main() {
         panic!("No .c files found in compile_commands.json");
     }
 
-    // Run parsec to generate libfoo.a
-    let status = Command::new("parsec")
-        .current_dir(&c_src_dir)
-        .args(&source_paths)
-        .status()
-        .expect("Failed to run parsec");
-    
-    if !status.success() {
-        panic!("Parsec failed with exit code: {:?}", status.code());
+    // Parsec caches the result of each translation unit, keyed on its source and compile command.
+    // The headers it includes are not part of that key, so the cache is discarded when any header,
+    // the compile commands or parsec itself change.
+    let parsec_cache_dir = out_path.join("parsec_cache");
+    let mut hasher = DefaultHasher::new();
+    hash_contents(&mut hasher, &headers);
+    hash_contents(&mut hasher, &[compile_commands_path.clone()]);
+    fs::metadata(parsec_build_dir.join("parsec")).ok()
+        .map(|metadata| (metadata.len(), metadata.modified().ok()))
+        .hash(&mut hasher);
+    let parsec_cache_inputs = hash_finish(hasher);
+    if !manifest.is_fresh("parsec_cache", &parsec_cache_inputs, &[]) {
+        let _ = fs::remove_dir_all(&parsec_cache_dir);
+        manifest.record("parsec_cache", &parsec_cache_inputs, &[]);
+    }
+
+    let parsec_outputs = [PathBuf::from("c_src/functions.json"), PathBuf::from("c_src/libfoo.a")];
+    let mut hasher = DefaultHasher::new();
+    parsec_cache_inputs.hash(&mut hasher);
+    hash_contents(&mut hasher, &source_paths);
+    // The trace format (text or binary) of the instrumentation compiled into libfoo.a
+    env::var("PARSEC_TRACE").ok().hash(&mut hasher);
+    env::var("CC").ok().hash(&mut hasher);
+    let parsec_inputs = hash_finish(hasher);
+
+    if !manifest.is_fresh("parsec", &parsec_inputs, &parsec_outputs) {
+        // Run parsec to generate libfoo.a
+        let status = Command::new("parsec")
+            .current_dir(&c_src_dir)
+            .env("PARSEC_CACHE_DIR", &parsec_cache_dir)
+            .args(&source_paths)
+            .status()
+            .expect("Failed to run parsec");
+        
+        if !status.success() {
+            panic!("Parsec failed with exit code: {:?}", status.code());
+        }
+        manifest.record("parsec", &parsec_inputs, &parsec_outputs);
     }
 
     // Tell cargo to tell rustc to link the library.
@@ -160,7 +360,7 @@ fn main() {
         }
     }
     // Add the include paths to the builder
-    for include_path in include_paths {
+    for include_path in &include_paths {
         bindings = bindings.clang_arg(format!("-I{}", include_path));
     }
 
@@ -172,23 +372,41 @@ fn main() {
         },
         Err(_) => Vec::new(),
     };
-    
-    let bindings = blocklist.iter().fold(bindings, |bindings, function| {
-        if function == "main_0" {
-            bindings.blocklist_function("main")
-        }
-        else {
-            bindings.blocklist_function(function)
-        }
-    });
-    
 
-    let bindings = bindings.generate() // Finish the builder and generate the bindings.
-                        .expect("Unable to generate bindings"); // Unwrap the Result and panic on failure.
+    // Bindgen parses every header, which is slow, and every translation adds one name to the blocklist.
+    // So the full bindings are generated without a blocklist and cached, and bindings.rs is produced
+    // from them by dropping the blocklisted functions. Translated functions are commented out in the C
+    // sources, so commented-out lines are left out of the key: the cached bindings still declare those
+    // functions, but they are always blocklisted.
+    let full_bindings_path = out_path.join("bindings_full.rs");
+    let mut hasher = DefaultHasher::new();
+    hash_uncommented_contents(&mut hasher, &c_files);
+    source_paths.hash(&mut hasher);
+    include_paths.hash(&mut hasher);
+    let bindgen_inputs = hash_finish(hasher);
 
-    // Write the bindings to the $OUT_DIR/bindings.rs file.
-    let out_path = PathBuf::from(env::var("OUT_DIR").unwrap());
-    bindings
-        .write_to_file(out_path.join("bindings.rs"))
-        .expect("Couldn't write bindings!");
-}
\ No newline at end of file
+    if !manifest.is_fresh("bindgen", &bindgen_inputs, &[full_bindings_path.clone()]) {
+        let bindings = bindings.generate() // Finish the builder and generate the bindings.
+                            .expect("Unable to generate bindings"); // Unwrap the Result and panic on failure.
+
+        // Write the bindings to the $OUT_DIR/bindings_full.rs file.
+        bindings
+            .write_to_file(&full_bindings_path)
+            .expect("Couldn't write bindings!");
+        manifest.record("bindgen", &bindgen_inputs, &[full_bindings_path.clone()]);
+    }
+
+    let bindings_path = out_path.join("bindings.rs");
+    let mut hasher = DefaultHasher::new();
+    hash_contents(&mut hasher, &[full_bindings_path.clone()]);
+    blocklist.hash(&mut hasher);
+    let filter_inputs = hash_finish(hasher);
+
+    if !manifest.is_fresh("blocklist", &filter_inputs, &[bindings_path.clone()]) {
+        let full_bindings = fs::read_to_string(&full_bindings_path).expect("Couldn't read bindings!");
+        let blocklist: HashSet<&str> = blocklist.iter().map(|function| function.trim()).collect();
+        fs::write(&bindings_path, filter_bindings(&full_bindings, &blocklist))
+            .expect("Couldn't write bindings!");
+        manifest.record("blocklist", &filter_inputs, &[bindings_path.clone()]);
+    }
+}
@@ -0,0 +1,134 @@
+import os
+from pathlib import Path
+
+import numpy as np
+
+from workspace import break_link
+
+
+class SourceFile:
+    '''
+    One C file, read once and kept in memory with the offset at which each of its lines starts.
+
+    Edits are recorded as patches over spans of the text as it was read, and are only written
+    to disk by `flush`. Spans therefore keep referring to the positions in functions.json,
+    however many other functions of the file have been edited.
+    '''
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.load()
+
+    def load(self):
+        self.data = self.path.read_bytes()
+        self.stat = self.stat_key()
+        # line_offsets[i] is the offset of line i + 1; the last entry is the end of the file
+        newlines = np.flatnonzero(np.frombuffer(self.data, dtype=np.uint8) == ord('\n')) + 1
+        self.line_offsets = np.concatenate([[0], newlines, [len(self.data)]]).astype(np.int64)
+        # {(start, end): replacement} over the offsets of `data`, never overlapping
+        self.patches = {}
+        self.dirty = False
+
+    def stat_key(self):
+        stat = os.stat(self.path)
+        return (stat.st_size, stat.st_mtime_ns)
+
+    def changed_on_disk(self):
+        return self.stat_key() != self.stat
+
+    def offset(self, line, column):
+        # Lines and columns are 1-based, columns count bytes (as in clang's source locations)
+        return int(self.line_offsets[line - 1]) + column - 1
+
+    def line(self, line):
+        # Line `line` without its line break
+        return self.data[self.line_offsets[line - 1]:self.line_offsets[line]].rstrip(b'\r\n')
+
+    def slice(self, start, end):
+        return memoryview(self.data)[start:end]
+
+    def span(self, func):
+        # The span of a function entry of functions.json, end column included
+        return self.offset(func['startLine'], func['startCol']), self.offset(func['endLine'], func['endCol']) + 1
+
+    def patch(self, start, end, replacement):
+        for other_start, other_end in self.patches:
+            assert end <= other_start or start >= other_end or (start, end) == (other_start, other_end), \
+                f"Patch {start}:{end} of {self.path} overlaps {other_start}:{other_end}"
+        self.patches[(start, end)] = replacement
+        self.dirty = True
+
+    def unpatch(self, start, end):
+        if self.patches.pop((start, end), None) is not None:
+            self.dirty = True
+
+    def render(self):
+        parts = []
+        position = 0
+        for (start, end), replacement in sorted(self.patches.items()):
+            parts += [self.slice(position, start), replacement]
+            position = end
+        parts.append(self.slice(position, len(self.data)))
+        return b''.join(parts)
+
+    def flush(self):
+        if not self.dirty:
+            return False
+        break_link(self.path)
+        self.path.write_bytes(self.render())
+        self.stat = self.stat_key()
+        self.dirty = False
+        return True
+
+
+class SourceIndex:
+    '''
+    The C files of a crate, each loaded the first time it is used.
+    A file that was modified on disk by someone else is loaded again, unless it has pending patches.
+    '''
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.files = {}
+
+    def file(self, filename):
+        source = self.files.get(filename)
+        if source is None:
+            source = self.files[filename] = SourceFile(self.root/filename)
+        elif not source.patches and not source.dirty and source.changed_on_disk():
+            source.load()
+        return source
+
+    def extract(self, func):
+        source = self.file(func['filename'])
+        start, end = source.span(func)
+        return bytes(source.slice(start, end)).decode('utf-8', errors='replace')
+
+    def comment_out(self, func):
+        '''
+        Comment out the definition of `func` with line comments, since C does not support nested block comments.
+        Code that follows the definition on its last line is moved to a line of its own.
+        '''
+        source = self.file(func['filename'])
+        start, end = source.span(func)
+        # The end of the last line of the definition, without its line break
+        line_end = source.offset(func['endLine'], 1) + len(source.line(func['endLine']))
+        body = bytes(source.slice(start, end))
+        rest = bytes(source.slice(end, line_end))
+        commented = b'\n'.join(b'// ' + line for line in body.split(b'\n'))
+        if rest.strip():
+            # Taking advantage of the fact that you can insert a linebreak anywhere in C, for the most part
+            commented += b'\n' + rest
+        source.patch(start, line_end, commented)
+
+    def restore(self, func):
+        # Undo `comment_out(func)`
+        source = self.file(func['filename'])
+        start = source.span(func)[0]
+        for span in list(source.patches):
+            if span[0] == start:
+                source.unpatch(*span)
+
+    def flush(self):
+        # Write the files with pending edits; returns how many were written
+        return sum(source.flush() for source in self.files.values())
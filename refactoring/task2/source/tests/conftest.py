@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The modules of the tool are imported from the source directory, as main.py does
+sys.path.insert(0, str(Path(__file__).parent.parent))
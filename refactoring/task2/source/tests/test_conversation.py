@@ -0,0 +1,85 @@
+from conversation import ConversationManager, compact_feedback, count_tokens
+from models import estimate_tokens
+
+
+def test_compact_feedback_collapses_repeated_lines():
+    text = 'error: a\n' + 'note: same\n' * 50 + 'error: b'
+    assert compact_feedback(text, 1000) == 'error: a\nnote: same  [repeated 50 times]\nerror: b'
+
+
+def test_compact_feedback_keeps_short_text():
+    assert compact_feedback('error: a\nerror: b', 1000) == 'error: a\nerror: b'
+
+
+def test_compact_feedback_cuts_the_middle():
+    lines = [f'line {i}' for i in range(1000)]
+    compacted = compact_feedback('\n'.join(lines), 100)
+    assert count_tokens(compacted) <= 110
+    assert compacted.startswith('line 0\nline 1\n')
+    assert compacted.endswith('line 998\nline 999')
+    assert 'lines omitted ...]' in compacted
+
+
+def test_compact_feedback_cuts_a_single_long_line():
+    diagnostic = 'error[E0308]: mismatched types ' + 'x' * 10000 + ' expected i32'
+    compacted = compact_feedback(diagnostic, 100)
+    assert count_tokens(compacted) <= 110
+    assert compacted.startswith('error[E0308]: mismatched types')
+    assert compacted.endswith('expected i32')
+    assert 'characters omitted ...]' in compacted
+
+
+def test_compact_feedback_cuts_long_lines_at_the_edges():
+    text = 'a' * 10000 + '\nmiddle\n' + 'b' * 10000
+    compacted = compact_feedback(text, 100)
+    assert compacted.startswith('aaaa')
+    assert compacted.endswith('bbbb')
+    assert count_tokens(compacted) <= 110
+
+
+def conversation_with_attempts(failures, token_budget=8000):
+    conversation = ConversationManager('system', 'translate f', token_budget=token_budget)
+    for i, summary in enumerate(failures):
+        conversation.add_response(f'attempt {i + 1}')
+        conversation.add_feedback(f'feedback {i + 1}', summary)
+    return conversation
+
+
+def test_messages_contain_only_the_latest_attempt():
+    messages = conversation_with_attempts(['Compile Error: a', 'Compile Error: b']).messages()
+    assert [message['role'] for message in messages] == ['system', 'user', 'assistant', 'user']
+    assert messages[2]['content'] == 'attempt 2'
+    assert messages[3]['content'] == 'feedback 2'
+    assert messages[1]['content'].endswith('- Attempt 1: Compile Error: a')
+
+
+def test_identical_failures_are_merged():
+    conversation = conversation_with_attempts(['Compile Error: a', 'Compile Error: a', 'Test Failure: t', 'Compile Error: a'])
+    assert conversation.summaries() == ['Attempts 1-2: Compile Error: a', 'Attempt 3: Test Failure: t']
+
+
+def test_the_oldest_summaries_are_dropped_over_budget():
+    failures = [f'Compile Error: {i} ' + 'x' * 400 for i in range(20)]
+    conversation = conversation_with_attempts(failures, token_budget=500)
+    messages = conversation.messages()
+    assert estimate_tokens(messages) <= 500
+    task = messages[1]['content']
+    assert 'Attempt 1:' not in task
+    assert 'Attempt 19:' in task
+    assert messages[2]['content'] == 'attempt 20'
+
+
+def test_the_latest_feedback_is_cut_last():
+    conversation = ConversationManager('system', 'translate f', token_budget=300, max_feedback_tokens=400)
+    conversation.add_response('attempt 1')
+    conversation.add_feedback('\n'.join(f'error line {i}' for i in range(500)), 'Compile Error: error line 0')
+    messages = conversation.messages()
+    assert estimate_tokens(messages) <= 300
+    assert messages[1]['content'] == 'translate f'
+    assert messages[3]['content'].startswith('error line 0\n')
+    assert messages[3]['content'].endswith('error line 499')
+
+
+def test_first_request_is_the_task():
+    conversation = ConversationManager('system', 'translate f')
+    assert conversation.messages() == [{'role': 'system', 'content': 'system'}, {'role': 'user', 'content': 'translate f'}]
@@ -0,0 +1,128 @@
+import os
+
+from journal import Journal
+
+
+def test_rollback_restores_modified_created_and_deleted_files(tmp_path):
+    modified, created, deleted = tmp_path/'modified', tmp_path/'created', tmp_path/'deleted'
+    modified.write_text('before')
+    deleted.write_text('kept')
+    journal = Journal()
+    journal.begin()
+    for path in [modified, created, deleted]:
+        journal.record(path)
+    modified.write_text('after')
+    created.write_text('new')
+    deleted.unlink()
+    journal.rollback()
+    assert modified.read_text() == 'before'
+    assert not created.exists()
+    assert deleted.read_text() == 'kept'
+    assert journal.transactions == [] and journal.blobs == {}
+
+
+def test_only_the_first_version_is_recorded(tmp_path):
+    path = tmp_path/'file'
+    path.write_text('one')
+    journal = Journal()
+    journal.begin()
+    journal.record(path)
+    path.write_text('two')
+    journal.record(path)
+    path.write_text('three')
+    journal.rollback()
+    assert path.read_text() == 'one'
+
+
+def test_identical_versions_are_stored_once(tmp_path):
+    for name in ['a', 'b']:
+        (tmp_path/name).write_text('same')
+    journal = Journal()
+    journal.begin()
+    journal.record(tmp_path/'a')
+    journal.record(tmp_path/'b')
+    assert len(journal.blobs) == 1
+
+
+def test_rollback_of_a_transaction_rolls_back_the_later_ones(tmp_path):
+    path = tmp_path/'file'
+    path.write_text('0')
+    journal = Journal()
+    outer = journal.begin('outer')
+    journal.record(path)
+    path.write_text('1')
+    journal.begin('inner')
+    journal.record(path)
+    path.write_text('2')
+    journal.rollback(outer)
+    assert path.read_text() == '0'
+    assert journal.transactions == []
+
+
+def test_committed_changes_are_undone_by_the_enclosing_transaction(tmp_path):
+    path = tmp_path/'file'
+    path.write_text('0')
+    undone = []
+    journal = Journal()
+    journal.begin('outer')
+    inner = journal.begin('inner')
+    journal.record(path)
+    journal.on_rollback(lambda: undone.append('inner'))
+    path.write_text('1')
+    journal.commit(inner)
+    assert journal.find('inner') is None
+    assert path.read_text() == '1'
+    journal.rollback(journal.find('outer'))
+    assert path.read_text() == '0'
+    assert undone == ['inner']
+
+
+def test_committing_the_outermost_transaction_keeps_the_changes(tmp_path):
+    path = tmp_path/'file'
+    path.write_text('0')
+    journal = Journal()
+    journal.begin()
+    journal.record(path)
+    path.write_text('1')
+    journal.commit()
+    assert path.read_text() == '1'
+    assert journal.blobs == {}
+
+
+def test_transaction_context_manager(tmp_path):
+    path = tmp_path/'file'
+    path.write_text('0')
+    journal = Journal()
+    try:
+        with journal.transaction():
+            journal.record(path)
+            path.write_text('1')
+            raise RuntimeError
+    except RuntimeError:
+        pass
+    assert path.read_text() == '0'
+    with journal.transaction():
+        journal.record(path)
+        path.write_text('2')
+    assert path.read_text() == '2'
+
+
+def test_rollback_does_not_write_through_hardlinks(tmp_path):
+    original, path = tmp_path/'original', tmp_path/'file'
+    original.write_text('shared')
+    path.write_text('0')
+    journal = Journal()
+    journal.begin()
+    journal.record(path)
+    # The file now shares its inode with another one, as in a materialized workspace
+    path.unlink()
+    os.link(original, path)
+    journal.rollback()
+    assert path.read_text() == '0'
+    assert original.read_text() == 'shared'
+
+
+def test_record_outside_of_a_transaction_is_ignored(tmp_path):
+    journal = Journal()
+    journal.record(tmp_path/'file')
+    assert journal.blobs == {}
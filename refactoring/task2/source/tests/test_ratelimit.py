@@ -0,0 +1,102 @@
+import asyncio
+import time
+
+import pytest
+
+from models.ratelimit import RateLimiter, RetryableError, TokenBucket, estimate_tokens, parse_reset
+
+
+def test_parse_reset_formats():
+    assert parse_reset('12') == 12.0
+    assert parse_reset('0.5') == 0.5
+    assert parse_reset('1m30s') == 90.0
+    assert parse_reset('250ms') == 0.25
+    assert parse_reset('1h2m3.5s') == 3723.5
+    assert parse_reset('2000-01-01T00:00:00Z') == 0.0
+    assert parse_reset('soon') is None
+
+
+def test_token_bucket_goes_into_debt():
+    bucket = TokenBucket(capacity=10, rate=1)
+    assert bucket.reserve(10) == 0.0
+    # Callers that arrive later wait for the debt of the earlier ones
+    assert bucket.reserve(5) == pytest.approx(5.0, abs=0.1)
+    assert bucket.reserve(5) == pytest.approx(10.0, abs=0.1)
+
+
+def test_token_bucket_drain():
+    bucket = TokenBucket(capacity=10, rate=1)
+    bucket.drain()
+    assert bucket.reserve(1) == pytest.approx(1.0, abs=0.1)
+
+
+def limiter(**kwargs):
+    return RateLimiter('test', requests_per_minute=6000, tokens_per_minute=10**6, base_delay=0.001, **kwargs)
+
+
+def test_run_retries_retryable_errors():
+    calls = []
+
+    async def call():
+        calls.append(time.monotonic())
+        if len(calls) < 3:
+            raise RetryableError("overloaded", retry_after=0.01)
+        return 'ok'
+
+    rate_limiter = limiter()
+    assert asyncio.run(rate_limiter.run(call)) == 'ok'
+    assert len(calls) == 3
+    assert rate_limiter.stats()['retries'] == 2
+    assert rate_limiter.stats()['throttled_time'] >= 0.02
+
+
+def test_run_gives_up_after_max_retries():
+    calls = []
+
+    async def call():
+        calls.append(None)
+        raise RetryableError("overloaded", retry_after=0)
+
+    with pytest.raises(RetryableError):
+        asyncio.run(limiter(max_retries=3).run(call))
+    assert len(calls) == 3
+
+
+def test_run_does_not_retry_other_errors():
+    calls = []
+
+    async def call():
+        calls.append(None)
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        asyncio.run(limiter().run(call))
+    assert len(calls) == 1
+
+
+def test_rate_limited_error_pauses_every_caller():
+    rate_limiter = limiter()
+    attempts = []
+
+    async def flaky():
+        attempts.append(None)
+        if len(attempts) == 1:
+            raise RetryableError("429", retry_after=0.05, rate_limited=True)
+        return 'ok'
+
+    before = time.monotonic()
+    assert asyncio.run(rate_limiter.run(flaky)) == 'ok'
+    assert rate_limiter.paused_until >= before + 0.05
+
+
+def test_update_drains_exhausted_budgets():
+    rate_limiter = limiter()
+    rate_limiter.update({'x-ratelimit-remaining-requests': '0', 'x-ratelimit-reset-requests': '2s',
+                         'x-ratelimit-remaining-tokens': '100', 'x-ratelimit-reset-tokens': '1s'})
+    assert rate_limiter.requests.level <= 0
+    assert rate_limiter.tokens.level > 0
+    assert rate_limiter.paused_until >= time.monotonic() + 1.5
+
+
+def test_estimate_tokens():
+    assert estimate_tokens([{'content': 'x' * 40}, {'content': 'y' * 4}]) == 11
@@ -0,0 +1,83 @@
+import os
+
+from source_index import SourceIndex
+
+SOURCE = """int add(int a, int b) {
+    return a + b;
+}
+
+int sub(int a, int b) { return a - b; } int x = 1;
+"""
+
+ADD = {'filename': 'foo.c', 'startLine': 1, 'startCol': 1, 'endLine': 3, 'endCol': 1}
+SUB = {'filename': 'foo.c', 'startLine': 5, 'startCol': 1, 'endLine': 5, 'endCol': 39}
+
+
+def index_of(tmp_path, source=SOURCE):
+    (tmp_path/'foo.c').write_text(source)
+    return SourceIndex(tmp_path)
+
+
+def test_extract(tmp_path):
+    index = index_of(tmp_path)
+    assert index.extract(ADD) == "int add(int a, int b) {\n    return a + b;\n}"
+    assert index.extract(SUB) == "int sub(int a, int b) { return a - b; }"
+
+
+def test_comment_out_keeps_the_code_that_follows(tmp_path):
+    index = index_of(tmp_path)
+    index.comment_out(SUB)
+    assert index.flush() == 1
+    assert (tmp_path/'foo.c').read_text().endswith("// int sub(int a, int b) { return a - b; }\n int x = 1;\n")
+
+
+def test_spans_refer_to_the_original_text(tmp_path):
+    index = index_of(tmp_path)
+    # Commenting out `add` adds lines, but `sub` is still found where functions.json says it is
+    index.comment_out(ADD)
+    index.comment_out(SUB)
+    index.flush()
+    assert (tmp_path/'foo.c').read_text() == ("// int add(int a, int b) {\n//     return a + b;\n// }\n\n"
+                                              "// int sub(int a, int b) { return a - b; }\n int x = 1;\n")
+    assert index.extract(SUB) == "int sub(int a, int b) { return a - b; }"
+
+
+def test_restore(tmp_path):
+    index = index_of(tmp_path)
+    index.comment_out(ADD)
+    index.comment_out(SUB)
+    index.flush()
+    index.restore(ADD)
+    index.restore(SUB)
+    assert index.flush() == 1
+    assert (tmp_path/'foo.c').read_text() == SOURCE
+
+
+def test_flush_only_writes_modified_files(tmp_path):
+    index = index_of(tmp_path)
+    index.extract(ADD)
+    assert index.flush() == 0
+    index.comment_out(ADD)
+    assert index.flush() == 1
+    assert index.flush() == 0
+
+
+def test_reloads_files_changed_on_disk(tmp_path):
+    index = index_of(tmp_path)
+    assert index.extract(ADD).startswith("int add")
+    path = tmp_path/'foo.c'
+    path.write_text(SOURCE.replace("int add", "long add"))
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert index.extract(ADD).startswith("long add")
+
+
+def test_breaks_hardlinks_before_writing(tmp_path):
+    original = tmp_path/'original.c'
+    original.write_text(SOURCE)
+    os.link(original, tmp_path/'foo.c')
+    index = SourceIndex(tmp_path)
+    index.comment_out(ADD)
+    index.flush()
+    assert original.read_text() == SOURCE
+    assert (tmp_path/'foo.c').read_text() != SOURCE
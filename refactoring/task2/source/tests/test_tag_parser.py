@@ -0,0 +1,81 @@
+import pytest
+
+from main import ResponseFormatException, TagParser
+
+RESPONSE = """Here is the translation.
+
+<IMPORTS>
+use std::cmp::max;
+</IMPORTS>
+
+<FUNC>
+```rust
+fn add_rust(a: i32, b: i32) -> i32 {
+    a + b
+}
+```
+</FUNC>
+
+<WRAPPER>
+#[no_mangle]
+pub extern "C" fn add(a: libc::c_int, b: libc::c_int) -> libc::c_int {
+    add_rust(a, b)
+}
+</WRAPPER>
+
+Let me know if you need anything else."""
+
+
+def feed_in_chunks(parser, response, size):
+    # Returns the prefix of the response that was fed before `feed` asked to stop
+    for i in range(0, len(response), size):
+        if parser.feed(response[i:i + size]):
+            return response[:i + size]
+    return response
+
+
+def test_finish_extracts_the_sections():
+    translation = TagParser().finish(RESPONSE)
+    assert translation['imports'] == 'use std::cmp::max;'
+    assert translation['func'] == 'fn add_rust(a: i32, b: i32) -> i32 {\n    a + b\n}'
+    assert translation['wrapper'].startswith('#[no_mangle]\npub extern "C" fn add(')
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 8, 50])
+def test_feed_stops_once_the_sections_are_closed(size):
+    parser = TagParser()
+    fed = feed_in_chunks(parser, RESPONSE, size)
+    # Tags split across chunks are found, and nothing is read after the chunk that closes the last section
+    end = fed.index('</WRAPPER>') + len('</WRAPPER>')
+    assert len(fed) - end < size
+    assert parser.finish(fed) == TagParser().finish(RESPONSE)
+
+
+def test_feed_waits_for_an_opened_imports_section():
+    parser = TagParser()
+    assert not parser.feed("<IMPORTS>\nuse std::mem;\n<FUNC>\nfn f() {}\n</FUNC>\n<WRAPPER>\nfn g() {}\n</WRAPPER>\n")
+    assert parser.feed("</IMPORTS>\n")
+
+
+def test_imports_are_optional():
+    response = "<FUNC>\nfn f() {}\n</FUNC>\n<WRAPPER>\nfn g() {}\n</WRAPPER>\n"
+    assert TagParser().feed(response)
+    assert TagParser().finish(response)['imports'] == ''
+
+
+def test_feed_gives_up_on_a_response_without_sections():
+    parser = TagParser(max_preamble=100)
+    with pytest.raises(ResponseFormatException):
+        for _ in range(10):
+            parser.feed("I'm sorry, but I can't help with that. ")
+
+
+@pytest.mark.parametrize('response', ["Sorry.", "<FUNC>\nfn f() {}\n</FUNC>\n", "<WRAPPER>\nfn g() {}\n</WRAPPER>\n"])
+def test_valid_rejects_incomplete_responses(response):
+    assert not TagParser.valid(response)
+    with pytest.raises(ResponseFormatException):
+        TagParser().finish(response)
+
+
+def test_valid_accepts_complete_responses():
+    assert TagParser.valid(RESPONSE)
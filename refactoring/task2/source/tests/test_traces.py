@@ -0,0 +1,163 @@
+import math
+import struct
+
+import pytest
+
+from traces import CHUNK_HEADER, MAGIC, VERSION, RECORD_CALL, RECORD_NAME, TAG_INT, TAG_FLOAT, TAG_POINTER, TAG_STRING, \
+    TraceReader, TraceStats, read_binary_trace, trace_stats, traced_functions
+
+
+def name_record(function_id, name):
+    return bytes([RECORD_NAME]) + struct.pack('<IB', function_id, len(name)) + name.encode()
+
+
+def value(v):
+    if isinstance(v, str):
+        return bytes([TAG_STRING, len(v)]) + v.encode()
+    if isinstance(v, float):
+        return bytes([TAG_FLOAT]) + struct.pack('<d', v)
+    if isinstance(v, tuple):
+        # (pointer,)
+        return bytes([TAG_POINTER]) + struct.pack('<Q', v[0])
+    return bytes([TAG_INT]) + struct.pack('<q', v)
+
+
+def call_record(function_id, args, returns):
+    return bytes([RECORD_CALL]) + struct.pack('<IBB', function_id, len(args), len(returns)) + \
+        b''.join(value(v) for v in args + returns)
+
+
+def chunk(pid, *records):
+    payload = b''.join(records)
+    return CHUNK_HEADER.pack(MAGIC, VERSION, 0, pid, len(payload)) + payload
+
+
+def read_binary_trace_of(tmp_path, data):
+    path = tmp_path/'instrumented.bin'
+    path.write_bytes(data)
+    return list(read_binary_trace(path))
+
+
+def text_record(name, args, returns):
+    quoted = lambda values: ', '.join(f'"{v}"' for v in values)
+    return f'{{ "name": "{name}", "args": [{quoted(args)}], "return": [{quoted(returns)}] }},\n'
+
+
+def test_binary_trace_decodes_values(tmp_path):
+    data = chunk(7, name_record(0, 'add'), call_record(0, [1, -2], [-1]),
+                 name_record(1, 'fmt'), call_record(1, ['hi', 0.5, (0xdead,)], []))
+    assert read_binary_trace_of(tmp_path, data) == [
+        {'name': 'add', 'args': [1, -2], 'return': [-1]},
+        {'name': 'fmt', 'args': ['hi', 0.5, '0xdead'], 'return': []},
+    ]
+
+
+def test_binary_trace_names_are_per_process(tmp_path):
+    # Function ids are assigned by each process independently
+    data = chunk(1, name_record(0, 'foo'), call_record(0, [], [1])) + \
+           chunk(2, name_record(0, 'bar'), call_record(0, [], [2])) + \
+           chunk(1, call_record(0, [], [3]))
+    assert [(record['name'], record['return']) for record in read_binary_trace_of(tmp_path, data)] == \
+           [('foo', [1]), ('bar', [2]), ('foo', [3])]
+
+
+def test_binary_trace_ignores_a_truncated_chunk(tmp_path):
+    complete = chunk(1, name_record(0, 'foo'), call_record(0, [1], [2]))
+    cut = chunk(1, call_record(0, [3], [4]))[:-3]
+    assert len(read_binary_trace_of(tmp_path, complete + cut)) == 1
+
+
+def test_binary_trace_rejects_other_files(tmp_path):
+    with pytest.raises(ValueError):
+        read_binary_trace_of(tmp_path, b'{ "name": "foo", "args": [], "return": [] },\n' * 2)
+
+
+@pytest.mark.parametrize('binary', [False, True])
+def test_traced_functions(tmp_path, binary):
+    if binary:
+        path = tmp_path/'instrumented.bin'
+        path.write_bytes(chunk(1, name_record(0, 'main_0'), name_record(1, 'add'),
+                               call_record(1, [1, 2], [3]), call_record(0, [], [0])))
+    else:
+        path = tmp_path/'instrumented.json'
+        path.write_text(text_record('add', [1, 2], [3]) + text_record('main_0', [], [0]))
+    assert traced_functions(path) == {'add', 'main_0'}
+
+
+def calls_of(reader):
+    calls = []
+    for batch in reader.batches():
+        for i in range(len(batch)):
+            calls.append((reader.names.names[batch.function_ids[i]], int(batch.nargs[i]), batch.returns[i]))
+    return calls
+
+
+@pytest.mark.parametrize('chunk_size', [1, 5, 64, 1 << 20])
+def test_text_reader_is_independent_of_chunk_size(tmp_path, chunk_size):
+    path = tmp_path/'instrumented.json'
+    # Strings are written unescaped, and may contain what looks like the end of a record
+    path.write_text(text_record('add', [1, 2], [3]) + text_record('puts', ['a"] },', '0x10'], [2]) +
+                    text_record('main_0', [], []))
+    calls = calls_of(TraceReader(path, chunk_size=chunk_size))
+    assert [(name, nargs) for name, nargs, _ in calls] == [('add', 2), ('puts', 2), ('main_0', 0)]
+    assert calls[0][2] == 3.0
+    assert math.isnan(calls[2][2])
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 1 << 20])
+def test_binary_reader_is_independent_of_chunk_size(tmp_path, chunk_size):
+    path = tmp_path/'instrumented.bin'
+    path.write_bytes(chunk(1, name_record(0, 'add'), call_record(0, [1, 2], [3])) +
+                     chunk(1, call_record(0, [4, 5], [9])))
+    assert [(name, returns) for name, _, returns in calls_of(TraceReader(path, chunk_size=chunk_size))] == \
+           [('add', 3.0), ('add', 9.0)]
+
+
+@pytest.mark.parametrize('binary', [False, True])
+def test_reader_follows_a_trace_being_written(tmp_path, binary):
+    path = tmp_path/('instrumented.bin' if binary else 'instrumented.json')
+    reader = TraceReader(path)
+    assert calls_of(reader) == []
+
+    if binary:
+        first = chunk(1, name_record(0, 'foo'), call_record(0, [], [1]))
+        second = chunk(1, call_record(0, [], [2]))
+    else:
+        first = text_record('foo', [], [1]).encode()
+        second = text_record('foo', [], [2]).encode()
+    # The second record is cut short at first: it is only read once it is complete
+    path.write_bytes(first + second[:-4])
+    assert [returns for _, _, returns in calls_of(reader)] == [1.0]
+    with open(path, 'ab') as f:
+        f.write(second[-4:])
+    assert [returns for _, _, returns in calls_of(reader)] == [2.0]
+    assert calls_of(reader) == []
+
+
+def test_trace_stats(tmp_path):
+    path = tmp_path/'instrumented.json'
+    path.write_text(text_record('add', [1, 'x'], [3]) + text_record('add', [3, 'y'], [7]) +
+                    text_record('main_0', [], [0]))
+    stats = trace_stats(path)
+    assert stats.counts() == {'add': 2, 'main_0': 1}
+    returns = stats.distribution('add')
+    assert (returns['count'], returns['mean'], returns['min'], returns['max']) == (2, 5.0, 3.0, 7.0)
+    assert returns['std'] == pytest.approx(2.0)
+    assert stats.distribution('add', 0)['mean'] == 2.0
+    # Strings are not numeric
+    assert stats.distribution('add', 1)['count'] == 0
+    assert stats.distribution('never_called') is None
+
+
+def test_trace_stats_accumulate_over_batches(tmp_path):
+    path = tmp_path/'instrumented.json'
+    path.write_text(''.join(text_record(f'f{i % 3}', [i], [i]) for i in range(30)))
+    reader = TraceReader(path, chunk_size=50)
+    stats = TraceStats(reader.names)
+    batches = 0
+    for batch in reader.batches():
+        stats.add(batch)
+        batches += 1
+    assert batches > 1
+    assert stats.counts() == {'f0': 10, 'f1': 10, 'f2': 10}
+    assert stats.distribution('f2')['max'] == 29.0
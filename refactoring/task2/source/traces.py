@@ -0,0 +1,354 @@
+import re
+import struct
+import time
+from pathlib import Path
+
+import numpy as np
+
+# Binary trace written by the runtime of parsec's instrumentation (parsec/trace_runtime.h)
+MAGIC = b'PTRC'
+VERSION = 1
+CHUNK_HEADER = struct.Struct('<4sHHII')  # magic, version, reserved, pid, payload length
+
+RECORD_NAME = 1
+RECORD_CALL = 2
+
+TAG_INT = 0
+TAG_FLOAT = 1
+TAG_POINTER = 2
+TAG_STRING = 3
+TAG_UNSUPPORTED = 4
+
+_u32 = struct.Struct('<I')
+_call = struct.Struct('<IBB')
+_i64 = struct.Struct('<q')
+_f64 = struct.Struct('<d')
+_u64 = struct.Struct('<Q')
+
+
+def parse_chunks(data):
+    '''
+    Yields (pid, payload, end) for every complete chunk at the start of `data`, where `end` is the
+    offset just past the chunk. A chunk cut short, for instance by a process killed while writing it
+    or by a file that is still being written, ends the iteration.
+    '''
+    offset = 0
+    while offset + CHUNK_HEADER.size <= len(data):
+        magic, version, _, pid, length = CHUNK_HEADER.unpack_from(data, offset)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Not a binary trace chunk at offset {offset}")
+        start = offset + CHUNK_HEADER.size
+        if start + length > len(data):
+            break
+        offset = start + length
+        yield pid, memoryview(data)[start:offset], offset
+
+
+def read_chunks(path):
+    # Yields (pid, payload) for every complete chunk of a binary trace
+    for pid, payload, _ in parse_chunks(Path(path).read_bytes()):
+        yield pid, payload
+
+
+def _read_value(payload, offset):
+    tag = payload[offset]
+    offset += 1
+    if tag == TAG_INT:
+        return _i64.unpack_from(payload, offset)[0], offset + 8
+    if tag == TAG_FLOAT:
+        return _f64.unpack_from(payload, offset)[0], offset + 8
+    if tag == TAG_POINTER:
+        return hex(_u64.unpack_from(payload, offset)[0]), offset + 8
+    if tag == TAG_STRING:
+        length = payload[offset]
+        value = bytes(payload[offset + 1:offset + 1 + length]).decode('utf-8', errors='replace')
+        return value, offset + 1 + length
+    if tag == TAG_UNSUPPORTED:
+        return '<unsupported>', offset
+    raise ValueError(f"Unknown value tag {tag}")
+
+
+def decode_payload(payload, names):
+    '''
+    Yields (name, args, returns) for every call record of a chunk payload.
+    `names` maps function ids to names for the process that wrote the chunk, and is updated
+    with the name records of the payload.
+    '''
+    offset = 0
+    while offset < len(payload):
+        record_type = payload[offset]
+        offset += 1
+        if record_type == RECORD_NAME:
+            function_id = _u32.unpack_from(payload, offset)[0]
+            length = payload[offset + 4]
+            names[function_id] = bytes(payload[offset + 5:offset + 5 + length]).decode('utf-8', errors='replace')
+            offset += 5 + length
+        elif record_type == RECORD_CALL:
+            function_id, nargs, nrets = _call.unpack_from(payload, offset)
+            offset += _call.size
+            values = []
+            for _ in range(nargs + nrets):
+                value, offset = _read_value(payload, offset)
+                values.append(value)
+            yield names.get(function_id, f'<function {function_id}>'), values[:nargs], values[nargs:]
+        else:
+            raise ValueError(f"Unknown record type {record_type}")
+
+
+def read_binary_trace(path):
+    '''
+    Decode a binary trace (instrumented.bin) into records shaped like those of instrumented.json:
+    {'name': ..., 'args': [...], 'return': [...]}, in the order they were written by each process.
+    Integers and floats are decoded as numbers, pointers as hex strings and strings as str.
+    '''
+    # Function names are written once per process, before its first call record for that function
+    names = {}
+    for pid, payload in read_chunks(path):
+        for name, args, returns in decode_payload(payload, names.setdefault(pid, {})):
+            yield {'name': name, 'args': args, 'return': returns}
+
+
+# A record of the text trace (instrumented.json). Every value is quoted, and strings are written
+# unescaped, so a record is delimited by its prefix and by the "] },\n" that ends it.
+_TEXT_LIST = rb'((?:(?!\{ "name": ").)*?)'
+TEXT_RECORD = re.compile(rb'\{ "name": "([^"]*)", "args": \[' + _TEXT_LIST + rb'\], "return": \[' + _TEXT_LIST + rb'\] \},\n', re.DOTALL)
+TEXT_VALUE = re.compile(rb'"(.*?)"(?:, |$)', re.DOTALL)
+
+
+def _numeric(value):
+    # Integers and floats as float64; pointers, strings and unsupported values as NaN
+    if isinstance(value, bytes):
+        try:
+            return float(value)
+        except ValueError:
+            return np.nan
+    if isinstance(value, (int, float)):
+        return float(value)
+    return np.nan
+
+
+class StringTable:
+    '''
+    Interns function names: each distinct name is given a small integer id, in order of first appearance.
+    '''
+
+    def __init__(self):
+        self.names = []
+        self.ids = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def intern(self, name):
+        if name not in self.ids:
+            self.ids[name] = len(self.names)
+            self.names.append(name)
+        return self.ids[name]
+
+    def lookup(self, name):
+        return self.ids.get(name)
+
+
+class TraceBatch:
+    '''
+    Consecutive calls of a trace, as columns of equal length n:
+        function_ids  int32 (n,)             ids in the reader's StringTable
+        args          float64 (n, max_args)  numeric argument values; NaN for other values and absent arguments
+        nargs         int16 (n,)             number of arguments of the call
+        returns       float64 (n,)           numeric return value; NaN if there is none or it is not numeric
+    '''
+
+    def __init__(self, function_ids, args, nargs, returns):
+        self.function_ids = function_ids
+        self.args = args
+        self.nargs = nargs
+        self.returns = returns
+
+    def __len__(self):
+        return len(self.function_ids)
+
+    @classmethod
+    def from_calls(cls, calls, names, max_args):
+        # calls: (name, args, returns) tuples, with raw bytes or decoded values
+        n = len(calls)
+        function_ids = np.empty(n, dtype=np.int32)
+        args = np.full((n, max_args), np.nan)
+        nargs = np.empty(n, dtype=np.int16)
+        returns = np.full(n, np.nan)
+        for i, (name, call_args, call_returns) in enumerate(calls):
+            function_ids[i] = names.intern(name)
+            nargs[i] = len(call_args)
+            for j, value in enumerate(call_args[:max_args]):
+                args[i, j] = _numeric(value)
+            if call_returns:
+                returns[i] = _numeric(call_returns[0])
+        return cls(function_ids, args, nargs, returns)
+
+    @classmethod
+    def concatenate(cls, batches, max_args):
+        batches = list(batches)
+        if not batches:
+            return cls(np.zeros(0, dtype=np.int32), np.zeros((0, max_args)), np.zeros(0, dtype=np.int16), np.zeros(0))
+        return cls(np.concatenate([batch.function_ids for batch in batches]),
+                   np.concatenate([batch.args for batch in batches]),
+                   np.concatenate([batch.nargs for batch in batches]),
+                   np.concatenate([batch.returns for batch in batches]))
+
+
+class TraceReader:
+    '''
+    Incremental reader of a trace written by parsec's instrumentation, either the text format
+    (instrumented.json) or the binary one (instrumented.bin, recognized by its first bytes).
+
+    The file is read `chunk_size` bytes at a time, and only a record cut by the end of a chunk is
+    carried over to the next, so memory use does not grow with the size of the trace. Reading stops
+    at the end of the last complete record, and resumes from there on the next call of `batches`,
+    which makes it possible to follow a trace that is still being written.
+    '''
+
+    def __init__(self, path, names=None, max_args=8, chunk_size=1 << 22):
+        self.path = Path(path)
+        self.names = names if names is not None else StringTable()
+        self.max_args = max_args
+        self.chunk_size = chunk_size
+        self.offset = 0
+        self.pending = b''
+        self.binary = None
+        # Per-process function names of a binary trace
+        self.process_names = {}
+
+    def batches(self):
+        # Yields a TraceBatch for each chunk of the records written since the last call
+        if not self.path.exists():
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            while True:
+                data = f.read(self.chunk_size)
+                if not data:
+                    return
+                self.offset += len(data)
+                data = self.pending + data
+                if self.binary is None:
+                    if len(data) < len(MAGIC):
+                        self.pending = data
+                        continue
+                    self.binary = data.startswith(MAGIC)
+                calls, end = self.parse_binary(data) if self.binary else self.parse_text(data)
+                self.pending = data[end:]
+                if calls:
+                    yield TraceBatch.from_calls(calls, self.names, self.max_args)
+
+    def parse_text(self, data):
+        calls = []
+        end = 0
+        for match in TEXT_RECORD.finditer(data):
+            name, args, returns = match.groups()
+            calls.append((name.decode('utf-8', errors='replace'), TEXT_VALUE.findall(args), TEXT_VALUE.findall(returns)))
+            end = match.end()
+        # Whatever precedes the start of the last record and did not match is malformed;
+        # only the last record may still be incomplete
+        end = max(end, data.rfind(b'{ "name": "', end))
+        return calls, end
+
+    def parse_binary(self, data):
+        calls = []
+        end = 0
+        for pid, payload, end in parse_chunks(data):
+            calls.extend(decode_payload(payload, self.process_names.setdefault(pid, {})))
+        return calls, end
+
+    def follow(self, poll_interval=0.5, stop=None):
+        '''
+        Yields batches as records are appended to the trace, until `stop` (a threading.Event) is set.
+        The records written before `stop` was set are all yielded.
+        '''
+        while True:
+            stopping = stop is not None and stop.is_set()
+            yield from self.batches()
+            if stopping:
+                return
+            if stop is not None:
+                stop.wait(poll_interval)
+            else:
+                time.sleep(poll_interval)
+
+
+class TraceStats:
+    '''
+    Per-function call counts and value distributions, accumulated over the batches of a trace.
+    The distribution of every argument position and of the return value is summarized by the
+    count, sum, sum of squares, minimum and maximum of its numeric values.
+    '''
+
+    def __init__(self, names, max_args=8):
+        self.names = names
+        self.max_args = max_args
+        self.calls = np.zeros(0, dtype=np.int64)
+        # Column max_args is the return value
+        columns = max_args + 1
+        self.count = np.zeros((0, columns), dtype=np.int64)
+        self.sum = np.zeros((0, columns))
+        self.sum_squares = np.zeros((0, columns))
+        self.min = np.zeros((0, columns))
+        self.max = np.zeros((0, columns))
+
+    def grow(self, size):
+        if size <= len(self.calls):
+            return
+        extra = size - len(self.calls)
+        columns = self.max_args + 1
+        self.calls = np.concatenate([self.calls, np.zeros(extra, dtype=np.int64)])
+        self.count = np.concatenate([self.count, np.zeros((extra, columns), dtype=np.int64)])
+        self.sum = np.concatenate([self.sum, np.zeros((extra, columns))])
+        self.sum_squares = np.concatenate([self.sum_squares, np.zeros((extra, columns))])
+        self.min = np.concatenate([self.min, np.full((extra, columns), np.inf)])
+        self.max = np.concatenate([self.max, np.full((extra, columns), -np.inf)])
+
+    def add(self, batch):
+        self.grow(len(self.names))
+        self.calls += np.bincount(batch.function_ids, minlength=len(self.calls))
+        values = np.concatenate([batch.args, batch.returns[:, None]], axis=1)
+        numeric = ~np.isnan(values)
+        zeroed = np.where(numeric, values, 0.0)
+        rows = np.broadcast_to(batch.function_ids[:, None], values.shape)
+        columns = np.broadcast_to(np.arange(values.shape[1]), values.shape)
+        np.add.at(self.count, (rows[numeric], columns[numeric]), 1)
+        np.add.at(self.sum, (rows, columns), zeroed)
+        np.add.at(self.sum_squares, (rows, columns), zeroed * zeroed)
+        np.minimum.at(self.min, (rows[numeric], columns[numeric]), values[numeric])
+        np.maximum.at(self.max, (rows[numeric], columns[numeric]), values[numeric])
+
+    def counts(self):
+        # {function name: number of calls}, for the functions that were called
+        return {self.names.names[i]: int(self.calls[i]) for i in np.flatnonzero(self.calls)}
+
+    def distribution(self, name, column='return'):
+        '''
+        Summary of the numeric values of an argument (its index) or of the return value ('return')
+        of `name`: {'count', 'mean', 'std', 'min', 'max'}. None if `name` was never called.
+        '''
+        i = self.names.lookup(name)
+        if i is None or i >= len(self.calls) or self.calls[i] == 0:
+            return None
+        j = self.max_args if column == 'return' else column
+        count = int(self.count[i, j])
+        if count == 0:
+            return {'count': 0, 'mean': np.nan, 'std': np.nan, 'min': np.nan, 'max': np.nan}
+        mean = self.sum[i, j] / count
+        variance = max(0.0, float(self.sum_squares[i, j] / count - mean * mean))
+        return {'count': count, 'mean': float(mean), 'std': variance ** 0.5, 'min': float(self.min[i, j]), 'max': float(self.max[i, j])}
+
+
+def trace_stats(path, max_args=8):
+    # Call counts and value distributions of a whole trace, read in bounded memory
+    reader = TraceReader(path, max_args=max_args)
+    stats = TraceStats(reader.names, max_args=max_args)
+    for batch in reader.batches():
+        stats.add(batch)
+    return stats
+
+
+def traced_functions(path):
+    # Names of the functions that returned at least once in a trace
+    return set(trace_stats(path).counts())
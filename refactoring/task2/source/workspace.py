@@ -0,0 +1,79 @@
+import errno
+import fcntl
+import os
+import shutil
+from pathlib import Path
+
+# ioctl request number for FICLONE on Linux (btrfs, XFS, ...).
+FICLONE = 0x40049409
+
+# Build products that are regenerated inside every workspace. They are never shared with
+# the source tree, because build tools (ar, cargo, ...) may update them in place.
+# Only the names written by build.rs and parsec are listed: a dataset may ship prebuilt objects and archives.
+BUILD_ARTIFACTS = ['target', 'instrumented.o', 'parsec_trace.o', 'libfoo.a', 'compile_commands.json', 'functions.json',
+                   'instrumented.json', 'instrumented.bin']
+
+
+class Cloner:
+    '''
+    A `copy_function` for shutil.copytree that shares file contents with the source tree.
+    Tries, in order: a reflink (true copy-on-write), a hardlink, and a plain copy.
+    Whichever method fails first is not attempted again for the rest of the tree.
+    '''
+
+    def __init__(self, hardlink=True):
+        self.reflink = hasattr(fcntl, 'ioctl')
+        self.hardlink = hardlink
+        self.counts = {'reflink': 0, 'hardlink': 0, 'copy': 0}
+
+    def __call__(self, src, dst):
+        if self.reflink:
+            try:
+                with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+                    fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                shutil.copystat(src, dst)
+                self.counts['reflink'] += 1
+                return dst
+            except OSError as e:
+                if e.errno not in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS):
+                    raise
+                os.unlink(dst)
+                self.reflink = False
+        if self.hardlink:
+            try:
+                os.link(src, dst)
+                self.counts['hardlink'] += 1
+                return dst
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+                    raise
+                self.hardlink = False
+        shutil.copy2(src, dst)
+        self.counts['copy'] += 1
+        return dst
+
+
+def materialize(src, dst, hardlink=True, ignore=BUILD_ARTIFACTS):
+    '''
+    Create `dst` as a copy-on-write view of `src`.
+    Files that are hardlinked must be detached with `break_link` before they are written to.
+    Returns a dict counting how many files were reflinked, hardlinked and copied.
+    '''
+    cloner = Cloner(hardlink=hardlink)
+    shutil.copytree(src, dst,
+                    copy_function=cloner,
+                    ignore=shutil.ignore_patterns(*ignore) if ignore else None)
+    return cloner.counts
+
+
+def break_link(path):
+    '''
+    Give `path` its own inode if it is shared with another file, so that writing to it
+    does not modify the source tree. No-op for files that are not hardlinked.
+    '''
+    path = Path(path)
+    if not path.exists() or path.stat().st_nlink <= 1:
+        return
+    tmp_path = path.with_name(path.name + '.unlink')
+    shutil.copy2(path, tmp_path)
+    os.replace(tmp_path, path)
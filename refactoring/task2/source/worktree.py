@@ -0,0 +1,109 @@
+import filecmp
+import fnmatch
+import os
+import queue
+import shutil
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+from workspace import Cloner, BUILD_ARTIFACTS, materialize, break_link
+
+# Temporary copies written by break_link; meaningful only in the tree that wrote them
+BACKUP_FILES = ['*.unlink']
+
+
+class Worktree:
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.version = -1
+
+
+class WorktreePool:
+    '''
+    A fixed number of private copies of the output crate ("worktrees"), so that several functions
+    can be inserted, built and tested at the same time.
+
+    Each worktree is a copy-on-write view of the canonical crate, with its own copy of the
+    canonical `target` directory, so that its first build is incremental. Cargo locks a target
+    directory for the duration of a build, so the worktrees cannot build in parallel in a single one.
+    With `copy_target=False`, the worktrees build into the shared target directory given to cargo
+    (CARGO_TARGET_DIR) instead, and nothing is copied.
+    Before a worktree is handed out, it is brought up to date with the translations that have
+    been merged into the canonical crate since it was last used.
+    '''
+
+    def __init__(self, canonical_dir, size, copy_target=True):
+        self.canonical_dir = Path(canonical_dir)
+        self.root = self.canonical_dir.parent/f'{self.canonical_dir.name}.worktrees'
+        self.version = 0
+        self.lock = threading.Lock()
+        self.free = queue.Queue()
+        self.counts = {'reflink': 0, 'hardlink': 0, 'copy': 0}
+        # Left over from an earlier run
+        shutil.rmtree(self.root, ignore_errors=True)
+
+        for i in range(size):
+            worktree = Worktree(self.root/f'slot_{i}')
+            counts = materialize(self.canonical_dir, worktree.path, ignore=BUILD_ARTIFACTS + BACKUP_FILES)
+            if copy_target and Path(self.canonical_dir, 'target').exists():
+                # Never hardlink build products: cargo and ar update them in place
+                cloner = Cloner(hardlink=False)
+                shutil.copytree(self.canonical_dir/'target', worktree.path/'target', copy_function=cloner, symlinks=True)
+                counts = {method: count + cloner.counts[method] for method, count in counts.items()}
+            for method, count in counts.items():
+                self.counts[method] += count
+            worktree.version = self.version
+            self.free.put(worktree)
+
+    def ignored(self, name):
+        return any(fnmatch.fnmatch(name, pattern) for pattern in BUILD_ARTIFACTS + BACKUP_FILES)
+
+    def sync(self, worktree):
+        '''
+        Copy every source file that differs from the canonical crate into `worktree`.
+        Files are rewritten rather than copied with their timestamps, so cargo sees them as modified.
+        '''
+        with self.lock:
+            if worktree.version == self.version:
+                return 0
+            version = self.version
+            changed = 0
+            for dirpath, dirnames, filenames in os.walk(self.canonical_dir):
+                dirnames[:] = [d for d in dirnames if not self.ignored(d)]
+                for name in filenames:
+                    if self.ignored(name):
+                        continue
+                    src = Path(dirpath, name)
+                    dst = worktree.path/src.relative_to(self.canonical_dir)
+                    if dst.exists() and filecmp.cmp(src, dst, shallow=False):
+                        continue
+                    dst.parent.mkdir(parents=True, exist_ok=True)
+                    break_link(dst)
+                    shutil.copyfile(src, dst)
+                    changed += 1
+        worktree.version = version
+        return changed
+
+    @contextmanager
+    def acquire(self):
+        # Blocks until a worktree is free
+        worktree = self.free.get()
+        try:
+            self.sync(worktree)
+            yield worktree.path
+        finally:
+            self.free.put(worktree)
+
+    def merge(self, apply):
+        '''
+        Run `apply()`, which modifies the canonical crate. Worktrees are never synced while it runs,
+        and pick up the change the next time they are acquired.
+        '''
+        with self.lock:
+            apply()
+            self.version += 1
+
+    def close(self):
+        shutil.rmtree(self.root, ignore_errors=True)
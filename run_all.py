@@ -1,8 +1,17 @@
 from pathlib import Path
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import argparse
 import shutil
 import subprocess
 import shlex
+import sys
+
+from telemetry import ProcessTreeSampler, disk_usage, agent_version, append_record, summarize, MB
+
+# Shared with the translation tool, which materializes its output crates the same way
+sys.path.append(str(Path(__file__).parent/'refactoring'/'task2'/'source'))
+from workspace import Cloner
 
 tasks = ['creation/task1', 'creation/task2', 'creation/task3', 'creation/task4', 'creation/task5',
          'debugging/task1', 'debugging/task2', 'debugging/task3',
@@ -17,38 +26,127 @@ commands = {
     'codex': 'codex exec {prompt} 2>&1 | tee log.txt'
 }
 
-for task in tasks:
-    for agent in agents:
-        print(f"Running {task} with {agent}...")
-        task_subfolder = Path.cwd() / task
-        prompt_path = task_subfolder / "prompt.txt"
-        prompt = prompt_path.read_text()
-
-        # Check if there is a directory in workdir starting with "run_{agent}_"
-        existing_runs = list(task_subfolder.glob(f"run_{agent}_*"))
-        if existing_runs:
-            print(f"Skipping {task} with {agent} as it has already been run.")
-            continue
-
-        working_dir = task_subfolder / f"run_{agent}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-        source_dir = task_subfolder / "source"
-        if not source_dir.exists():
-            working_dir.mkdir(parents=True, exist_ok=True)
-        else:
-            # Copy source folder to working directory
-            shutil.copytree(source_dir, working_dir)
-
-        prompt = shlex.quote(prompt)
-        command = commands[agent].format(prompt=prompt)
+def run_task(task, agent, sweep, quiet=False):
+    # When runs execute concurrently, `quiet` keeps the agent output out of the terminal.
+    # It still ends up in the per-run log.txt written by `tee`.
+    # `sweep` identifies this invocation of run_all.py and carries the agent versions and the ledger path.
+    task_subfolder = Path.cwd() / task
+    prompt_path = task_subfolder / "prompt.txt"
+    prompt = prompt_path.read_text()
+
+    working_dir = task_subfolder / f"run_{agent}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    source_dir = task_subfolder / "source"
+    if not source_dir.exists():
+        working_dir.mkdir(parents=True, exist_ok=True)
+    else:
+        # Copy source folder to working directory
+        # Reflinked files share their blocks with the source until one side writes to them,
+        # so a workspace costs only the files the agent changes.
+        # Hardlinks are not an option here: agents edit files in place, which would modify the source.
+        shutil.copytree(source_dir, working_dir, copy_function=Cloner(hardlink=False))
+
+    prompt = shlex.quote(prompt)
+    command = commands[agent].format(prompt=prompt)
+    if not quiet:
         print(f"Executing command: {command} in {working_dir}")
-        result = subprocess.run(command, shell=True, cwd=working_dir)
-        # If the result is not successful, clean up the working directory
-        if result.returncode != 0:
-            print(f"Command failed with return code {result.returncode}. Cleaning up {working_dir}.")
-            # First copy the log out of the working directory
-            log_path = working_dir / "log.txt"
-            if log_path.exists():
-                # The name of the new log file should be the working directory name with .txt extension
-                new_log_path = task_subfolder / f"error_log_{working_dir.name}.txt"
-                shutil.copy(log_path, new_log_path)
-            shutil.rmtree(working_dir)
\ No newline at end of file
+    start = datetime.now()
+    process = subprocess.Popen(command, shell=True, cwd=working_dir,
+                               stdout=subprocess.DEVNULL if quiet else None)
+    with ProcessTreeSampler(process.pid) as usage:
+        process.wait()
+
+    append_record(sweep['ledger'], {
+        'sweep': sweep['id'],
+        'task': task,
+        'agent': agent,
+        'agent_version': sweep['versions'][agent],
+        'run_dir': working_dir.name,
+        'start': start.isoformat(timespec='seconds'),
+        'returncode': process.returncode,
+        'wall_time_s': round(usage.wall_time, 2),
+        'cpu_user_s': round(usage.cpu_user, 2),
+        'cpu_system_s': round(usage.cpu_system, 2),
+        'peak_rss_mb': round(usage.peak_rss / MB, 1),
+        'disk_mb': round(disk_usage(working_dir) / MB, 1),
+    })
+    # If the run is not successful, clean up the working directory
+    if process.returncode != 0:
+        print(f"Command failed with return code {process.returncode}. Cleaning up {working_dir}.")
+        # First copy the log out of the working directory
+        log_path = working_dir / "log.txt"
+        if log_path.exists():
+            # The name of the new log file should be the working directory name with .txt extension
+            new_log_path = task_subfolder / f"error_log_{working_dir.name}.txt"
+            shutil.copy(log_path, new_log_path)
+        shutil.rmtree(working_dir)
+    return process.returncode
+
+def pending_runs():
+    for task in tasks:
+        for agent in agents:
+            # Check if there is a directory in workdir starting with "run_{agent}_"
+            existing_runs = list((Path.cwd() / task).glob(f"run_{agent}_*"))
+            if existing_runs:
+                print(f"Skipping {task} with {agent} as it has already been run.")
+                continue
+            yield task, agent
+
+def run_parallel(jobs, agent_jobs, sweep):
+    # Each (task, agent) pair has its own workspace, so runs are independent of each other.
+    # `agent_jobs` caps how many runs of the same agent are in flight (e.g. to respect API quotas).
+    queue = list(pending_runs())
+    running = {}
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        while queue or running:
+            in_flight = [agent for (_, agent) in running.values()]
+            for run in list(queue):
+                if len(running) >= jobs:
+                    break
+                task, agent = run
+                if in_flight.count(agent) >= agent_jobs.get(agent, jobs):
+                    continue
+                queue.remove(run)
+                in_flight.append(agent)
+                print(f"Running {task} with {agent}...")
+                running[pool.submit(run_task, task, agent, sweep, True)] = run
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                task, agent = running.pop(future)
+                try:
+                    returncode = future.result()
+                except Exception as e:
+                    print(f"Run of {task} with {agent} raised an exception: {e}")
+                    continue
+                print(f"Finished {task} with {agent} (return code {returncode}).")
+
+def agent_jobs_spec(spec):
+    # The `type` of --agent-jobs, so that argparse reports invalid values as usage errors
+    agent, _, limit = spec.partition('=')
+    if agent not in commands or not limit.isdigit() or int(limit) < 1:
+        raise argparse.ArgumentTypeError(f"Invalid --agent-jobs value: {spec}. Expected <agent>=<N>.")
+    return agent, int(limit)
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Run every scenario with every agent')
+    parser.add_argument('--jobs',       type=int,   default=1,  help='Number of runs to execute concurrently')
+    parser.add_argument('--agent-jobs', nargs='*',  default=[], type=agent_jobs_spec, help='Per-agent concurrency caps, e.g. claude=2 codex=1')
+    parser.add_argument('--ledger',     type=str,   default='results.jsonl', help='Append-only file with one record per run')
+    parser.add_argument('--summary',    action='store_true',    help='Print a comparison of the recorded runs and exit')
+    args = parser.parse_args()
+    agent_jobs = dict(args.agent_jobs)
+
+    if args.summary:
+        summarize(args.ledger)
+        exit(0)
+
+    sweep = {'id': datetime.now().strftime('%Y%m%d_%H%M%S'),
+             'versions': {agent: agent_version(agent) for agent in agents},
+             'ledger': str(Path(args.ledger).absolute())}
+
+    if args.jobs > 1:
+        run_parallel(args.jobs, agent_jobs, sweep)
+    else:
+        for task, agent in pending_runs():
+            print(f"Running {task} with {agent}...")
+            run_task(task, agent, sweep)
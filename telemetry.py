@@ -0,0 +1,151 @@
+from pathlib import Path
+from collections import defaultdict
+import fcntl
+import json
+import os
+import resource
+import subprocess
+import threading
+import time
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+MB = 1024 * 1024
+
+def process_tree(root_pid):
+    # Map every live process to its parent by scanning /proc, then collect the descendants of root_pid
+    children = defaultdict(list)
+    for entry in Path('/proc').iterdir():
+        if not entry.name.isdigit():
+            continue
+        try:
+            stat = (entry / 'stat').read_text()
+        except OSError:
+            continue
+        # The command name is in parentheses and may contain spaces, so split after the last ')'
+        fields = stat[stat.rfind(')') + 2:].split()
+        children[int(fields[1])].append(int(entry.name))
+    tree = [root_pid]
+    for pid in tree:
+        tree.extend(children.get(pid, []))
+    return tree
+
+def tree_rss(root_pid):
+    total = 0
+    for pid in process_tree(root_pid):
+        try:
+            total += int(Path(f'/proc/{pid}/statm').read_text().split()[1]) * PAGE_SIZE
+        except (OSError, IndexError, ValueError):
+            continue
+    return total
+
+class ProcessTreeSampler:
+    '''
+    Samples the resident memory of a process and all of its descendants in a background thread.
+    CPU time is taken from getrusage(RUSAGE_CHILDREN), which covers every descendant once it has been waited for.
+    '''
+
+    def __init__(self, pid, interval=1.0):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = 0
+        self.enabled = Path('/proc').is_dir()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+
+    def __enter__(self):
+        self.start_time = time.time()
+        self.start_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        if self.enabled:
+            self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        if self.enabled:
+            self.thread.join()
+        end_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        self.wall_time = time.time() - self.start_time
+        self.cpu_user = end_usage.ru_utime - self.start_usage.ru_utime
+        self.cpu_system = end_usage.ru_stime - self.start_usage.ru_stime
+        if not self.enabled:
+            # Without /proc, fall back to the largest single descendant (ru_maxrss is in kilobytes)
+            self.peak_rss = end_usage.ru_maxrss * 1024
+
+    def sample(self):
+        while not self.stopped.is_set():
+            self.peak_rss = max(self.peak_rss, tree_rss(self.pid))
+            self.stopped.wait(self.interval)
+
+def disk_usage(path):
+    seen = set()
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in dirnames + filenames:
+            try:
+                st = os.lstat(os.path.join(dirpath, name))
+            except OSError:
+                continue
+            if (st.st_dev, st.st_ino) in seen:
+                continue
+            seen.add((st.st_dev, st.st_ino))
+            total += st.st_blocks * 512
+    return total
+
+def agent_version(agent):
+    try:
+        result = subprocess.run([agent, '--version'], capture_output=True, text=True, timeout=30)
+        return result.stdout.strip().split('\n')[0] or 'unknown'
+    except (OSError, subprocess.TimeoutExpired):
+        return 'unknown'
+
+def append_record(ledger, record):
+    # Several workers may finish at the same time, so take an exclusive lock for the append
+    with open(ledger, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.write(json.dumps(record) + '\n')
+        fcntl.flock(f, fcntl.LOCK_UN)
+
+def read_records(ledger):
+    if not Path(ledger).exists():
+        return []
+    with open(ledger, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def summarize(ledger):
+    records = read_records(ledger)
+    if not records:
+        print(f"No runs recorded in {ledger}.")
+        return
+
+    def mean(values):
+        return sum(values) / len(values) if values else 0.0
+
+    def print_table(title, key_names, groups):
+        print(title)
+        header = key_names + ['runs', 'failed', 'wall (s)', 'cpu (s)', 'peak rss (MB)', 'disk (MB)']
+        rows = [header]
+        for key, runs in sorted(groups.items()):
+            rows.append(list(key) + [
+                str(len(runs)),
+                str(sum(1 for r in runs if r['returncode'] != 0)),
+                f"{mean([r['wall_time_s'] for r in runs]):.1f}",
+                f"{mean([r['cpu_user_s'] + r['cpu_system_s'] for r in runs]):.1f}",
+                f"{max(r['peak_rss_mb'] for r in runs):.1f}",
+                f"{mean([r['disk_mb'] for r in runs]):.1f}",
+            ])
+        widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+        for row in rows:
+            print('  '.join(cell.ljust(width) for cell, width in zip(row, widths)))
+        print()
+
+    by_agent = defaultdict(list)
+    by_task = defaultdict(list)
+    by_sweep = defaultdict(list)
+    for r in records:
+        by_agent[(r['agent'], r['agent_version'])].append(r)
+        by_task[(r['task'], r['agent'], r['agent_version'])].append(r)
+        by_sweep[(r['sweep'], r['agent'], r['agent_version'])].append(r)
+
+    print_table("Per agent version:", ['agent', 'version'], by_agent)
+    print_table("Per task:", ['task', 'agent', 'version'], by_task)
+    print_table("Per sweep:", ['sweep', 'agent', 'version'], by_sweep)
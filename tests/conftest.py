@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The scripts at the root of the repository are not a package
+sys.path.insert(0, str(Path(__file__).parent.parent))
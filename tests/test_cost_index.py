@@ -0,0 +1,73 @@
+import json
+import os
+
+import cost_index
+from cost_index import JsonStringScanner, open_index, update_index
+
+
+def scan(text, chunk_size):
+    scanner = JsonStringScanner()
+    values = []
+    for i in range(0, len(text), chunk_size):
+        values += scanner.feed(text[i:i + chunk_size])
+    return values
+
+
+def test_scanner_yields_string_values_with_their_keys():
+    text = json.dumps({'requests': [{'message': {'text': 'hi'}, 'modelId': 'copilot/gpt-4o'},
+                                    {'response': [{'value': 'a'}, {'value': 'b'}]}],
+                       'version': 3})
+    assert scan(text, len(text)) == [(('requests', 'message', 'text'), 'hi'),
+                                     (('requests', 'modelId'), 'copilot/gpt-4o'),
+                                     (('requests', 'response', 'value'), 'a'),
+                                     (('requests', 'response', 'value'), 'b')]
+
+
+def test_scanner_does_not_depend_on_chunk_boundaries():
+    text = json.dumps({'a': ['quote " backslash \\ newline \n unicode é 😀', {'b': 'x,y:{z}'}]})
+    expected = scan(text, len(text))
+    assert expected[0][1].startswith('quote " backslash \\')
+    for chunk_size in [1, 2, 3, 7]:
+        assert scan(text, chunk_size) == expected
+
+
+def test_vscode_chat_counts_inputs_and_outputs():
+    chat = {'requests': [{'message': {'text': 'x' * 40},
+                          'modelId': 'copilot/claude-sonnet',
+                          'response': [{'value': 'y' * 80}]}]}
+    text = json.dumps(chat)
+    counts = cost_index.parse_vscode_chat([text[:10], text[10:]])
+    assert counts['model'] == 'claude-sonnet'
+    assert counts['input_tokens'] == cost_index.count_tokens('x' * 40)
+    assert counts['output_tokens'] == cost_index.count_tokens('y' * 80)
+
+
+def test_cursor_chat_splits_lines_across_chunks():
+    text = '_**User**_\nquestion\n_**Assistant**_\nanswer one\nanswer two'
+    counts = cost_index.parse_cursor_chat([text[:15], text[15:30], text[30:]])
+    assert counts['input_tokens'] == cost_index.count_tokens('question')
+    assert counts['output_tokens'] == cost_index.count_tokens('answer one') + cost_index.count_tokens('answer two')
+
+
+def test_index_only_reparses_changed_logs(tmp_path):
+    log = tmp_path/'debugging'/'task1'/'run_claude_20250101_000000'/'log.txt'
+    log.parent.mkdir(parents=True)
+    log.write_text('some output\n')
+    db = open_index(str(tmp_path/'index.sqlite'))
+
+    assert update_index(db, tmp_path) == (1, 1)
+    assert update_index(db, tmp_path) == (0, 1)
+
+    # Touched but identical: not parsed again
+    stat = log.stat()
+    os.utime(log, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert update_index(db, tmp_path) == (0, 1)
+
+    log.write_text('some other output\n')
+    assert update_index(db, tmp_path) == (1, 1)
+    scenario, editor, model = db.execute('SELECT scenario, editor, model FROM files').fetchone()
+    assert (scenario, editor, model) == ('debugging/task1', 'claude', 'default')
+
+    log.unlink()
+    assert update_index(db, tmp_path) == (0, 0)
+    assert db.execute('SELECT COUNT(*) FROM files').fetchone()[0] == 0